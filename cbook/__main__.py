@@ -1,13 +1,40 @@
-from options import OPTIONS
-from startup import setup, show_help, greet_user
-from input_handlers import ask_int
+from contextlib import nullcontext
+import os
+import sqlite3
+
+from commands import build_parser, run_command
+from sampler import sampling, settings
 
 
 def main():
+    # Running a non-interactive command if one is given
+    status = run_command()
+    if status is not None:
+        exit(status)
+
+    # Opening the contact book only for the interactive application,
+    # commands like `lookup` must work without it
+    from options import OPTIONS, dmgr
+    from startup import (
+        setup, show_help, greet_user, start_backups, start_instrumentation,
+        start_maintenance)
+    from input_handlers import ask_int
+    from replay import RECORD_ENV, ScriptRecorder
+
     # Setting up the configuration file
     setup()
     # Greeting the user
     greet_user()
+    # Starting the scheduled backups, if configured
+    start_backups(dmgr)
+    # Maintaining the book in the background while the app is idle
+    maintenance = start_maintenance(dmgr)
+    # Recording where the time goes, see the "Show performance stats"
+    # option
+    start_instrumentation(dmgr, OPTIONS)
+    # Recording the session as a script for `replay`, if asked to
+    recorder = ScriptRecorder(os.environ[RECORD_ENV]) \
+        if os.environ.get(RECORD_ENV) else None
     # Starting the main program
     keys = tuple(OPTIONS.keys())
     while True:
@@ -16,12 +43,31 @@ def main():
         i = ask_int("Choose an option: ", low=1, high=len(OPTIONS))
         selected_option = keys[i-1]
         func = OPTIONS[selected_option]
+        if maintenance:
+            maintenance.busy()
         try:
-            func()
+            with recorder.action(selected_option) if recorder \
+                    else nullcontext():
+                func()
         except KeyboardInterrupt:
             pass
+        except sqlite3.OperationalError as error:
+            # E.g. the book stayed locked by another connection for longer
+            # than the busy timeout, the user can simply try again
+            print(f"\nThe option couldn't complete, please try again:"
+                  f" {error}")
+        # Committing after every option, so that backups and other
+        # connections see the changes
+        dmgr.commit()
+        if maintenance:
+            maintenance.idle()
         print()
     
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Sampling the whole session if asked to, with `--sample FILE` or
+    # the `CBOOK_SAMPLE` environment variable
+    args = build_parser().parse_args()
+    path, interval = settings(args.sample, args.sample_interval)
+    with sampling(path, interval, args.sample_wall):
+        main()
\ No newline at end of file
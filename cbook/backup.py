@@ -0,0 +1,196 @@
+"""
+This module backs up and restores the contact book using SQLite's
+online backup API, the database is copied a few pages at a time so
+the application stays responsive while a backup is running
+"""
+from datetime import datetime
+import gzip
+from pathlib import Path
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional, Union
+
+from datamanager import DATA_PATH
+
+BACKUP_DIR = Path.home() / ".cbook_backups"
+BACKUP_PREFIX = "cbook-"
+# No. of pages copied in each step of the backup
+PAGES_PER_STEP = 256
+
+
+class BackupResult(NamedTuple):
+    """Details of a finished backup"""
+
+    path: Path
+    size: int           # Size of the database in bytes
+    elapsed: float      # Seconds spent copying the database
+
+    @property
+    def throughput(self) -> float:
+        """Speed of the backup in MB/s"""
+        return self.size / self.elapsed / 1e6 if self.elapsed else 0.0
+
+
+def _check_integrity(conn: sqlite3.Connection) -> None:
+    """Raises `sqlite3.DatabaseError` if the database of `conn` is
+    corrupt"""
+
+    result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    if result != "ok":
+        raise sqlite3.DatabaseError(f"Integrity check failed: {result}")
+
+
+def list_backups(backup_dir: Union[str, Path] = BACKUP_DIR) -> List[Path]:
+    """Returns the backups in `backup_dir`, newest first"""
+
+    backup_dir = Path(backup_dir)
+    if not backup_dir.exists():
+        return []
+    backups = [path for path in backup_dir.iterdir()
+               if path.name.startswith(BACKUP_PREFIX)]
+    return sorted(backups, key=lambda path: path.name, reverse=True)
+
+
+def backup_database(
+        source: Union[str, Path] = DATA_PATH,
+        backup_dir: Union[str, Path] = BACKUP_DIR,
+        compress: bool = True,
+        keep: Optional[int] = 7,
+        pages: int = PAGES_PER_STEP,
+        progress: Optional[Callable[[int, int], None]] = None
+        ) -> BackupResult:
+    """Backs up the database at `source` into `backup_dir`, verifies the
+    integrity of the copy and removes the oldest backups so that only
+    `keep` of them remain
+
+    :param source: Path of the contact book
+    :type source: Union[str, Path]
+    :param backup_dir: Directory where backups are stored
+    :type backup_dir: Union[str, Path]
+    :param compress: gzip the backup
+    :type compress: bool
+    :param keep: No. of backups to keep, all are kept if `None`
+    :type keep: Optional[int]
+    :param pages: No. of pages copied in each step
+    :type pages: int
+    :param progress: Called with the no. of remaining and total pages
+     after each step
+    :type progress: Optional[Callable[[int, int], None]]
+
+    :returns: Details of the backup
+    :rtype: BackupResult
+    """
+
+    backup_dir = Path(backup_dir)
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    path = backup_dir / f"{BACKUP_PREFIX}{stamp}.sqlite"
+    tmp_path = path.with_name(path.name + ".tmp")
+
+    def report(status, remaining, total):
+        if progress:
+            progress(remaining, total)
+
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(tmp_path)
+    try:
+        start = time.perf_counter()
+        # Other connections can read and write between the steps, the
+        # backup restarts by itself if they change the database
+        src.backup(dst, pages=pages, progress=report)
+        elapsed = time.perf_counter() - start
+        _check_integrity(dst)
+        size = dst.execute("PRAGMA page_count").fetchone()[0] \
+            * dst.execute("PRAGMA page_size").fetchone()[0]
+    except BaseException:
+        dst.close()
+        tmp_path.unlink()
+        raise
+    finally:
+        src.close()
+    dst.close()
+
+    if compress:
+        path = path.with_name(path.name + ".gz")
+        with tmp_path.open("rb") as raw, gzip.open(path, "wb") as packed:
+            shutil.copyfileobj(raw, packed)
+        tmp_path.unlink()
+    else:
+        tmp_path.replace(path)
+
+    if keep is not None:
+        for old in list_backups(backup_dir)[keep:]:
+            old.unlink()
+    return BackupResult(path, size, elapsed)
+
+
+def restore_database(
+        backup: Union[str, Path],
+        target: Union[str, Path] = DATA_PATH,
+        pages: int = PAGES_PER_STEP) -> BackupResult:
+    """Restores the backup at `backup` over the database at `target`,
+    the backup is checked for integrity before anything is overwritten
+
+    :param backup: Path of the backup, compressed or not
+    :type backup: Union[str, Path]
+    :param target: Path of the contact book to restore
+    :type target: Union[str, Path]
+
+    :returns: Details of the restore
+    :rtype: BackupResult
+    """
+
+    backup = Path(backup)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if backup.suffix == ".gz":
+            plain = Path(tmp_dir) / "restore.sqlite"
+            with gzip.open(backup, "rb") as packed, plain.open("wb") as raw:
+                shutil.copyfileobj(packed, raw)
+        else:
+            plain = backup
+
+        src = sqlite3.connect(plain)
+        dst = sqlite3.connect(target)
+        try:
+            _check_integrity(src)
+            size = src.execute("PRAGMA page_count").fetchone()[0] \
+                * src.execute("PRAGMA page_size").fetchone()[0]
+            start = time.perf_counter()
+            # Copying through the backup API instead of replacing the
+            # file keeps other open connections valid
+            src.backup(dst, pages=pages)
+            elapsed = time.perf_counter() - start
+        finally:
+            src.close()
+            dst.close()
+    return BackupResult(Path(target), size, elapsed)
+
+
+class BackupScheduler(threading.Thread):
+    """Backs up the contact book at `source` every `interval` seconds in
+    the background until `stop` is called"""
+
+    def __init__(self, source: Union[str, Path], interval: float,
+                 **backup_args):
+        super().__init__(daemon=True)
+        self.source = source
+        self.interval = interval
+        self.backup_args = backup_args
+        self.last_result: Optional[BackupResult] = None
+        self.last_error: Optional[Exception] = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.last_result = backup_database(self.source,
+                                                   **self.backup_args)
+                self.last_error = None
+            except (OSError, sqlite3.Error) as error:
+                self.last_error = error
+
+    def stop(self):
+        self._stopped.set()
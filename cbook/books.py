@@ -0,0 +1,157 @@
+"""
+This module searches across multiple contact books, either by fanning
+the query out to a pool of workers (one connection per book) or by
+attaching all the books to a single connection
+"""
+from concurrent.futures import (
+    Executor, ProcessPoolExecutor, ThreadPoolExecutor)
+import heapq
+from pathlib import Path
+import sqlite3
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config import get_books, open_book
+from datamanager import (
+    Contact, contact_columns, name_key, phone_key)
+
+# SQLite's default limit on the number of attached databases
+MAX_ATTACHED = 10
+
+
+class BookMatch(NamedTuple):
+    """A contact found in the book named `book`"""
+
+    book: str
+    contact: Contact
+
+
+def _sort_key(match: BookMatch) -> Tuple[str, str]:
+    # Same order as the `ORDER BY first_key, last_key` of each book
+    contact = match.contact
+    return name_key(contact.first_name), name_key(contact.last_name) or ""
+
+
+def _search_book(
+        book: str, path: Path, query: str,
+        by_phone: bool) -> Tuple[str, List[Contact], float]:
+    """Searches a single book, runs inside a worker of the pool"""
+
+    start = time.perf_counter()
+    dmgr = open_book(path)
+    if by_phone:
+        contacts = dmgr.fetch_by_phone_no(query)
+    else:
+        contacts = dmgr.fetch_by_name(query)
+    return book, contacts, time.perf_counter() - start
+
+
+def _select_books(names: Optional[List[str]]) -> Dict[str, Path]:
+    books = get_books()
+    if names is None:
+        return books
+    unknown = set(names) - set(books)
+    if unknown:
+        raise KeyError(f"Unknown books: {', '.join(sorted(unknown))}")
+    return {name: books[name] for name in names}
+
+
+def search_books(
+        query: str,
+        by_phone: bool = False,
+        books: Optional[List[str]] = None,
+        workers: Optional[int] = None,
+        processes: bool = False
+        ) -> Tuple[List[BookMatch], Dict[str, float]]:
+    """Searches the books named in `books` (all the configured books if
+    `None`) in parallel for contacts matching `query` by name, or by
+    phone no. if `by_phone` is `True`
+
+    :param query: Name or phone no. to search for
+    :type query: str
+    :param by_phone: Search by phone no. instead of name
+    :type by_phone: bool
+    :param books: Names of the books to search
+    :type books: Optional[List[str]]
+    :param workers: Maximum number of books searched at once
+    :type workers: Optional[int]
+    :param processes: Use a process pool instead of a thread pool, which
+     helps when building the contacts dominates the search
+    :type processes: bool
+
+    :returns: Matches from all the books in sorted order, and the time
+     taken (in seconds) to search each book
+    :rtype: Tuple[List[BookMatch], Dict[str, float]]
+    """
+
+    selected = _select_books(books)
+    pool: Executor
+    if processes:
+        pool = ProcessPoolExecutor(workers)
+    else:
+        pool = ThreadPoolExecutor(workers or len(selected) or 1)
+    with pool:
+        futures = [pool.submit(_search_book, name, path, query, by_phone)
+                   for name, path in selected.items()]
+        results = [future.result() for future in futures]
+
+    timings = {book: elapsed for book, _, elapsed in results}
+    # Each book's result is already sorted, so they only need merging
+    matches = heapq.merge(
+        *([BookMatch(book, c) for c in contacts]
+          for book, contacts, _ in results),
+        key=_sort_key)
+    return list(matches), timings
+
+
+def attach_search(
+        query: str,
+        by_phone: bool = False,
+        books: Optional[List[str]] = None
+        ) -> Tuple[List[BookMatch], float]:
+    """Searches the books by attaching them all to one connection and
+    running a single `UNION ALL` query, which avoids the pool overhead
+    for a small number of books. Phone numbers match either exactly or
+    as a part of a stored number
+
+    :returns: Matches from all the books in sorted order, and the total
+     time taken (in seconds)
+    :rtype: Tuple[List[BookMatch], float]
+    """
+
+    selected = _select_books(books)
+    if len(selected) > MAX_ATTACHED:
+        raise ValueError(
+            f"Can't attach more than {MAX_ATTACHED} books, use"
+            " `search_books` instead")
+
+    start = time.perf_counter()
+    names = list(selected)
+    conn = sqlite3.connect(":memory:")
+    selects = []
+    params: list = []
+    for i, name in enumerate(names):
+        schema = f"book{i}"
+        # Opening each book once brings its schema up to date
+        open_book(selected[name])
+        conn.execute("ATTACH DATABASE ? AS " + schema,
+                     (str(selected[name]),))
+        if by_phone:
+            where = f"""id IN (SELECT c_id FROM {schema}.Phones
+                    WHERE number_key = ? OR number LIKE ?)"""
+            params.extend((phone_key(query), f"%{query}%"))
+        else:
+            where = "first_key LIKE ? OR last_key LIKE ?"
+            key = name_key(query)
+            params.extend((f"%{key}%", f"%{key}%"))
+        selects.append(f"""
+            SELECT {i}, first_key, last_key, {contact_columns(schema)}
+            FROM {schema}.Contacts AS Contacts WHERE {where}""")
+    sql = " UNION ALL ".join(selects) + " ORDER BY 2, 3"
+
+    matches = []
+    if selects:
+        for book_no, _, _, *row in conn.execute(sql, params):
+            matches.append(BookMatch(names[book_no], Contact(*row)))
+    conn.close()
+    return matches, time.perf_counter() - start
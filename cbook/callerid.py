@@ -0,0 +1,367 @@
+"""
+This module contains the caller-ID daemon, a long running process
+which resolves phone numbers to contact names over a Unix domain
+socket, along with a client and a load test for it
+
+The protocol is line based, the client sends a phone no. followed by a
+newline and the daemon replies with `<id>\\t<name>` or an empty line if
+the number is unknown
+"""
+from collections import Counter
+import errno
+from pathlib import Path
+import random
+import socket
+import socketserver
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from config import open_book
+from datamanager import Change, DataManager, phone_key
+
+DEFAULT_SOCKET = Path.home() / ".cbook_callerid.sock"
+
+
+def _full_name(first_name: str, last_name: Optional[str]) -> str:
+    return f"{first_name} {last_name}" if last_name else first_name
+
+
+class NumberIndex:
+    """An in-memory map from phone no. keys to (contact id, name), built
+    from the Phones table once and then kept up to date from the change
+    log, so a refresh only reads the changes made since the previous one
+
+    Each entry of the map is replaced at once, but lookups made while a
+    refresh runs can see some of its changes and not the others yet"""
+
+    def __init__(self, db_path: Union[str, Path, None] = None):
+        self.db_path = db_path
+        self._map: Dict[str, Tuple[int, str]] = dict()
+        # keys: phone no. key, values: no. of numbers with this key by
+        # contact id, the same key can be stored under different kinds
+        self._owners: Dict[str, Counter] = dict()
+        # keys: contact id, values: no. of numbers by key
+        self._keys: Dict[int, Counter] = dict()
+        # keys: contact id, values: full name
+        self._names: Dict[int, str] = dict()
+        self._dmgr: Optional[DataManager] = None
+        # SQLite's data version and the change log version seen last
+        self._version: Optional[int] = None
+        self._change: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._map)
+
+    def refresh(self) -> bool:
+        """Brings the map up to date if the database has changed since
+        the last refresh, returns `True` if it had changed. The map is
+        rebuilt from scratch the first time, or if the changes since the
+        last refresh have been compacted away
+
+        Must always be called from the same thread, as the connection
+        to the database is opened by the first call"""
+
+        if self._dmgr is None:
+            self._dmgr = open_book(self.db_path)
+        version = self._dmgr.data_version()
+        if version == self._version:
+            return False
+
+        if self._change is None:
+            self._rebuild()
+        else:
+            try:
+                changes = list(self._dmgr.iter_changes(self._change))
+            except ValueError:
+                self._rebuild()
+            else:
+                self._apply(changes)
+        self._version = version
+        return True
+
+    def _rebuild(self) -> None:
+        # Read before the numbers, so changes made in between are applied
+        # again by the next refresh, which is harmless
+        change = self._dmgr.change_version()  # type: ignore[union-attr]
+        new_map = dict()
+        owners: Dict[str, Counter] = dict()
+        keys: Dict[int, Counter] = dict()
+        names = dict()
+        for key, cid, first_name, last_name in \
+                self._dmgr.fetch_caller_ids():  # type: ignore[union-attr]
+            names[cid] = _full_name(first_name, last_name)
+            owners.setdefault(key, Counter())[cid] += 1
+            keys.setdefault(cid, Counter())[key] += 1
+            new_map[key] = (cid, names[cid])
+        # Swapping the reference, so lookups never see a partial map
+        self._map = new_map
+        self._owners, self._keys, self._names = owners, keys, names
+        self._change = change
+
+    def _apply(self, changes: List[Change]) -> None:
+        for change in changes:
+            if change.table == "Contacts":
+                cid = change.key["id"]
+                if change.op == "delete":
+                    self._names.pop(cid, None)
+                else:
+                    data = change.data or dict()
+                    self._names[cid] = _full_name(data["first_name"],
+                                                  data["last_name"])
+                    for key in self._keys.get(cid, ()):
+                        if self._map.get(key, (None,))[0] == cid:
+                            self._map[key] = (cid, self._names[cid])
+            elif change.table == "Phones" and change.op != "update":
+                key, cid = change.key["number_key"], change.key["c_id"]
+                owners = self._owners.setdefault(key, Counter())
+                keys = self._keys.setdefault(cid, Counter())
+                step = 1 if change.op == "insert" else -1
+                owners[cid] += step
+                keys[key] += step
+                # Counters keep the keys of their removed items
+                for counter, item in ((owners, cid), (keys, key)):
+                    if counter[item] <= 0:
+                        del counter[item]
+                self._point(key)
+            self._change = change.version
+
+    def _point(self, key: str) -> None:
+        """Points `key` at one of the contacts with a number of this key,
+        keeping the current one if it still has one"""
+
+        owners = self._owners.get(key)
+        if not owners:
+            self._owners.pop(key, None)
+            self._map.pop(key, None)
+            return
+        current = self._map.get(key)
+        if current is not None and current[0] in owners:
+            return
+        cid = next(iter(owners))
+        if cid not in self._names:
+            contact = self._dmgr.get_contact(cid)  # type: ignore[union-attr]
+            self._names[cid] = _full_name(contact.first_name,
+                                          contact.last_name) \
+                if contact else ""
+        self._map[key] = (cid, self._names[cid])
+
+    def close(self):
+        """Closes the connection to the database, must be called from
+        the thread which refreshes the map"""
+
+        self._dmgr = None
+        self._version = None
+        self._change = None
+
+    def lookup(self, number: str) -> Optional[Tuple[int, str]]:
+        """Returns the (id, name) of the contact owning `number` or
+        `None` if no contact has this number"""
+
+        key = phone_key(number)
+        if key is None:
+            return None
+        return self._map.get(key)
+
+
+class _LookupHandler(socketserver.StreamRequestHandler):
+    """Answers the lookups of a single client connection"""
+
+    def handle(self):
+        index = self.server.index  # type: ignore[attr-defined]
+        for line in self.rfile:
+            result = index.lookup(line.decode().strip())
+            if result:
+                reply = f"{result[0]}\t{result[1]}\n"
+            else:
+                reply = "\n"
+            self.wfile.write(reply.encode())
+
+
+def _listening(socket_path: Path) -> bool:
+    """Whether a process accepts connections on the socket `socket_path`,
+    a socket left behind by a daemon that died refuses them"""
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+    return True
+
+
+class CallerIDServer(
+        socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves lookups from a `NumberIndex`, refreshing it every
+    `refresh_interval` seconds in a background thread
+
+    The error of a failed first refresh is raised by the constructor,
+    later failures (e.g. while the database is locked) are reported on
+    stderr and the refresh is retried, lookups are answered from the
+    map as it was meanwhile"""
+
+    daemon_threads = True
+
+    def __init__(
+            self,
+            socket_path: Union[str, Path] = DEFAULT_SOCKET,
+            db_path: Union[str, Path, None] = None,
+            refresh_interval: float = 1.0):
+
+        self.socket_path = Path(socket_path)
+        if self.socket_path.exists():
+            if _listening(self.socket_path):
+                raise OSError(errno.EADDRINUSE, "A caller-ID daemon is"
+                              f" already listening on {self.socket_path}")
+            # Removing the socket left behind by a previous run
+            self.socket_path.unlink()
+        super().__init__(str(self.socket_path), _LookupHandler)
+        self.index = NumberIndex(db_path)
+        self.refresh_interval = refresh_interval
+        # Error of the last refresh, `None` if it succeeded
+        self.last_error: Optional[Exception] = None
+        self._stopped = threading.Event()
+        self._loaded = threading.Event()
+        self._refresher = threading.Thread(
+            target=self._refresh_loop, daemon=True)
+        self._refresher.start()
+        self._loaded.wait()
+        if self.last_error is not None:
+            self.server_close()
+            raise self.last_error
+
+    def _refresh_loop(self):
+        try:
+            self.index.refresh()
+        except Exception as error:
+            # Raised by the constructor
+            self.last_error = error
+            self._loaded.set()
+            return
+        self._loaded.set()
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.index.refresh()
+                self.last_error = None
+            except sqlite3.Error as error:
+                self.last_error = error
+                print(f"Refreshing the caller-ID map failed, retrying in"
+                      f" {self.refresh_interval}s: {error}", file=sys.stderr)
+        self.index.close()
+
+    def server_close(self):
+        self._stopped.set()
+        self._refresher.join()
+        super().server_close()
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+
+class CallerIDClient:
+    """A client keeping a single connection to the caller-ID daemon"""
+
+    def __init__(self, socket_path: Union[str, Path] = DEFAULT_SOCKET):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(str(socket_path))
+        self._file = self._sock.makefile("rwb", buffering=0)
+
+    def lookup(self, number: str) -> Optional[Tuple[int, str]]:
+        """Returns the (id, name) of the contact owning `number` or
+        `None` if the number is unknown"""
+
+        # Newlines would split the request into two lookups
+        number = number.replace("\n", "")
+        self._file.write(f"{number}\n".encode())
+        reply = self._file.readline().decode().rstrip("\n")
+        if not reply:
+            return None
+        cid, name = reply.split("\t", 1)
+        return int(cid), name
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def serve(
+        socket_path: Union[str, Path] = DEFAULT_SOCKET,
+        db_path: Union[str, Path, None] = None,
+        refresh_interval: float = 1.0) -> None:
+    """Runs the caller-ID daemon until interrupted"""
+
+    with CallerIDServer(socket_path, db_path, refresh_interval) as server:
+        print(f"Loaded {len(server.index)} numbers,"
+              f" listening on {server.socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def load_test(
+        socket_path: Union[str, Path] = DEFAULT_SOCKET,
+        db_path: Union[str, Path, None] = None,
+        requests: int = 10000,
+        clients: int = 4,
+        miss_ratio: float = 0.1) -> Dict[str, float]:
+    """Fires `requests` lookups at a running daemon from `clients`
+    concurrent connections, a `miss_ratio` fraction of them for unknown
+    numbers, and returns the latency percentiles (in milliseconds), the
+    throughput (lookups per second) and the no. of clients that failed"""
+
+    numbers = [row[0] for row in open_book(db_path).fetch_caller_ids()]
+    per_client = max(requests // clients, 1)
+    latencies: List[float] = []
+    failures: List[OSError] = []
+    lock = threading.Lock()
+
+    def run_client():
+        samples = []
+        try:
+            with CallerIDClient(socket_path) as client:
+                for _ in range(per_client):
+                    if numbers and random.random() >= miss_ratio:
+                        number = random.choice(numbers)
+                    else:
+                        number = str(random.randrange(10**11, 10**12))
+                    start = time.perf_counter()
+                    client.lookup(number)
+                    samples.append(time.perf_counter() - start)
+        except OSError as error:
+            # The lookups made before are still counted
+            with lock:
+                failures.append(error)
+        with lock:
+            latencies.extend(samples)
+
+    threads = [threading.Thread(target=run_client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if len(latencies) >= 2:
+        cuts = statistics.quantiles(latencies, n=100)
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        # `quantiles` needs two samples, a single one is every percentile
+        p50 = p95 = p99 = latencies[0] if latencies else 0.0
+    return {
+        "requests": len(latencies),
+        "failed_clients": len(failures),
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "p99_ms": p99 * 1000,
+        "throughput": len(latencies) / elapsed,
+    }
@@ -0,0 +1,605 @@
+"""
+This module contains the non-interactive commands of the application,
+which are run as `python cbook <command> [arguments]`
+"""
+import argparse
+import time
+from typing import List, Optional
+
+COMMANDS = dict()   # keys: command name, values: function responsible
+
+
+def callerid(args: argparse.Namespace) -> int:
+    """Runs the caller-ID daemon or talks to a running one"""
+
+    import sys
+    import callerid as cid
+
+    socket_path = args.socket or cid.DEFAULT_SOCKET
+    if args.action == "serve":
+        try:
+            cid.serve(socket_path, args.db, args.refresh)
+        except OSError as error:
+            print(error, file=sys.stderr)
+            return 1
+    elif args.action == "lookup":
+        with cid.CallerIDClient(socket_path) as client:
+            for number in args.numbers:
+                result = client.lookup(number)
+                print(number, result[1] if result else "Unknown", sep="\t")
+    else:
+        stats = cid.load_test(socket_path, args.db, args.requests,
+                              args.clients)
+        print(f"{stats['requests']} lookups,"
+              f" {stats['throughput']:.0f} lookups/s")
+        print(f"p50: {stats['p50_ms']:.3f} ms,"
+              f" p95: {stats['p95_ms']:.3f} ms,"
+              f" p99: {stats['p99_ms']:.3f} ms")
+        if stats["failed_clients"]:
+            print(f"{stats['failed_clients']} of {args.clients} clients"
+                  f" failed to talk to the daemon at {socket_path}")
+            return 1
+    return 0
+
+
+def compile_book(args: argparse.Namespace) -> int:
+    """Compiles the contact book into a read-only lookup snapshot"""
+
+    from config import open_book
+    import snapshot
+
+    output = args.output or snapshot.SNAPSHOT_PATH
+    start = time.perf_counter()
+    count = snapshot.compile_snapshot(open_book(args.db), output)
+    elapsed = time.perf_counter() - start
+    print(f"Compiled {count} contacts into {output} in {elapsed:.3f}s")
+    return 0
+
+
+def lookup(args: argparse.Namespace) -> int:
+    """Looks up contacts by name or phone no. in a compiled snapshot"""
+
+    from data_display import format_for_display, display_table
+    import snapshot
+
+    start = time.perf_counter()
+    with snapshot.SnapshotReader(args.snapshot or snapshot.SNAPSHOT_PATH) \
+            as reader:
+        if args.phone:
+            data = reader.fetch_by_phone_no(args.query)
+        else:
+            data = reader.fetch_by_name(args.query)
+        elapsed = time.perf_counter() - start
+        display_table(format_for_display(data))
+    print(f"\nFound {len(data)} contacts in {elapsed * 1000:.3f} ms")
+    return 0
+
+
+def counters(args: argparse.Namespace) -> int:
+    """Shows, checks or rebuilds the stored contact counters"""
+
+    from config import open_book
+
+    dmgr = open_book(args.db)
+    if args.rebuild:
+        dmgr.rebuild_counters()
+        print("Counters rebuilt")
+    if args.check:
+        mismatches = dmgr.check_counters()
+        for name, key, stored, actual in mismatches:
+            print(f"{name} {key!r}: stored {stored}, actual {actual}")
+        print(f"Found {len(mismatches)} inconsistent counters")
+        return 1 if mismatches else 0
+
+    print(f"Contacts: {dmgr.get_contact_count()}")
+    for code, count in dmgr.get_country_code_counts():
+        print(f"Country code +{code}: {count}" if code
+              else f"No country code: {count}")
+    return 0
+
+
+def search(args: argparse.Namespace) -> int:
+    """Searches for contacts across multiple contact books"""
+
+    import books
+    from data_display import format_for_display, display_table
+
+    names = args.books.split(",") if args.books else None
+    if args.attach:
+        matches, elapsed = books.attach_search(args.query, args.phone, names)
+        timings = {"all books (attached)": elapsed}
+    else:
+        matches, timings = books.search_books(
+            args.query, args.phone, names, args.workers, args.processes)
+
+    tb_data = format_for_display([match.contact for match in matches])
+    for row, match in zip(tb_data, matches):
+        row["Book"] = match.book
+    display_table(tb_data)
+    print(f"\nFound {len(matches)} contacts")
+    for book, elapsed in timings.items():
+        print(f"{book}: {elapsed * 1000:.3f} ms")
+    return 0
+
+
+def backup(args: argparse.Namespace) -> int:
+    """Backs up the contact book or lists the existing backups"""
+
+    import backup as bk
+    from datamanager import DATA_PATH
+
+    backup_dir = args.dir or bk.BACKUP_DIR
+    if args.list:
+        for path in bk.list_backups(backup_dir):
+            print(path)
+        return 0
+
+    result = bk.backup_database(
+        args.db or DATA_PATH, backup_dir, not args.no_compress,
+        args.keep, args.pages)
+    print(f"Backed up {result.size / 1e6:.2f} MB to {result.path}")
+    print(f"Took {result.elapsed:.3f}s ({result.throughput:.1f} MB/s)")
+    return 0
+
+
+def restore(args: argparse.Namespace) -> int:
+    """Restores the contact book from a backup"""
+
+    import backup as bk
+    from datamanager import DATA_PATH
+
+    result = bk.restore_database(args.backup, args.db or DATA_PATH)
+    print(f"Restored {result.size / 1e6:.2f} MB into {result.path}")
+    print(f"Took {result.elapsed:.3f}s ({result.throughput:.1f} MB/s)")
+    return 0
+
+
+def profile(args: argparse.Namespace) -> int:
+    """Reports the effective storage settings and, optionally, how each
+    storage profile performs on the contact book"""
+
+    from tabulate import tabulate
+    from config import get_storage_settings
+    from datamanager import DATA_PATH, DataManager
+    import tuning
+
+    db_path = args.db or DATA_PATH
+    requested = get_storage_settings()
+    effective = DataManager(db_path, settings=requested).effective_settings()
+    table = [(name, requested.get(name, ""), value)
+             for name, value in effective.items()]
+    print(tabulate(table, headers=["Setting", "Configured", "Effective"],
+                   tablefmt="simple_grid"))
+
+    reports = []
+    if args.benchmark:
+        reports.append(("profile", tuning.benchmark_profiles(
+            db_path, lookups=args.lookups, inserts=args.inserts)))
+    if args.backends:
+        reports.append(("backend", tuning.benchmark_backends(
+            db_path, lookups=args.lookups, inserts=args.inserts)))
+    for kind, results in reports:
+        table = [[name] + [f"{timings[op] * 1000:.1f}"
+                           for op in tuning.OPERATIONS]
+                 for name, timings in results.items()]
+        print(f"\nTime taken (ms) by each {kind}")
+        print(tabulate(table,
+                       headers=[kind.capitalize(), *tuning.OPERATIONS],
+                       tablefmt="simple_grid"))
+    return 0
+
+
+def filter_contacts(args: argparse.Namespace) -> int:
+    """Searches the contact book with a filter, or shows how SQLite
+    would run it"""
+
+    import sys
+    from config import open_book
+    from data_display import format_for_display, display_table
+    import query
+
+    dmgr = open_book(args.db)
+    try:
+        if args.explain:
+            node = query.parse(args.filter)
+            condition, params = query.compile_filter(node)
+            print(node)
+            print(f"WHERE {condition}")
+            print(f"Parameters: {params}")
+            print("\n".join(query.explain(dmgr, args.filter)))
+            return 0
+        start = time.perf_counter()
+        data = query.search(dmgr, args.filter, args.limit)
+        elapsed = time.perf_counter() - start
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    display_table(format_for_display(data))
+    print(f"\nFound {len(data)} contacts in {elapsed * 1000:.3f} ms")
+    return 0
+
+
+def batch_edit(args: argparse.Namespace) -> int:
+    """Changes all the contacts matching a filter at once"""
+
+    import sys
+    from config import open_book
+    import query
+
+    dmgr = open_book(args.db)
+    try:
+        if args.country_code:
+            count = query.add_country_code(dmgr, args.filter,
+                                           args.country_code, args.dry_run)
+            what = "phone numbers"
+        else:
+            field, _, value = args.set.partition("=")
+            count = query.update(dmgr, args.filter, field, value or None,
+                                 args.dry_run)
+            what = "contacts"
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    dmgr.commit()
+    action = "Would change" if args.dry_run else "Changed"
+    print(f"{action} {count} {what}")
+    return 0
+
+
+def delete(args: argparse.Namespace) -> int:
+    """Deletes many contacts, or a large group, in chunks"""
+
+    import sys
+    from config import open_book
+    import query
+
+    def report(done: int, total: int) -> None:
+        print(f"\r{done}/{total}", end="", file=sys.stderr)
+
+    dmgr = open_book(args.db)
+    start = time.perf_counter()
+    try:
+        if args.group is not None:
+            if args.dry_run:
+                count = dmgr.get_group_size(args.group)
+            else:
+                count = dmgr.delete_group_in_chunks(args.group, args.chunk,
+                                                    report)
+            what = "members removed from the group"
+        elif args.ids:
+            ids = [int(cid) for cid in args.ids.split(",")]
+            count = len(ids) if args.dry_run else \
+                dmgr.delete_contacts(ids, args.chunk, report, args.trash)
+            what = "contacts deleted"
+        else:
+            count = query.delete(dmgr, args.filter, args.dry_run, report,
+                                 args.trash)
+            what = "contacts deleted"
+        if args.trash and args.group is None:
+            what = "contacts moved to the trash"
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    if not args.dry_run:
+        print(file=sys.stderr)
+    prefix = "Would be: " if args.dry_run else ""
+    print(f"{prefix}{count} {what} in {elapsed:.3f}s")
+    return 0
+
+
+def maintain(args: argparse.Namespace) -> int:
+    """Purges the trash, refreshes the query planner's statistics and
+    shrinks the database file"""
+
+    import sys
+    from config import open_book
+    from maintenance import maintain as run_maintenance
+
+    def report(done: int, total: int) -> None:
+        print(f"\rPurged {done}/{total}", end="", file=sys.stderr)
+
+    dmgr = open_book(args.db)
+    size = dmgr.page_stats()
+    result = run_maintenance(dmgr, args.trash_days, not args.no_vacuum,
+                             report)
+    if result.purged:
+        print(file=sys.stderr)
+    print(f"Purged {result.purged} contacts from the trash")
+    print(f"Reclaimed {result.reclaimed / 1024:.1f} KiB of"
+          f" {size[0] * size[2] / 1024:.1f} KiB")
+    for step, seconds in result.timings.items():
+        print(f"{step:<10}{seconds:.3f}s")
+    print(f"Took {result.elapsed:.3f}s")
+    return 0
+
+
+def replay(args: argparse.Namespace) -> int:
+    """Replays a script of menu actions on synthetic books of several
+    sizes and reports the latency of each action"""
+
+    import sys
+    from tabulate import tabulate
+    from replay import DEFAULT_SCRIPT, ScriptError, load_test, load_script, \
+        parse_script
+
+    actions = load_script(args.script) if args.script \
+        else parse_script(DEFAULT_SCRIPT)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    try:
+        results = load_test(actions, sizes, args.backend, args.repeat)
+    except ScriptError as error:
+        print(error, file=sys.stderr)
+        return 1
+    for size, stats in results.items():
+        print(f"{size} contacts ({args.backend}, {args.repeat} runs)")
+        print(tabulate(
+            [(name.split(":", 1)[1], summary["count"],
+              *(summary[column] * 1000 for column in ("p50", "p95", "max")))
+             for name, summary in stats.rows()],
+            headers=["Action", "Runs", "p50 ms", "p95 ms", "Max ms"],
+            floatfmt=".3f"))
+        print()
+    return 0
+
+
+def changes(args: argparse.Namespace) -> int:
+    """Streams the changes made to the contact book since a version as
+    JSON lines, or compacts the change log"""
+
+    import json
+    import sys
+    from config import open_book
+
+    dmgr = open_book(args.db)
+    if args.compact:
+        dropped = dmgr.compact_changes(args.upto)
+        dmgr.commit()
+        print(f"Dropped {dropped} entries from the change log")
+        return 0
+    if args.current:
+        print(dmgr.change_version())
+        return 0
+
+    try:
+        for change in dmgr.iter_changes(args.since):
+            print(json.dumps(change._asdict()))
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    return 0
+
+
+def sync(args: argparse.Namespace) -> int:
+    """Syncs the contact book with another copy of it both ways"""
+
+    from datamanager import DATA_PATH
+    from sync import sync_books
+
+    result = sync_books(args.db or DATA_PATH, args.other, args.dry_run)
+    action = "Would sync" if args.dry_run else "Synced"
+    print(f"{action} {result.to_local} contacts into this book and"
+          f" {result.to_remote} into {args.other}")
+    if result.rekeyed:
+        print(f"{result.rekeyed} contacts created in both books under the"
+              f" same id were given new ids")
+    print(f"Compared {result.ranges} ranges and {result.differing}"
+          f" differing contacts in {result.elapsed:.3f}s")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Builds the argument parser for all the commands"""
+
+    parser = argparse.ArgumentParser(
+        prog="cbook",
+        description="Manage your contacts, run without a command to"
+                    " start the interactive application")
+    parser.add_argument("--sample", metavar="FILE", default=None,
+                        help="Profile the session by sampling its stacks and"
+                             " write them to FILE as collapsed stacks for"
+                             " flamegraph tools")
+    parser.add_argument("--sample-interval", metavar="MS", type=float,
+                        default=None, help="Milliseconds between samples")
+    parser.add_argument("--sample-wall", action="store_true",
+                        help="Sample wall clock time, including the time"
+                             " spent waiting for input, instead of CPU time")
+    subparsers = parser.add_subparsers(dest="command")
+
+    sub = subparsers.add_parser(
+        "callerid", help="Resolve phone numbers to names over a socket")
+    sub.add_argument("action", choices=("serve", "lookup", "loadtest"))
+    sub.add_argument("numbers", nargs="*", help="Numbers to look up")
+    sub.add_argument("--socket", default=None,
+                     help="Path of the Unix socket")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+    sub.add_argument("--refresh", type=float, default=1.0,
+                     help="Seconds between checks for database changes")
+    sub.add_argument("--requests", type=int, default=10000,
+                     help="Number of lookups made by the load test")
+    sub.add_argument("--clients", type=int, default=4,
+                     help="Concurrent connections used by the load test")
+
+    sub = subparsers.add_parser(
+        "compile", help="Compile the book into a read-only lookup snapshot")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+    sub.add_argument("--output", default=None,
+                     help="Path of the snapshot to write")
+
+    sub = subparsers.add_parser(
+        "lookup", help="Look up contacts in a compiled snapshot")
+    sub.add_argument("query", help="Name or phone no. to look for")
+    sub.add_argument("--phone", action="store_true",
+                     help="Look up by phone no. instead of name")
+    sub.add_argument("--snapshot", default=None,
+                     help="Path of the snapshot to read")
+
+    sub = subparsers.add_parser(
+        "counters", help="Show, check or rebuild the contact counters")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+    sub.add_argument("--check", action="store_true",
+                     help="Compare the counters with the actual counts")
+    sub.add_argument("--rebuild", action="store_true",
+                     help="Recompute the counters from the data")
+
+    sub = subparsers.add_parser(
+        "search", help="Search for contacts across multiple books")
+    sub.add_argument("query", help="Name or phone no. to search for")
+    sub.add_argument("--phone", action="store_true",
+                     help="Search by phone no. instead of name")
+    sub.add_argument("--books", default=None,
+                     help="Comma separated names of the books to search"
+                          " (default: all of them)")
+    sub.add_argument("--attach", action="store_true",
+                     help="Attach the books to a single connection instead"
+                          " of searching them in parallel")
+    sub.add_argument("--workers", type=int, default=None,
+                     help="Maximum number of books searched at once")
+    sub.add_argument("--processes", action="store_true",
+                     help="Search using processes instead of threads")
+
+    sub = subparsers.add_parser("backup", help="Back up the contact book")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+    sub.add_argument("--dir", default=None,
+                     help="Directory where backups are stored")
+    sub.add_argument("--keep", type=int, default=7,
+                     help="No. of backups to keep")
+    sub.add_argument("--pages", type=int, default=256,
+                     help="No. of pages copied in each step")
+    sub.add_argument("--no-compress", action="store_true",
+                     help="Don't gzip the backup")
+    sub.add_argument("--list", action="store_true",
+                     help="List the existing backups")
+
+    sub = subparsers.add_parser(
+        "restore", help="Restore the contact book from a backup")
+    sub.add_argument("backup", help="Path of the backup")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+
+    sub = subparsers.add_parser(
+        "profile", help="Report the storage settings and benchmark them")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+    sub.add_argument("--benchmark", action="store_true",
+                     help="Measure every profile on a copy of the book")
+    sub.add_argument("--backends", action="store_true",
+                     help="Measure the in-memory backends on the contacts"
+                          " of the book")
+    sub.add_argument("--lookups", type=int, default=100,
+                     help="No. of searches and lookups measured")
+    sub.add_argument("--inserts", type=int, default=1000,
+                     help="No. of contacts inserted in bulk")
+
+    sub = subparsers.add_parser(
+        "filter", help="Search contacts with a filter, e.g."
+                       " 'name:raj group:Work added>2023-01 -email:null'")
+    sub.add_argument("filter", help="The filter")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+    sub.add_argument("--limit", type=int, default=None,
+                     help="Maximum no. of contacts shown")
+    sub.add_argument("--explain", action="store_true",
+                     help="Show the compiled SQL and its query plan instead"
+                          " of searching")
+
+    sub = subparsers.add_parser(
+        "batch-edit", help="Change all the contacts matching a filter")
+    sub.add_argument("filter", help="The filter, as for the filter command")
+    change = sub.add_mutually_exclusive_group(required=True)
+    change.add_argument("--set", metavar="FIELD=VALUE",
+                        help="Set a field (first_name, last_name, email or"
+                             " address), an empty value clears it")
+    change.add_argument("--country-code", metavar="CODE",
+                        help="Add a country code to the numbers without one")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+    sub.add_argument("--dry-run", action="store_true",
+                     help="Only count what would be changed")
+
+    sub = subparsers.add_parser(
+        "delete", help="Delete many contacts or a large group in chunks")
+    target = sub.add_mutually_exclusive_group(required=True)
+    target.add_argument("--filter", help="Delete the contacts matching a"
+                                         " filter, as for the filter command")
+    target.add_argument("--ids", help="Delete the contacts with these"
+                                      " comma separated ids")
+    target.add_argument("--group", type=int, default=None,
+                        help="Delete the group with this id, but not its"
+                             " contacts")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+    sub.add_argument("--chunk", type=int, default=1000,
+                     help="No. of rows deleted per transaction")
+    sub.add_argument("--dry-run", action="store_true",
+                     help="Only count what would be deleted")
+    sub.add_argument("--trash", action="store_true",
+                     help="Move the contacts to the trash instead, from"
+                          " where they can be restored")
+
+    sub = subparsers.add_parser(
+        "maintain", help="Purge the trash, optimize and shrink the book")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+    sub.add_argument("--trash-days", type=int, default=30,
+                     help="Purge the contacts deleted more than this many"
+                          " days ago, 0 empties the trash")
+    sub.add_argument("--no-vacuum", action="store_true",
+                     help="Don't give the unused space back to the file"
+                          " system")
+
+    sub = subparsers.add_parser(
+        "replay", help="Measure the latency of scripted menu actions on"
+                       " synthetic books")
+    sub.add_argument("script", nargs="?", default=None,
+                     help="Script to replay, e.g. one recorded with"
+                          " CBOOK_RECORD (default: a built-in one)")
+    sub.add_argument("--sizes", default="1000,10000,100000",
+                     help="Comma separated sizes of the synthetic books")
+    sub.add_argument("--backend", choices=("sqlite", "memory"),
+                     default="sqlite", help="Backend of the synthetic books")
+    sub.add_argument("--repeat", type=int, default=3,
+                     help="No. of times the script is replayed per size")
+
+    sub = subparsers.add_parser(
+        "changes", help="Export the changes made since a version")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+    sub.add_argument("--since", type=int, default=0,
+                     help="Version of the last change already exported")
+    sub.add_argument("--current", action="store_true",
+                     help="Print the version of the latest change")
+    sub.add_argument("--compact", action="store_true",
+                     help="Drop superseded entries from the change log")
+    sub.add_argument("--upto", type=int, default=None,
+                     help="With --compact, also drop all the entries up to"
+                          " this version")
+
+    sub = subparsers.add_parser(
+        "sync", help="Sync the contact book with another copy of it")
+    sub.add_argument("other", help="Path of the other copy")
+    sub.add_argument("--db", default=None, help="Path of the contact book")
+    sub.add_argument("--dry-run", action="store_true",
+                     help="Only report what would be synced")
+    return parser
+
+
+def run_command(argv: Optional[List[str]] = None) -> Optional[int]:
+    """Parses `argv` and runs the given command, returns its exit status
+    or `None` if no command was given"""
+
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        return None
+    return COMMANDS[args.command](args)
+
+
+# Registering all the commands
+COMMANDS["callerid"] = callerid
+COMMANDS["compile"] = compile_book
+COMMANDS["lookup"] = lookup
+COMMANDS["counters"] = counters
+COMMANDS["search"] = search
+COMMANDS["backup"] = backup
+COMMANDS["restore"] = restore
+COMMANDS["profile"] = profile
+COMMANDS["filter"] = filter_contacts
+COMMANDS["batch-edit"] = batch_edit
+COMMANDS["delete"] = delete
+COMMANDS["maintain"] = maintain
+COMMANDS["replay"] = replay
+COMMANDS["changes"] = changes
+COMMANDS["sync"] = sync
@@ -0,0 +1,104 @@
+"""
+This module contains helpers for reading the configuration file
+created by `startup.setup`
+"""
+import configparser as cfg
+import os
+from pathlib import Path
+from typing import Dict, Union
+
+from datamanager import (
+    DATA_PATH, STORAGE_PRAGMAS, DataManager, StorageBackend,
+    storage_settings)
+
+CONF_PATH = Path.home() / ".cbook_conf.ini"
+
+# Name of the book stored at `DATA_PATH`
+DEFAULT_BOOK = "default"
+
+# Storage backends which can be chosen by `open_storage`
+BACKENDS = ("sqlite", "sqlite-memory", "memory")
+# Environment variable overriding the configured backend
+BACKEND_ENV = "CBOOK_BACKEND"
+
+
+def load_config() -> cfg.ConfigParser:
+    """Reads and returns the configuration file, an empty configuration
+    is returned if the file doesn't exist yet"""
+
+    parser = cfg.ConfigParser()
+    parser.read(CONF_PATH)
+    return parser
+
+
+def get_books() -> Dict[str, Path]:
+    """Returns the contact books known to the application by their
+    names, the `BOOKS` section of the configuration file maps names
+    to database paths e.g. `team = ~/team_contacts.sqlite`"""
+
+    books = {DEFAULT_BOOK: DATA_PATH}
+    parser = load_config()
+    if parser.has_section("BOOKS"):
+        for name, path in parser.items("BOOKS"):
+            books[name] = Path(path).expanduser()
+    return books
+
+
+def get_storage_settings() -> Dict[str, Union[int, str]]:
+    """Returns the storage settings configured in the `STORAGE` section
+    of the configuration file, i.e. the settings of `profile` (one of
+    `datamanager.PROFILES`) updated with any of the individual settings
+    e.g. `cache_size = -64000`"""
+
+    parser = load_config()
+    if not parser.has_section("STORAGE"):
+        return storage_settings()
+    profile = parser.get("STORAGE", "profile", fallback="default")
+    overrides: Dict[str, Union[int, str]] = dict()
+    for name in STORAGE_PRAGMAS:
+        if parser.has_option("STORAGE", name):
+            value = parser.get("STORAGE", name)
+            overrides[name] = int(value) if value.lstrip("-").isdigit() \
+                else value
+    return storage_settings(profile, overrides)
+
+
+def open_book(path: Union[str, Path, None] = None) -> DataManager:
+    """Opens the SQLite book at `path` (`DATA_PATH` if `None`) with the
+    storage settings configured in the `STORAGE` section, the app, its
+    commands and its background threads all open books through it
+
+    :rtype: DataManager
+    """
+
+    return DataManager(path, settings=get_storage_settings())
+
+
+def open_storage(
+        path: Union[str, Path, None] = None) -> StorageBackend:
+    """Opens the storage backend named by the `backend` option of the
+    `STORAGE` section (or the `CBOOK_BACKEND` environment variable),
+    one of `BACKENDS`
+
+    - `sqlite` stores the contacts in the database at `path`
+    - `sqlite-memory` uses a private in-memory SQLite database
+    - `memory` keeps the contacts in Python dicts and sorted lists
+
+    :param path: Path of the database used by the `sqlite` backend
+    :type path: Union[str, Path, None]
+
+    :rtype: StorageBackend
+    """
+
+    parser = load_config()
+    backend = os.environ.get(BACKEND_ENV) \
+        or parser.get("STORAGE", "backend", fallback="sqlite")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend {backend!r}, expected"
+                         f" one of {', '.join(BACKENDS)}")
+    if backend == "memory":
+        from memory_backend import MemoryBackend
+        return MemoryBackend()
+    if backend == "sqlite-memory":
+        path = ":memory:"
+    return open_book(path)
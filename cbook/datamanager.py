@@ -1,155 +1,1842 @@
-from datetime import datetime
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import json
+import math
+import re
 import sqlite3
 from pathlib import Path
-from typing import List, NamedTuple, Tuple, Union, Optional
+import unicodedata
+from typing import (
+    Callable, ContextManager, Dict, Iterable, Iterator, List, NamedTuple,
+    Sequence, Tuple, Union, Optional)
 
 DATA_PATH = Path.home() / ".cbook_contacts.sqlite"
 
+# Storage settings applied to every connection, by profile name. The
+# page_size only takes effect for new databases (or after a VACUUM in
+# rollback journal mode) and mmap_size/cache_size are in bytes/KiB
+# (negative cache_size) as understood by SQLite
+PROFILES: Dict[str, Dict[str, Union[int, str]]] = {
+    "default": {},
+    "interactive": {
+        "journal_mode": "wal",
+        "cache_size": -16000,
+        "mmap_size": 256 * 2**20,
+        "temp_store": "memory",
+    },
+    "bulk": {
+        "journal_mode": "wal",
+        "page_size": 8192,
+        "cache_size": -256000,
+        "mmap_size": 2 * 2**30,
+        "temp_store": "memory",
+    },
+    "low-memory": {
+        "journal_mode": "delete",
+        "cache_size": -1000,
+        "mmap_size": 0,
+        "temp_store": "file",
+    },
+}
+# Order in which the settings are applied, page_size must come first
+STORAGE_PRAGMAS = (
+    "page_size", "journal_mode", "mmap_size", "cache_size", "temp_store")
 
-class Contact(NamedTuple):
+
+def storage_settings(
+        profile: str = "default",
+        overrides: Optional[Dict[str, Union[int, str]]] = None
+        ) -> Dict[str, Union[int, str]]:
+    """Returns the storage settings of the profile named `profile`
+    updated with `overrides`, raises `ValueError` for unknown profiles
+    or settings
+
+    :param profile: Name of one of the `PROFILES`
+    :type profile: str
+    :param overrides: Settings replacing the ones of the profile
+    :type overrides: Optional[Dict[str, Union[int, str]]]
+
+    :rtype: Dict[str, Union[int, str]]
+    """
+
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown storage profile: {profile}")
+    settings = dict(PROFILES[profile])
+    settings.update(overrides or {})
+    for name, value in settings.items():
+        if name not in STORAGE_PRAGMAS:
+            raise ValueError(f"Unknown storage setting: {name}")
+        # Values are put into the PRAGMA statements as they are
+        if not re.fullmatch(r"-?\d+|[A-Za-z]+", str(value)):
+            raise ValueError(f"Invalid value for {name}: {value}")
+    return settings
+
+
+def apply_settings(conn: sqlite3.Connection,
+                   settings: Dict[str, Union[int, str]]) -> None:
+    """Applies the storage `settings` (see `storage_settings`) to the
+    connection `conn`, in the order of `STORAGE_PRAGMAS`"""
+
+    for name in STORAGE_PRAGMAS:
+        if name in settings:
+            conn.execute(f"PRAGMA {name} = {settings[name]}").fetchall()
+
+
+# Timestamps are stored as microseconds since this (naive) epoch
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def to_timestamp(value: Union[datetime, int]) -> int:
+    """Converts `value` to the integer timestamp stored in the database
+
+    :param value: a datetime or an already converted timestamp
+    :type value: Union[datetime, int]
+
+    :returns: microseconds since `EPOCH`
+    :rtype: int
+    """
+
+    if isinstance(value, datetime):
+        return (value - EPOCH) // MICROSECOND
+    return value
+
+
+def from_timestamp(value: Union[datetime, int]) -> datetime:
+    """Converts a timestamp stored in the database back to a datetime
+
+    :param value: microseconds since `EPOCH` or an already converted
+     datetime
+    :type value: Union[datetime, int]
+
+    :rtype: datetime
+    """
+
+    if isinstance(value, datetime):
+        return value
+    return EPOCH + value * MICROSECOND
+
+
+class _ContactRecord(NamedTuple):
+    db_id: int
+    first_name: str
+    last_name: str
+    date_added: Union[datetime, int]
+    phone_personal: str
+    phone_work: Optional[str] = None
+    phone_home: Optional[str] = None
+    email: Optional[str] = None
+    address: Optional[str] = None
+
+
+class Contact(_ContactRecord):
     """Represents the contact data which is stored into the
-    database"""
+    database
+
+    Contacts read from the database keep `date_added` as the stored
+    integer timestamp, it's only converted to a datetime when accessed"""
+
+    __slots__ = ()
+
+    @property
+    def date_added(self) -> datetime:  # type: ignore[override]
+        return from_timestamp(tuple.__getitem__(self, 3))
+
+    @property
+    def added_timestamp(self) -> int:
+        """`date_added` as stored in the database"""
+        return to_timestamp(tuple.__getitem__(self, 3))
+
+    def _decoded(self) -> tuple:
+        return (*self[:3], self.date_added, *self[4:])
+
+    def __eq__(self, other):
+        # Compares equal to tuples holding the same values, like any
+        # other named tuple
+        if not isinstance(other, tuple):
+            return NotImplemented
+        if hasattr(other, "_decoded"):
+            other = other._decoded()
+        return self._decoded() == tuple(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self._decoded())
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={value!r}" for name, value
+                           in zip(self._fields, self._decoded()))
+        return f"Contact({fields})"
+
+    def _asdict(self):
+        return dict(zip(self._fields, self._decoded()))
+
+
+class Change(NamedTuple):
+    """An entry of the change log, `key` identifies the changed row of
+    `table` and `data` holds its values after the change (`None` for
+    deletions)"""
+
+    version: int
+    table: str
+    op: str             # insert, update or delete
+    key: dict
+    data: Optional[dict]
+
+
+class TrashEntry(NamedTuple):
+    """A soft deleted contact, along with all its phone nos. and the ids
+    of its groups, which are restored with it"""
+
+    trash_id: int
+    deleted: datetime
+    contact: Contact
+    phones: List[Tuple[str, str]]   # (kind, number)
+    groups: List[int]
+
+
+def trash_entry(trash_id: int, contact_id: int, deleted: int,
+                data: dict) -> TrashEntry:
+    """Builds a `TrashEntry` from the JSON data stored in the trash"""
+
+    phones = [tuple(phone) for phone in data["phones"]]
+    slots = dict(phones)
+    contact = Contact(contact_id, data["first_name"], data["last_name"],
+                      data["date_added"],
+                      *(slots.get(kind) for kind in PHONE_SLOTS),
+                      data["email"], data["address"])
+    return TrashEntry(trash_id, from_timestamp(deleted), contact,
+                      phones, data["groups"])  # type: ignore[arg-type]
+
+
+SCHEMA = """
+    PRAGMA foreign_keys = ON;
+    CREATE TABLE IF NOT EXISTS Contacts(
+        id INTEGER PRIMARY KEY,
+        first_name VARCHAR(15) NOT NULL,
+        last_name VARCHAR(15),
+        email VARCHAR(40),
+        address VARCHAR(50),
+        date_added TIMESTAMP NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS Phone_numbers(
+        c_id INTEGER,
+        personal VARCHAR(15) UNIQUE NOT NULL,
+        work VARCHAR(15) UNIQUE,
+        home VARCHAR(15) UNIQUE,
+        FOREIGN KEY(c_id) REFERENCES Contacts(id)
+            ON DELETE RESTRICT,
+        PRIMARY KEY(personal, work, home)
+    );
+    
+    CREATE TABLE IF NOT EXISTS Groups(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS Group_members(
+        g_id INTEGER NOT NULL,
+        c_id INTEGER NOT NULL,
+        FOREIGN KEY(g_id) REFERENCES Groups(id) ON DELETE RESTRICT,
+        FOREIGN KEY(c_id) REFERENCES Contacts(id) ON DELETE RESTRICT,
+        PRIMARY KEY(g_id, c_id)
+    );
+"""
+
+
+# Country code of a phone no. key, i.e. the digits before the last 10
+COUNTRY_CODE = """CASE WHEN length({key}) > 10
+    THEN substr({key}, 1, length({key}) - 10) ELSE '' END"""
+
+# Actual values of all the counters stored in the Counters table, the
+# country code of a contact is the one of their personal phone no.
+COUNTERS_QUERY = f"""
+    SELECT 'contacts', '', COUNT(*) FROM Contacts
+    UNION ALL
+    SELECT 'group', CAST(g_id AS TEXT), COUNT(*) FROM Group_members
+        GROUP BY g_id
+    UNION ALL
+    SELECT 'country_code', {COUNTRY_CODE.format(key="number_key")}, COUNT(*)
+        FROM Phones WHERE kind = 'personal' GROUP BY 2
+"""
+
+
+def _counter_change(name: str, key: str, change: int) -> str:
+    """Returns the statement adding `change` to a counter, used inside
+    the triggers maintaining the Counters table"""
+
+    return f"""INSERT INTO Counters(name, key, value)
+            VALUES('{name}', {key}, {change})
+            ON CONFLICT(name, key) DO UPDATE SET value = value + {change};"""
+
+
+# Columns identifying a row and the columns logged for it, by table
+LOGGED_TABLES = {
+    "Contacts": (("id",), ("id", "first_name", "last_name", "email",
+                           "address", "date_added")),
+    "Phones": (("c_id", "kind", "number_key"),
+               ("c_id", "kind", "number", "number_key")),
+    "Groups": (("id",), ("id", "name")),
+    "Group_members": (("g_id", "c_id"), ("g_id", "c_id")),
+}
+
+
+def _log_triggers(
+        table: str, ops: Tuple[str, ...] = ("insert", "update", "delete")
+        ) -> str:
+    """Returns the triggers appending every change of `table` to the
+    Changes table, with the key and new values of the row as JSON, for
+    the operations in `ops`"""
+
+    key_cols, data_cols = LOGGED_TABLES[table]
+
+    def as_json(row: str, cols: Tuple[str, ...]) -> str:
+        pairs = ", ".join(f"'{col}', {row}.{col}" for col in cols)
+        return f"json_object({pairs})"
+
+    triggers = []
+    for op, row in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+        if op not in ops:
+            continue
+        data = as_json(row, data_cols) if op != "delete" else "NULL"
+        triggers.append(f"""
+    CREATE TRIGGER {table}_log_{op} AFTER {op.upper()} ON {table} BEGIN
+        INSERT INTO Changes(table_name, op, key, data)
+            VALUES('{table}', '{op}', {as_json(row, key_cols)}, {data});
+    END;""")
+    return "".join(triggers)
+
+
+# Compatibility view with the columns of the old Phone_numbers table
+PHONE_NUMBERS_VIEW = """
+    CREATE VIEW Phone_numbers AS
+        SELECT c_id,
+            MAX(CASE WHEN kind = 'personal' THEN number END) AS personal,
+            MAX(CASE WHEN kind = 'work' THEN number END) AS work,
+            MAX(CASE WHEN kind = 'home' THEN number END) AS home
+        FROM Phones GROUP BY c_id;
+"""
+
+# Triggers maintaining the group sizes in the Counters table
+GROUP_MEMBERS_COUNT_TRIGGERS = f"""
+    CREATE TRIGGER Group_members_count_insert
+    AFTER INSERT ON Group_members BEGIN
+        {_counter_change("group", "CAST(NEW.g_id AS TEXT)", 1)}
+    END;
+    CREATE TRIGGER Group_members_count_delete
+    AFTER DELETE ON Group_members BEGIN
+        {_counter_change("group", "CAST(OLD.g_id AS TEXT)", -1)}
+    END;
+"""
+
+# Triggers maintaining the no. of personal phone nos. by country code in
+# the Counters table
+PHONES_COUNT_TRIGGERS = f"""
+    CREATE TRIGGER Phones_count_insert AFTER INSERT ON Phones
+    WHEN NEW.kind = 'personal' BEGIN
+        {_counter_change("country_code",
+                         COUNTRY_CODE.format(key="NEW.number_key"), 1)}
+    END;
+    CREATE TRIGGER Phones_count_delete AFTER DELETE ON Phones
+    WHEN OLD.kind = 'personal' BEGIN
+        {_counter_change("country_code",
+                         COUNTRY_CODE.format(key="OLD.number_key"), -1)}
+    END;
+    CREATE TRIGGER Phones_count_update
+    AFTER UPDATE OF kind, number_key ON Phones BEGIN
+        INSERT INTO Counters(name, key, value)
+            SELECT 'country_code',
+                {COUNTRY_CODE.format(key="OLD.number_key")}, -1
+            WHERE OLD.kind = 'personal'
+            UNION ALL
+            SELECT 'country_code',
+                {COUNTRY_CODE.format(key="NEW.number_key")}, 1
+            WHERE NEW.kind = 'personal'
+            ON CONFLICT(name, key) DO UPDATE
+            SET value = value + excluded.value;
+    END;
+"""
+
+# Logs a phone no. whose key changes as the deletion of the old row and
+# the insertion of the new one, as rows are identified by their key
+PHONES_LOG_UPDATE = """
+    CREATE TRIGGER Phones_log_update AFTER UPDATE ON Phones BEGIN
+        INSERT INTO Changes(table_name, op, key, data)
+            SELECT 'Phones', 'delete', json_object('c_id', OLD.c_id,
+                    'kind', OLD.kind, 'number_key', OLD.number_key), NULL
+            WHERE OLD.c_id IS NOT NEW.c_id OR OLD.kind IS NOT NEW.kind
+                OR OLD.number_key IS NOT NEW.number_key
+            UNION ALL
+            SELECT 'Phones',
+                CASE WHEN OLD.c_id IS NOT NEW.c_id OR OLD.kind IS NOT NEW.kind
+                    OR OLD.number_key IS NOT NEW.number_key
+                    THEN 'insert' ELSE 'update' END,
+                json_object('c_id', NEW.c_id, 'kind', NEW.kind,
+                    'number_key', NEW.number_key),
+                json_object('c_id', NEW.c_id, 'kind', NEW.kind,
+                    'number', NEW.number, 'number_key', NEW.number_key);
+    END;
+"""
+
+# uid of the contacts which existed before uids were added, unique
+# within a book as long as ids are below 2 ** 31
+LEGACY_UID = "((date_added % 4294967291) << 31) | (id & 2147483647)"
+
+# Migrations applied on top of `SCHEMA`, the i-th script upgrades the
+# database to `PRAGMA user_version` i + 1
+MIGRATIONS = [
+    # 1: Normalized digit keys for exact phone no. lookups
+    """
+    ALTER TABLE Phone_numbers ADD COLUMN personal_key VARCHAR(15);
+    ALTER TABLE Phone_numbers ADD COLUMN work_key VARCHAR(15);
+    ALTER TABLE Phone_numbers ADD COLUMN home_key VARCHAR(15);
+    UPDATE Phone_numbers SET
+        personal_key = phone_key(personal),
+        work_key = phone_key(work),
+        home_key = phone_key(home);
+    CREATE UNIQUE INDEX IF NOT EXISTS Phone_numbers_personal_key
+        ON Phone_numbers(personal_key);
+    CREATE UNIQUE INDEX IF NOT EXISTS Phone_numbers_work_key
+        ON Phone_numbers(work_key);
+    CREATE UNIQUE INDEX IF NOT EXISTS Phone_numbers_home_key
+        ON Phone_numbers(home_key);
+    """,
+    # 2: One row per phone no. with a compatibility view for the old table
+    f"""
+    CREATE TABLE Phones(
+        c_id INTEGER NOT NULL,
+        kind VARCHAR(10) NOT NULL,
+        number VARCHAR(15) NOT NULL,
+        number_key VARCHAR(15) NOT NULL,
+        FOREIGN KEY(c_id) REFERENCES Contacts(id) ON DELETE RESTRICT,
+        UNIQUE(number_key, kind)
+    );
+    CREATE INDEX Phones_contact ON Phones(c_id, kind);
+    CREATE UNIQUE INDEX Phones_slot ON Phones(c_id, kind)
+        WHERE kind IN ('personal', 'work', 'home');
+    INSERT INTO Phones(c_id, kind, number, number_key)
+        SELECT c_id, 'personal', personal, personal_key FROM Phone_numbers
+        WHERE personal IS NOT NULL
+        UNION ALL
+        SELECT c_id, 'work', work, work_key FROM Phone_numbers
+        WHERE work IS NOT NULL
+        UNION ALL
+        SELECT c_id, 'home', home, home_key FROM Phone_numbers
+        WHERE home IS NOT NULL;
+    DROP TABLE Phone_numbers;
+    {PHONE_NUMBERS_VIEW}
+    """,
+    # 3: Integer timestamps (microseconds since the epoch) for date_added
+    """
+    ALTER TABLE Contacts ADD COLUMN added INTEGER;
+    UPDATE Contacts SET added =
+        CAST(strftime('%s', date_added) AS INTEGER) * 1000000
+        + CASE WHEN length(date_added) > 20
+            THEN CAST(substr(date_added || '00000', 21, 6) AS INTEGER)
+            ELSE 0 END;
+    ALTER TABLE Contacts DROP COLUMN date_added;
+    ALTER TABLE Contacts RENAME COLUMN added TO date_added;
+    CREATE INDEX Contacts_date_added ON Contacts(date_added);
+    """,
+    # 4: Counters maintained by triggers, so counts don't need a scan
+    f"""
+    CREATE TABLE Counters(
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value INTEGER NOT NULL,
+        PRIMARY KEY(name, key)
+    ) WITHOUT ROWID;
+    INSERT INTO Counters(name, key, value) {COUNTERS_QUERY};
+    INSERT OR IGNORE INTO Counters VALUES('contacts', '', 0);
+
+    CREATE TRIGGER Contacts_count_insert AFTER INSERT ON Contacts BEGIN
+        {_counter_change("contacts", "''", 1)}
+    END;
+    CREATE TRIGGER Contacts_count_delete AFTER DELETE ON Contacts BEGIN
+        {_counter_change("contacts", "''", -1)}
+    END;
+    {GROUP_MEMBERS_COUNT_TRIGGERS}
+    {PHONES_COUNT_TRIGGERS}
+    """,
+    # 5: Append-only change log for incremental exports, versions are
+    # never reused thanks to AUTOINCREMENT
+    f"""
+    CREATE TABLE Changes(
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        op TEXT NOT NULL,
+        key TEXT NOT NULL,
+        data TEXT
+    );
+    -- Versions up to which entries have been dropped by compaction
+    CREATE TABLE Changes_horizon(version INTEGER NOT NULL);
+    INSERT INTO Changes_horizon VALUES(0);
+    {"".join(_log_triggers(table) for table in LOGGED_TABLES)}
+    """,
+    # 6: Last modification times and tombstones of deleted contacts, used
+    # to resolve conflicts when syncing books
+    """
+    ALTER TABLE Contacts ADD COLUMN modified INTEGER NOT NULL DEFAULT 0;
+    -- Changes of the modification time alone aren't logged, they
+    -- come along with changes of the phone numbers
+    DROP TRIGGER Contacts_log_update;
+    CREATE TRIGGER Contacts_log_update
+    AFTER UPDATE OF id, first_name, last_name, email, address, date_added
+    ON Contacts BEGIN
+        INSERT INTO Changes(table_name, op, key, data)
+            VALUES('Contacts', 'update', json_object('id', NEW.id),
+                json_object('id', NEW.id, 'first_name', NEW.first_name,
+                    'last_name', NEW.last_name, 'email', NEW.email,
+                    'address', NEW.address, 'date_added', NEW.date_added));
+    END;
+    UPDATE Contacts SET modified = date_added;
+    CREATE TABLE Deleted_contacts(
+        id INTEGER PRIMARY KEY,
+        modified INTEGER NOT NULL
+    );
+    """,
+    # 7: Index in the order contacts are listed, so name searches
+    # stream their first rows without sorting every match
+    """
+    CREATE INDEX Contacts_name ON Contacts(first_name, last_name);
+    """,
+    # 8: Normalized keys of the names for sorting and matching them
+    # regardless of case and Unicode representation
+    """
+    ALTER TABLE Contacts ADD COLUMN first_key TEXT;
+    ALTER TABLE Contacts ADD COLUMN last_key TEXT;
+    UPDATE Contacts SET
+        first_key = name_key(first_name),
+        last_key = name_key(last_name);
+    DROP INDEX Contacts_name;
+    CREATE INDEX Contacts_sort ON Contacts(first_key, last_key);
+    """,
+    # 9: Frecency ranks of the contacts the user accessed, not logged or
+    # synced as they only describe the use of this copy of the book
+    """
+    CREATE TABLE Contact_ranks(
+        c_id INTEGER PRIMARY KEY,
+        rank REAL NOT NULL
+    );
+    CREATE INDEX Contact_ranks_rank ON Contact_ranks(rank);
+    """,
+    # 10: A phone no. whose key changes is logged as a deletion and an
+    # insertion, see `PHONES_LOG_UPDATE`
+    f"""
+    DROP TRIGGER Phones_log_update;
+    {PHONES_LOG_UPDATE}
+    """,
+    # 11: Phone nos., group memberships and ranks are deleted along with
+    # their contact or group by SQLite itself. Foreign keys can't be
+    # altered, so the tables are rebuilt (keeping their rowids, which
+    # order the phone nos.) along with their indexes and triggers
+    f"""
+    DROP VIEW Phone_numbers;
+    CREATE TABLE Phones_new(
+        c_id INTEGER NOT NULL,
+        kind VARCHAR(10) NOT NULL,
+        number VARCHAR(15) NOT NULL,
+        number_key VARCHAR(15) NOT NULL,
+        FOREIGN KEY(c_id) REFERENCES Contacts(id) ON DELETE CASCADE,
+        UNIQUE(number_key, kind)
+    );
+    INSERT INTO Phones_new(rowid, c_id, kind, number, number_key)
+        SELECT rowid, c_id, kind, number, number_key FROM Phones;
+    DROP TABLE Phones;
+    ALTER TABLE Phones_new RENAME TO Phones;
+    CREATE INDEX Phones_contact ON Phones(c_id, kind);
+    CREATE UNIQUE INDEX Phones_slot ON Phones(c_id, kind)
+        WHERE kind IN ('personal', 'work', 'home');
+    {PHONES_COUNT_TRIGGERS}
+    {_log_triggers("Phones", ("insert", "delete"))}
+    {PHONES_LOG_UPDATE}
+    {PHONE_NUMBERS_VIEW}
+
+    CREATE TABLE Group_members_new(
+        g_id INTEGER NOT NULL,
+        c_id INTEGER NOT NULL,
+        FOREIGN KEY(g_id) REFERENCES Groups(id) ON DELETE CASCADE,
+        FOREIGN KEY(c_id) REFERENCES Contacts(id) ON DELETE CASCADE,
+        PRIMARY KEY(g_id, c_id)
+    );
+    INSERT INTO Group_members_new(rowid, g_id, c_id)
+        SELECT rowid, g_id, c_id FROM Group_members;
+    DROP TABLE Group_members;
+    ALTER TABLE Group_members_new RENAME TO Group_members;
+    -- Cascading deletes of contacts look their memberships up by c_id
+    CREATE INDEX Group_members_contact ON Group_members(c_id);
+    {GROUP_MEMBERS_COUNT_TRIGGERS}
+    {_log_triggers("Group_members")}
+
+    CREATE TABLE Contact_ranks_new(
+        c_id INTEGER PRIMARY KEY
+            REFERENCES Contacts(id) ON DELETE CASCADE,
+        rank REAL NOT NULL
+    );
+    INSERT INTO Contact_ranks_new(c_id, rank)
+        SELECT c_id, rank FROM Contact_ranks
+        WHERE c_id IN (SELECT id FROM Contacts);
+    DROP TABLE Contact_ranks;
+    ALTER TABLE Contact_ranks_new RENAME TO Contact_ranks;
+    CREATE INDEX Contact_ranks_rank ON Contact_ranks(rank);
+    """,
+    # 12: Trash of soft deleted contacts, see `TrashEntry`
+    """
+    CREATE TABLE Trash(
+        trash_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        c_id INTEGER NOT NULL,
+        deleted INTEGER NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX Trash_deleted ON Trash(deleted);
+    """,
+    # 13: Identities of the contacts shared by every copy of a book, so
+    # syncing tells the contacts created separately under the same id
+    # apart, see `sync`. Existing contacts get the same uid in every copy
+    # made before, derived from their id and date added, and new ones a
+    # random uid unless the id belonged to a deleted contact, whose uid
+    # is taken over. Tombstones written before keep a NULL uid
+    f"""
+    ALTER TABLE Contacts ADD COLUMN uid INTEGER;
+    UPDATE Contacts SET uid = {LEGACY_UID};
+    CREATE UNIQUE INDEX Contacts_uid ON Contacts(uid);
+    CREATE TRIGGER Contacts_uid AFTER INSERT ON Contacts
+    WHEN NEW.uid IS NULL BEGIN
+        UPDATE Contacts SET uid = random() WHERE id = NEW.id;
+    END;
+    ALTER TABLE Deleted_contacts ADD COLUMN uid INTEGER;
+    """,
+]
+
+# The stored data of the contacts selected by `{selected}` as JSON, the
+# way it is kept in the trash
+TRASH_DATA = """json_object(
+        'first_name', first_name, 'last_name', last_name,
+        'email', email, 'address', address, 'date_added', date_added,
+        'phones', json((SELECT json_group_array(json_array(kind, number))
+            FROM (SELECT kind, number FROM Phones
+                WHERE c_id = Contacts.id ORDER BY rowid))),
+        'groups', json((SELECT json_group_array(g_id) FROM Group_members
+            WHERE c_id = Contacts.id)))"""
+
+# Phone nos. of the pre-migration Phone_numbers table whose keys are
+# shared by other numbers of the same column, e.g. `+91-9876543210` and
+# `919876543210`, which the unique key indexes of migration 1 reject.
+# One row per key: (column, key, numbers and their contact ids)
+PHONE_KEY_CONFLICTS = """
+    SELECT kind, key, group_concat(
+            quote(number) || ' (contact ' || c_id || ')', ', ')
+    FROM (
+        SELECT 'personal' AS kind, personal AS number, c_id,
+            phone_key(personal) AS key FROM Phone_numbers
+        UNION ALL
+        SELECT 'work', work, c_id, phone_key(work) FROM Phone_numbers
+        UNION ALL
+        SELECT 'home', home, c_id, phone_key(home) FROM Phone_numbers
+    )
+    WHERE key IS NOT NULL
+    GROUP BY kind, key HAVING COUNT(*) > 1
+    ORDER BY kind, key
+"""
+
+# Phone no. kinds which are mapped to the fields of `Contact`
+PHONE_SLOTS = ("personal", "work", "home")
+
+# No. of contacts deleted in each transaction by the bulk deletes
+DELETE_CHUNK = 1000
+
+# Fields of the contacts which can be set for many contacts at once
+BATCH_FIELDS = ("first_name", "last_name", "email", "address")
+
+
+def contact_columns(schema: str = "main") -> str:
+    """Returns the columns selected to build a `Contact` from the
+    Contacts table of the database attached as `schema`, phone numbers
+    are picked through the (c_id, kind) index of Phones"""
+
+    return f"""
+    Contacts.id, first_name, last_name, date_added,
+    (SELECT number FROM {schema}.Phones
+        WHERE c_id = Contacts.id AND kind = 'personal'),
+    (SELECT number FROM {schema}.Phones
+        WHERE c_id = Contacts.id AND kind = 'work'),
+    (SELECT number FROM {schema}.Phones
+        WHERE c_id = Contacts.id AND kind = 'home'),
+    email, address
+"""
+
+
+CONTACT_COLUMNS = contact_columns()
+
+
+def phone_key(phone: Optional[str]) -> Optional[str]:
+    """Returns the canonical key of a phone no. i.e. its E.164 digits
+    without the leading `+` or any separators, so that `+91-9876543210`,
+    `+919876543210` and `919876543210` all share the same key
+
+    :param phone: phone no. as entered by the user
+    :type phone: Optional[str]
+
+    :returns: digits of the phone no. or `None` if there are none
+    :rtype: Optional[str]
+    """
+
+    if not phone:
+        return None
+    digits = re.sub(r"\D", "", phone)
+    return digits or None
+
+
+def name_key(name: Optional[str]) -> Optional[str]:
+    """Returns the key by which a name is sorted and matched, i.e. its
+    NFKC normal form casefolded, so that `ÉMILE`, `émile` and `émile`
+    spelt with a combining accent all share the same key
+
+    :param name: first or last name
+    :type name: Optional[str]
+
+    :rtype: Optional[str]
+    """
+
+    if name is None:
+        return None
+    return unicodedata.normalize("NFKC", name).casefold()
+
+
+# Time after which an access to a contact counts half as much
+ACCESS_HALF_LIFE = timedelta(days=7)
+
+
+def access_rank(when: Union[datetime, int]) -> float:
+    """Returns the frecency rank of a single access to a contact
+
+    A contact accessed at times t1, t2, ... has the score
+    `sum(2 ** ((ti - now) / ACCESS_HALF_LIFE))`, which decays as time
+    passes. Ranks are the logarithm of the score taken at `EPOCH`
+    instead of now, so stored ranks never need to be decayed: sorting
+    contacts by rank sorts them by score at any time, and the ranks of
+    further accesses are added up with `logaddexp`
+
+    :param when: Time of the access
+    :type when: Union[datetime, int]
+
+    :rtype: float
+    """
+
+    half_lives = to_timestamp(when) / (ACCESS_HALF_LIFE // MICROSECOND)
+    return half_lives * math.log(2)
+
+
+def logaddexp(a: Optional[float], b: float) -> float:
+    """Returns `log(exp(a) + exp(b))` without overflowing, `b` if `a`
+    is `None`"""
+
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+class MigrationError(sqlite3.DatabaseError):
+    """Raised when the schema of a book can't be brought up to date, the
+    book is left at the last version reached"""
+
+
+class StorageBackend(ABC):
+    """The interface through which the application stores and searches
+    contacts, implemented by `DataManager` (SQLite) and
+    `memory_backend.MemoryBackend`
+
+    Backends only implement the lazy `iter_*` methods, the `fetch_*`
+    methods collect their results into lists"""
+
+    def fetch_by_name(self, name: str) -> List[Contact]:
+        """Fetches and returns all the contacts from the database whose
+        name matches `name` (i.e. first_name + last_name)
+
+        :param name: name to search for
+        :type name: str
+
+        :returns: List of found contacts
+        :rtype: List[Contact]
+        """
+
+        return list(self.iter_by_name(name))
+
+    def fetch_by_phone_no(self, phone: str) -> List[Contact]:
+        """Fetches and returns all the contacts having a phone no.
+        equal to `phone`, if no number matches exactly then all the
+        contacts with a number containing `phone` are returned
+
+        :param phone: Phone no. to search for
+        :type phone: str
+        .. No math is to be done with phone numbers
+
+        :returns: List of found contacts
+        :rtype: List[Contact]
+        """
+
+        return list(self.iter_by_phone_no(phone))
+
+    def fetch_by_exact_phone(self, phone: str) -> List[Contact]:
+        """Fetches and returns all the contacts having `phone` as one of
+        their phone numbers, the numbers are compared by their canonical
+        key (see `phone_key`) so the lookup is a single index probe
+        instead of a `LIKE` scan
+
+        :param phone: Phone no. to look for, in any supported format
+        :type phone: str
+
+        :returns: List of found contacts
+        :rtype: List[Contact]
+        """
+
+        return list(self.iter_by_exact_phone(phone))
+
+    def fetch_contacts(self, limit: int = 10) -> List[Contact]:
+        """Fetches and returns a maximum of `limit` contacts in sorted order
+
+        :param limit: Maximum number of contacts to fetch
+        :type limit: int
+
+        :returns: List of contacts found
+        :rtype: List[Contact]
+        """
+
+        return list(self.iter_contacts(limit))
+
+    def fetch_added_between(
+            self, start: datetime,
+            end: Optional[datetime] = None) -> List[Contact]:
+        """Fetches and returns the contacts added at or after `start` and
+        before `end` (if given), oldest first
+
+        :param start: Earliest time of addition
+        :type start: datetime
+        :param end: Time of addition up to which (exclusive) to fetch
+        :type end: Optional[datetime]
+
+        :returns: List of contacts found
+        :rtype: List[Contact]
+        """
+
+        return list(self.iter_added_between(start, end))
+
+    def fetch_added_since(self, since: datetime) -> List[Contact]:
+        """Fetches and returns the contacts added at or after `since`,
+        oldest first
+
+        :param since: Earliest time of addition
+        :type since: datetime
+
+        :returns: List of contacts found
+        :rtype: List[Contact]
+        """
+
+        return self.fetch_added_between(since)
+
+    def get_contacts_from_group(self, group_id: int) -> List[Contact]:
+        """Fetches and returns all the contacts from group with id `group_id`
+
+        :param group_id: The group_id from which to fetch contacts
+        :type group_id: int
+        :returns: List of present contacts
+        :rtype: List[Contact]"""
+
+        return list(self.iter_contacts_from_group(group_id))
+
+    @abstractmethod
+    def iter_by_name(
+            self, name: str,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_by_name`"""
+
+    @abstractmethod
+    def iter_by_phone_no(
+            self, phone: str,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_by_phone_no`"""
+
+    @abstractmethod
+    def iter_by_exact_phone(
+            self, phone: str,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_by_exact_phone`"""
+
+    @abstractmethod
+    def iter_contacts(
+            self, limit: Optional[int] = None,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields a maximum of `limit` contacts (all of them if
+        `limit` is `None`) in sorted order"""
+
+    @abstractmethod
+    def iter_added_between(
+            self, start: datetime, end: Optional[datetime] = None,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_added_between`"""
+
+    @abstractmethod
+    def iter_contacts_from_group(
+            self, group_id: int,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts from group with id `group_id`"""
+
+    @abstractmethod
+    def get_contact(self, contact_id: int) -> Optional[Contact]:
+        """Returns the contact with id `contact_id`, `None` if there is
+        no such contact"""
+
+    @abstractmethod
+    def fetch_phone_numbers(self, contact_id: int) -> List[Tuple[str, str]]:
+        """Returns all the (kind, number) pairs of a contact"""
+
+    @abstractmethod
+    def add_phone_number(
+            self, contact_id: int, number: str, kind: str = "mobile") -> bool:
+        """Adds another phone no. to a contact, returns `True` if added"""
+
+    @abstractmethod
+    def remove_phone_number(self, contact_id: int, number: str) -> None:
+        """Removes a phone no. from a contact"""
+
+    @abstractmethod
+    def fetch_caller_ids(self) -> List[Tuple[str, int, str, Optional[str]]]:
+        """Returns (number_key, id, first_name, last_name) for every
+        stored phone no."""
+
+    @abstractmethod
+    def record_access(
+            self, contact_id: int,
+            when: Optional[datetime] = None) -> Optional[float]:
+        """Adds an access at `when` (now by default) to the frecency rank
+        of a contact, returns its new rank or `None` if there is no such
+        contact"""
+
+    @abstractmethod
+    def iter_frecent(self, limit: int) -> Iterator[Tuple[float, Contact]]:
+        """Lazily yields the (rank, contact) of the `limit` contacts with
+        the highest frecency rank, highest first"""
+
+    @abstractmethod
+    def get_contact_count(self) -> int:
+        """Returns the total number of contacts"""
+
+    @abstractmethod
+    def get_group_size(self, group_id: int) -> int:
+        """Returns the number of contacts in a group"""
+
+    @abstractmethod
+    def get_country_code_counts(self) -> List[Tuple[str, int]]:
+        """Returns the (country_code, no. of contacts) pairs, most
+        common first"""
+
+    @abstractmethod
+    def create_contact(self, contact: Contact) -> bool:
+        """Stores a new contact, returns `True` if created"""
+
+    @abstractmethod
+    def update_contact(self, contact: Contact) -> bool:
+        """Updates the contact with id `contact.db_id`, returns `True` if
+        updated"""
+
+    @abstractmethod
+    def delete_contact(self, contact: Contact) -> None:
+        """Deletes a contact along with its numbers and memberships"""
+
+    def delete_contacts(
+            self, ids: Iterable[int], chunk_size: int = DELETE_CHUNK,
+            progress: Optional[Callable[[int, int], None]] = None,
+            trash: bool = False) -> int:
+        """Deletes the contacts with ids in `ids`, or moves them to the
+        trash, calling `progress` with the no. of ids processed and the
+        total after every `chunk_size` of them. Returns the no. of
+        contacts deleted
+
+        Backends may override this with a set-based deletion, the default
+        deletes the contacts one by one"""
+
+        ids = list(ids)
+        deleted = 0
+        for i, contact_id in enumerate(ids, start=1):
+            contact = self.get_contact(contact_id)
+            if contact:
+                if trash:
+                    self.trash_contact(contact)
+                else:
+                    self.delete_contact(contact)
+                deleted += 1
+            if progress and (i % chunk_size == 0 or i == len(ids)):
+                progress(i, len(ids))
+        return deleted
+
+    @abstractmethod
+    def trash_contact(self, contact: Contact) -> bool:
+        """Moves a contact to the trash along with its phone nos. and
+        groups, returns `False` if there is no such contact"""
+
+    @abstractmethod
+    def fetch_trash(self, trash_id: Optional[int] = None) -> List[TrashEntry]:
+        """Returns the entries of the trash, most recently deleted first,
+        or just the one with id `trash_id`"""
+
+    @abstractmethod
+    def remove_from_trash(self, trash_id: int) -> None:
+        """Removes an entry from the trash for good"""
+
+    @abstractmethod
+    def purge_trash(self, older_than: Optional[datetime] = None) -> int:
+        """Removes the entries deleted before `older_than` (all of them
+        if `None`) from the trash for good, returns how many"""
+
+    def restore_contact(self, trash_id: int) -> Optional[Contact]:
+        """Restores a contact from the trash along with its phone nos.
+        and the groups which still exist. It gets a new id if its id was
+        taken in the meantime
+
+        :param trash_id: id of the entry of the trash
+        :type trash_id: int
+
+        :returns: The restored contact, `None` if there is no such entry
+         or one of its phone nos. was taken in the meantime
+        :rtype: Optional[Contact]
+        """
+
+        entries = self.fetch_trash(trash_id)
+        if not entries:
+            return None
+        entry = entries[0]
+        contact = entry.contact
+        if self.get_contact(contact.db_id):
+            contact = contact._replace(db_id=self.get_new_id())
+        groups = {group[0] for group in self.fetch_groups()}
+        try:
+            with self.transaction():
+                if not self.create_contact(contact):
+                    raise ValueError("Phone no. already exists")
+                for kind, number in entry.phones:
+                    if kind not in PHONE_SLOTS and not self.add_phone_number(
+                            contact.db_id, number, kind):
+                        raise ValueError("Phone no. already exists")
+                for group_id in entry.groups:
+                    if group_id in groups:
+                        self.add_contacts_to_group(group_id, contact.db_id)
+                self.remove_from_trash(trash_id)
+        except ValueError:
+            return None
+        return contact
+
+    @abstractmethod
+    def get_new_id(self) -> int:
+        """Returns a new id for the contact to use"""
+
+    @abstractmethod
+    def create_group(self, name: str) -> None:
+        """Creates a group named `name`"""
+
+    @abstractmethod
+    def fetch_groups(self) -> List[Tuple[Union[int, str]]]:
+        """Returns the (id, name) of all the groups"""
+
+    @abstractmethod
+    def add_contacts_to_group(self, group_id: int, contact_id: int) -> bool:
+        """Adds a contact to a group, returns `True` if added"""
+
+    @abstractmethod
+    def remove_contacts_from_group(
+            self, group_id: int, contact_id: int) -> None:
+        """Removes a contact from a group"""
+
+    @abstractmethod
+    def delete_group(self, group_id: int) -> None:
+        """Deletes a group, but not its contacts"""
+
+    def set_progress_handler(
+            self, handler: Optional[Callable[[], int]], n: int) -> None:
+        """Calls `handler` periodically while a query runs, the query is
+        interrupted if it returns a non zero value. Backends without
+        long running queries ignore it"""
+
+    def set_trace_callback(
+            self, callback: Optional[Callable[[str], None]]) -> None:
+        """Calls `callback` with every SQL statement as it starts running.
+        Backends without SQL ignore it"""
+
+    @abstractmethod
+    def transaction(self) -> ContextManager[None]:
+        """Context manager applying all the changes made inside it
+        together or not at all"""
+
+    @abstractmethod
+    def commit(self) -> None:
+        """Makes the pending changes durable"""
+
+
+class DataManager(StorageBackend):
+    """This class is responsible for maintaining the sqlite database
+    used by the application"""
+
+    def __init__(
+            self,
+            path: Union[str, Path, None] = None,
+            batch_size: int = 500,
+            settings: Optional[Dict[str, Union[int, str]]] = None):
+
+        self.path = path if path is not None else DATA_PATH
+        # No. of rows fetched at once by the `iter_*` methods
+        self.batch_size = batch_size
+        # No converters are needed, timestamps are stored as integers
+        # and decoded by `Contact` only when accessed
+        self.__conn = sqlite3.connect(self.path)
+        self.__conn.create_function(
+            "phone_key", 1, phone_key, deterministic=True)
+        self.__conn.create_function(
+            "name_key", 1, name_key, deterministic=True)
+        self.__conn.create_function(
+            "logaddexp", 2, logaddexp, deterministic=True)
+        # No. of `transaction` blocks entered and not left yet
+        self._transactions = 0
+        # Storage settings, see `storage_settings`
+        self.settings = settings or dict()
+        apply_settings(self.__conn, self.settings)
+        cur = self.__conn.cursor()
+        cur.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        """Brings the database schema up to date by running the pending
+        `MIGRATIONS`, each one inside its own transaction
+
+        :raises MigrationError: If a migration fails, it is rolled back
+        """
+
+        cur = self.__conn.cursor()
+        cur.execute("PRAGMA user_version")
+        version = cur.fetchone()[0]
+        for i, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            if i == 1:
+                self._check_phone_keys()
+            try:
+                cur.executescript(
+                    f"BEGIN; {script} PRAGMA user_version = {i}; COMMIT;")
+            except sqlite3.Error as error:
+                if self.__conn.in_transaction:
+                    self.__conn.rollback()
+                raise MigrationError(
+                    f"Migration {i} of {self.path} failed and was rolled"
+                    f" back, the book is still at version {i - 1}: {error}"
+                ) from error
+
+    def _check_phone_keys(self) -> None:
+        """Makes sure no two phone nos. of the same kind share a key
+        before the unique key indexes are built, as the same number
+        written in two formats could be stored before keys existed
+
+        :raises MigrationError: Naming the conflicting numbers
+        """
+
+        cur = self.__conn.cursor()
+        cur.execute(PHONE_KEY_CONFLICTS)
+        conflicts = cur.fetchall()
+        if conflicts:
+            details = "\n".join(f"  {kind} {key}: {numbers}"
+                                 for kind, key, numbers in conflicts)
+            raise MigrationError(
+                f"{self.path} can't be upgraded, these phone nos. are the"
+                f" same number written in different formats. Remove or"
+                f" correct all but one of each, e.g. with the sqlite3"
+                f" shell, and open the book again:\n{details}")
+
+    @contextmanager
+    def _atomic(self) -> Iterator[sqlite3.Cursor]:
+        """Runs the enclosed statements inside a savepoint, so either all
+        of them take effect or none of them do"""
+
+        cur = self.__conn.cursor()
+        cur.execute("SAVEPOINT atomic")
+        try:
+            yield cur
+        except BaseException:
+            cur.execute("ROLLBACK TO atomic")
+            cur.execute("RELEASE atomic")
+            raise
+        cur.execute("RELEASE atomic")
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Groups all the changes made inside the `with` block into a
+        single transaction, which is much faster for bulk changes than
+        committing each of them"""
+
+        self._transactions += 1
+        try:
+            with self._atomic():
+                yield
+        finally:
+            self._transactions -= 1
+
+    def _insert_phones(
+            self, cur: sqlite3.Cursor, contact: Contact) -> None:
+        """Inserts the personal, work and home numbers of `contact`"""
+
+        numbers = (contact.phone_personal, contact.phone_work,
+                   contact.phone_home)
+        query = """INSERT INTO Phones(c_id, kind, number, number_key)
+                VALUES(?, ?, ?, ?)"""
+        params = [(contact.db_id, kind, number, phone_key(number))
+                  for kind, number in zip(PHONE_SLOTS, numbers) if number]
+        cur.executemany(query, params)
+
+    def _iter_contacts(
+            self, query: str, params: tuple,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Runs `query` and lazily yields a `Contact` for every row,
+        fetching `batch_size` rows at a time. The cursor is closed once
+        the rows are exhausted or the generator is closed early"""
+
+        batch_size = batch_size or self.batch_size
+        cur = self.__conn.cursor()
+        try:
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield Contact(*row)
+        finally:
+            cur.close()
+
+    def iter_by_name(
+            self, name: str,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_by_name`
+
+        :param name: name to search for
+        :type name: str
+        :param batch_size: No. of rows fetched at once
+        :type batch_size: Optional[int]
+
+        :rtype: Iterator[Contact]
+        """
+
+        query = f"""
+            SELECT {CONTACT_COLUMNS}
+            FROM Contacts
+            WHERE first_key LIKE ? OR last_key LIKE ?
+            ORDER BY first_key, last_key;
+        """
+        param = f"%{name_key(name)}%"
+        return self._iter_contacts(query, (param, param), batch_size)
+
+    def iter_by_phone_no(
+            self, phone: str,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_by_phone_no`
+
+        :param phone: Phone no. to search for
+        :type phone: str
+        :param batch_size: No. of rows fetched at once
+        :type batch_size: Optional[int]
+
+        :rtype: Iterator[Contact]
+        """
+
+        found = False
+        for contact in self.iter_by_exact_phone(phone, batch_size):
+            found = True
+            yield contact
+        if found:
+            return
+
+        query = f"""
+            SELECT {CONTACT_COLUMNS}
+            FROM Contacts
+            WHERE id IN (SELECT c_id FROM Phones WHERE number LIKE ?)
+            ORDER BY first_key, last_key;
+        """
+        param = f"%{phone}%"
+        yield from self._iter_contacts(query, (param,), batch_size)
+
+    def iter_by_exact_phone(
+            self, phone: str,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_by_exact_phone`
+
+        :param phone: Phone no. to look for, in any supported format
+        :type phone: str
+        :param batch_size: No. of rows fetched at once
+        :type batch_size: Optional[int]
+
+        :rtype: Iterator[Contact]
+        """
+
+        key = phone_key(phone)
+        if key is None:
+            return iter(())
+        query = f"""
+            SELECT {CONTACT_COLUMNS}
+            FROM Contacts
+            WHERE id IN (SELECT c_id FROM Phones WHERE number_key = ?)
+            ORDER BY first_key, last_key;
+        """
+        return self._iter_contacts(query, (key,), batch_size)
+
+    def get_contact(self, contact_id: int) -> Optional[Contact]:
+        """Fetches and returns the contact with id `contact_id`
+
+        :param contact_id: Contact ID
+        :type contact_id: int
+
+        :returns: The contact or `None` if there is no such contact
+        :rtype: Optional[Contact]
+        """
+
+        query = f"SELECT {CONTACT_COLUMNS} FROM Contacts WHERE id = ?"
+        return next(self._iter_contacts(query, (contact_id,)), None)
+
+    def fetch_phone_numbers(self, contact_id: int) -> List[Tuple[str, str]]:
+        """Fetches and returns all the phone numbers of the contact with
+        id `contact_id` as (kind, number) pairs
+
+        :param contact_id: Contact ID
+        :type contact_id: int
+
+        :returns: List of (kind, number) pairs
+        :rtype: List[Tuple[str, str]]
+        """
+
+        cur = self.__conn.cursor()
+        query = """SELECT kind, number FROM Phones
+                WHERE c_id = ? ORDER BY rowid"""
+        cur.execute(query, (contact_id,))
+        return cur.fetchall()
+
+    def add_phone_number(
+            self, contact_id: int, number: str, kind: str = "mobile") -> bool:
+        """Adds another phone no. of kind `kind` to the contact with id
+        `contact_id`, a contact may have any number of these. Returns
+        `True` if added successfully `False` otherwise
+
+        :param contact_id: Contact ID
+        :type contact_id: int
+        :param number: The phone no. to add
+        :type number: str
+        :param kind: Kind of the number e.g. mobile, fax, other
+        :type kind: str
+
+        :returns: Status of addition
+        :rtype: bool
+        """
+
+        key = phone_key(number)
+        if key is None:
+            return False
+        try:
+            with self._atomic() as cur:
+                query = """INSERT INTO Phones(c_id, kind, number, number_key)
+                        VALUES(?, ?, ?, ?)"""
+                cur.execute(query, (contact_id, kind, number, key))
+                self._touch(cur, contact_id)
+            return True
+        except sqlite3.Error:
+            return False
+
+    def remove_phone_number(self, contact_id: int, number: str) -> None:
+        """Removes the phone no. `number` from the contact with id
+        `contact_id`"""
+
+        cur = self.__conn.cursor()
+        query = "DELETE FROM Phones WHERE c_id = ? AND number_key = ?"
+        cur.execute(query, (contact_id, phone_key(number)))
+        if cur.rowcount:
+            self._touch(cur, contact_id)
+
+    def _touch(self, cur: sqlite3.Cursor, contact_id: int) -> None:
+        """Sets the modification time of a contact to now"""
+
+        query = "UPDATE Contacts SET modified = ? WHERE id = ?"
+        cur.execute(query, (to_timestamp(datetime.now()), contact_id))
+
+    def fetch_caller_ids(self) -> List[Tuple[str, int, str, Optional[str]]]:
+        """Fetches and returns every stored phone no. key along with the
+        id and name of the contact it belongs to, used for building
+        in-memory number -> contact maps
+
+        :returns: List of (number_key, id, first_name, last_name)
+        :rtype: List[Tuple[str, int, str, Optional[str]]]
+        """
+
+        cur = self.__conn.cursor()
+        query = """
+            SELECT number_key, id, first_name, last_name
+            FROM Phones JOIN Contacts ON Contacts.id = Phones.c_id
+        """
+        cur.execute(query)
+        return cur.fetchall()
+
+    def record_access(
+            self, contact_id: int,
+            when: Optional[datetime] = None) -> Optional[float]:
+        """Adds an access at `when` (now by default) to the frecency rank
+        of a contact, see `access_rank`
+
+        :param contact_id: id of the contact accessed
+        :type contact_id: int
+        :param when: Time of the access
+        :type when: Optional[datetime]
 
-    db_id: int
-    first_name: str
-    last_name: str
-    date_added: datetime
-    phone_personal: str
-    phone_work: Optional[str] = None
-    phone_home: Optional[str] = None
-    email: Optional[str] = None
-    address: Optional[str] = None
+        :returns: The new rank, `None` if there is no such contact
+        :rtype: Optional[float]
+        """
 
+        rank = access_rank(when or datetime.now())
+        with self._atomic() as cur:
+            cur.execute("""INSERT INTO Contact_ranks(c_id, rank)
+                    SELECT id, ? FROM Contacts WHERE id = ?
+                    ON CONFLICT(c_id) DO UPDATE
+                    SET rank = logaddexp(rank, excluded.rank)""",
+                        (rank, contact_id))
+            cur.execute("SELECT rank FROM Contact_ranks WHERE c_id = ?",
+                        (contact_id,))
+            row = cur.fetchone()
+        return row[0] if row else None
 
-SCHEMA = """
-    PRAGMA foreign_keys = ON;
-    CREATE TABLE IF NOT EXISTS Contacts(
-        id INTEGER PRIMARY KEY,
-        first_name VARCHAR(15) NOT NULL,
-        last_name VARCHAR(15),
-        email VARCHAR(40),
-        address VARCHAR(50),
-        date_added TIMESTAMP NOT NULL
-    );
-    CREATE TABLE IF NOT EXISTS Phone_numbers(
-        c_id INTEGER,
-        personal VARCHAR(15) UNIQUE NOT NULL,
-        work VARCHAR(15) UNIQUE,
-        home VARCHAR(15) UNIQUE,
-        FOREIGN KEY(c_id) REFERENCES Contacts(id)
-            ON DELETE RESTRICT,
-        PRIMARY KEY(personal, work, home)
-    );
-    
-    CREATE TABLE IF NOT EXISTS Groups(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL
-    );
+    def iter_frecent(self, limit: int) -> Iterator[Tuple[float, Contact]]:
+        """Lazily yields the (rank, contact) of the `limit` contacts with
+        the highest frecency rank, highest first
 
-    CREATE TABLE IF NOT EXISTS Group_members(
-        g_id INTEGER NOT NULL,
-        c_id INTEGER NOT NULL,
-        FOREIGN KEY(g_id) REFERENCES Groups(id) ON DELETE RESTRICT,
-        FOREIGN KEY(c_id) REFERENCES Contacts(id) ON DELETE RESTRICT,
-        PRIMARY KEY(g_id, c_id)
-    );
-"""
+        :param limit: Maximum number of contacts to yield
+        :type limit: int
 
+        :rtype: Iterator[Tuple[float, Contact]]
+        """
 
-class DataManager:
-    """This class is responsible for maintaining the sqlite database
-    used by the application"""
+        cur = self.__conn.cursor()
+        try:
+            cur.execute(f"""SELECT rank, {CONTACT_COLUMNS}
+                    FROM Contact_ranks JOIN Contacts ON Contacts.id = c_id
+                    ORDER BY rank DESC LIMIT ?""", (limit,))
+            for rank, *row in cur:
+                yield rank, Contact(*row)
+        finally:
+            cur.close()
+
+    def effective_settings(self) -> Dict[str, Union[int, str]]:
+        """Returns the storage settings in effect for this connection,
+        which may differ from the requested ones e.g. page_size of an
+        existing database or mmap_size above SQLite's compile time limit
 
-    def __init__(self):
+        :rtype: Dict[str, Union[int, str]]
+        """
 
-        self.__conn = sqlite3.connect(
-            DATA_PATH,
-            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
         cur = self.__conn.cursor()
-        cur.executescript(SCHEMA)
+        settings = dict()
+        for name in STORAGE_PRAGMAS:
+            cur.execute(f"PRAGMA {name}")
+            row = cur.fetchone()
+            settings[name] = row[0] if row else None
+        return settings
 
-    def fetch_by_name(self, name: str) -> List[Contact]:
-        """Fetches and returns all the contacts from the database whose
-        name matches `name` (i.e. first_name + last_name)
+    def set_progress_handler(
+            self, handler: Optional[Callable[[], int]], n: int) -> None:
+        """Calls `handler` every `n` SQLite virtual machine instructions
+        while a query runs, the query is interrupted (raising
+        `sqlite3.OperationalError`) if it returns a non zero value.
+        `None` removes the handler
 
-        :param name: name to search for
-        :type name: str
+        :param handler: Function deciding whether to interrupt the query
+        :type handler: Optional[Callable[[], int]]
+        :param n: No. of instructions between the calls
+        :type n: int
+        """
 
-        :returns: List of found contacts
-        :rtype: List[Contact]
+        self.__conn.set_progress_handler(handler, n)
+
+    def set_trace_callback(
+            self, callback: Optional[Callable[[str], None]]) -> None:
+        """Calls `callback` with the text of every SQL statement as it
+        starts running, including the statements run by triggers. `None`
+        removes the callback
+
+        :param callback: Function receiving the statements
+        :type callback: Optional[Callable[[str], None]]
+        """
+
+        self.__conn.set_trace_callback(callback)
+
+    def data_version(self) -> int:
+        """Returns SQLite's data version of the database, which changes
+        whenever another connection commits a change to it
+
+        :rtype: int
         """
 
         cur = self.__conn.cursor()
-        query = """
-            SELECT id, first_name, last_name, date_added, personal, work, home, email, address
-            FROM Contacts JOIN Phone_numbers ON Contacts.id = Phone_numbers.c_id
-            WHERE first_name LIKE ? OR last_name LIKE ?
-            ORDER BY first_name, last_name;
+        cur.execute("PRAGMA data_version")
+        return cur.fetchone()[0]
+
+    def change_version(self) -> int:
+        """Returns the version of the latest change logged, changes
+        made after this call have greater versions
+
+        :rtype: int
         """
-        param = f"%{name}%"
-        cur.execute(query, (param, param))
-        data = [Contact(*row) for row in cur]
-        return data
 
-    def fetch_by_phone_no(self, phone: str) -> List[Contact]:
-        """Fetches and returns all the contacts with either
-        phone_no1 or phone_no2
-        equal to `phone` from the database
+        cur = self.__conn.cursor()
+        cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'Changes'")
+        data = cur.fetchone()
+        return data[0] if data else 0
 
-        :param phone: Phone no. to search for
-        :type phone: str
-        .. No math is to be done with phone numbers
+    def iter_changes(
+            self, since: int = 0,
+            batch_size: Optional[int] = None) -> Iterator[Change]:
+        """Lazily yields the changes made after version `since` in the
+        order they were made, raises `ValueError` if some of them were
+        already dropped by `compact_changes`, in which case a full
+        export is needed
 
-        :returns: List of found contacts
-        :rtype: List[Contact]
+        :param since: Version of the last change already seen
+        :type since: int
+        :param batch_size: No. of rows fetched at once
+        :type batch_size: Optional[int]
+
+        :rtype: Iterator[Change]
         """
 
         cur = self.__conn.cursor()
-        query = """
-            SELECT id, first_name, last_name, date_added, personal, work, home, email, address
-            FROM Contacts JOIN Phone_numbers ON Contacts.id = Phone_numbers.c_id
-            WHERE personal LIKE ? OR work LIKE ? OR home LIKE ?
-            ORDER BY first_name, last_name;
+        cur.execute("SELECT version FROM Changes_horizon")
+        horizon = cur.fetchone()[0]
+        if since < horizon:
+            raise ValueError(
+                f"Changes up to version {horizon} have been compacted")
+        return self._iter_changes(since, batch_size or self.batch_size)
+
+    def _iter_changes(self, since: int, batch_size: int) -> Iterator[Change]:
+        cur = self.__conn.cursor()
+        try:
+            cur.execute("""SELECT version, table_name, op, key, data
+                        FROM Changes WHERE version > ? ORDER BY version""",
+                        (since,))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for version, table, op, key, data in rows:
+                    yield Change(version, table, op, json.loads(key),
+                                 json.loads(data) if data else None)
+        finally:
+            cur.close()
+
+    def compact_changes(self, upto: Optional[int] = None) -> int:
+        """Compacts the change log by dropping the entries superseded by
+        a later change of the same row, and all the entries up to
+        version `upto` if given. Returns the no. of entries dropped
+
+        Readers must treat inserts and updates alike (as upserts), as
+        only the latest change of a row is kept
+
+        :param upto: Version up to which all entries are dropped
+        :type upto: Optional[int]
+
+        :rtype: int
         """
-        param = f"%{phone}%"
-        cur.execute(query, (param, param, param))
-        data = [Contact(*row) for row in cur]
-        return data
 
-    def fetch_contacts(self, limit: int = 10) -> List[Contact]:
-        """Fetches and returns a maximum of `limit` contacts in sorted order
+        with self._atomic() as cur:
+            cur.execute("""DELETE FROM Changes WHERE version NOT IN (
+                    SELECT MAX(version) FROM Changes
+                    GROUP BY table_name, key)""")
+            dropped = cur.rowcount
+            if upto is not None:
+                cur.execute("DELETE FROM Changes WHERE version <= ?",
+                            (upto,))
+                dropped += cur.rowcount
+                cur.execute("""UPDATE Changes_horizon
+                        SET version = MAX(version, ?)""", (upto,))
+        return dropped
 
-        :param limit: Maximum number of contacts to fetch
-        :type limit: int
+    def iter_contacts(
+            self, limit: Optional[int] = None,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields a maximum of `limit` contacts (all of them if
+        `limit` is `None`) in sorted order
 
-        :returns: List of contacts found
-        :rtype: List[Contact]
+        :param limit: Maximum number of contacts to yield
+        :type limit: Optional[int]
+        :param batch_size: No. of rows fetched at once
+        :type batch_size: Optional[int]
+
+        :rtype: Iterator[Contact]
         """
 
-        cur = self.__conn.cursor()
-        query = """
-                SELECT id, first_name, last_name, date_added, personal, work, home, email, address
-                FROM Contacts JOIN Phone_numbers ON Contacts.id = Phone_numbers.c_id
-                ORDER BY first_name, last_name LIMIT ?
+        query = f"""
+                SELECT {CONTACT_COLUMNS}
+                FROM Contacts
+                ORDER BY first_key, last_key LIMIT ?
+            """
+        # A negative limit means no limit to SQLite
+        limit = -1 if limit is None else limit
+        return self._iter_contacts(query, (limit,), batch_size)
+
+    def _filtered_query(self, condition: str) -> str:
+        return f"""
+                SELECT {CONTACT_COLUMNS}
+                FROM Contacts WHERE {condition}
+                ORDER BY first_key, last_key LIMIT ?
             """
-        cur.execute(query, (limit,))
-        contacts = [Contact(*row) for row in cur]
-        return contacts
+
+    def iter_filtered(
+            self, condition: str, params: Sequence,
+            limit: Optional[int] = None,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts matching an SQL condition on the
+        Contacts table in sorted order, for the filters compiled by
+        `query.compile_filter`
+
+        :param condition: The condition, with `?` placeholders
+        :type condition: str
+        :param params: Values of the placeholders
+        :type params: Sequence
+        :param limit: Maximum number of contacts to yield
+        :type limit: Optional[int]
+
+        :rtype: Iterator[Contact]
+        """
+
+        limit = -1 if limit is None else limit
+        return self._iter_contacts(self._filtered_query(condition),
+                                   (*params, limit), batch_size)
+
+    def update_filtered(
+            self, condition: str, params: Sequence, field: str,
+            value: Optional[str], dry_run: bool = False) -> int:
+        """Sets `field` to `value` for all the contacts matching an SQL
+        condition on the Contacts table, with a single UPDATE inside a
+        transaction. Contacts which already have the value are left
+        alone
+
+        :param condition: The condition, e.g. compiled from a filter by
+         `query.compile_filter`
+        :type condition: str
+        :param params: Values of the placeholders of `condition`
+        :type params: Sequence
+        :param field: One of `BATCH_FIELDS`
+        :type field: str
+        :param value: The new value, `None` to clear the field
+        :type value: Optional[str]
+        :param dry_run: Only count the contacts which would be changed
+        :type dry_run: bool
+
+        :raises ValueError: If `field` can't be set or `first_name` would
+         be cleared
+
+        :returns: No. of contacts changed, or which would be changed
+        :rtype: int
+        """
+
+        if field not in BATCH_FIELDS:
+            raise ValueError(f"Can't set {field} for many contacts")
+        if field == "first_name" and not value:
+            raise ValueError("first_name can't be empty")
+        where = f"({condition}) AND {field} IS NOT ?"
+        params = (*params, value)
+        with self._atomic() as cur:
+            if dry_run:
+                cur.execute(f"SELECT COUNT(*) FROM Contacts WHERE {where}",
+                            params)
+                return cur.fetchone()[0]
+            assignments = f"{field} = ?, modified = ?"
+            values: List = [value, to_timestamp(datetime.now())]
+            if field in ("first_name", "last_name"):
+                assignments += f", {field[:-5]}_key = ?"
+                values.append(name_key(value))
+            cur.execute(f"UPDATE Contacts SET {assignments} WHERE {where}",
+                        (*values, *params))
+            return cur.rowcount
+
+    def add_country_code(
+            self, condition: str, params: Sequence, code: str,
+            dry_run: bool = False) -> int:
+        """Prefixes the country code `code` to the phone nos. without one
+        (i.e. with exactly 10 digits, see `COUNTRY_CODE`) of all the
+        contacts matching an SQL condition on the Contacts table, with a
+        single UPDATE inside a transaction. Numbers which would clash with
+        a number already stored are left alone
+
+        :param condition: The condition, e.g. compiled from a filter by
+         `query.compile_filter`
+        :type condition: str
+        :param params: Values of the placeholders of `condition`
+        :type params: Sequence
+        :param code: The country code, e.g. `91`
+        :type code: str
+        :param dry_run: Only count the numbers which would be changed
+        :type dry_run: bool
+
+        :raises ValueError: If `code` isn't a country code
+
+        :returns: No. of phone nos. changed, or which would be changed
+        :rtype: int
+        """
+
+        code = code.lstrip("+")
+        if not re.fullmatch(r"[1-9]\d{0,2}", code):
+            raise ValueError(f"Invalid country code: {code}")
+        where = f"""length(number_key) = 10
+                AND c_id IN (SELECT id FROM Contacts WHERE {condition})
+                AND NOT EXISTS (SELECT 1 FROM Phones AS Other
+                    WHERE Other.number_key = ? || Phones.number_key
+                    AND Other.kind = Phones.kind)"""
+        params = (*params, code)
+        with self._atomic() as cur:
+            if dry_run:
+                cur.execute(f"SELECT COUNT(*) FROM Phones WHERE {where}",
+                            params)
+                return cur.fetchone()[0]
+            cur.execute(f"""UPDATE Contacts SET modified = ?
+                    WHERE id IN (SELECT c_id FROM Phones WHERE {where})""",
+                        (to_timestamp(datetime.now()), *params))
+            cur.execute(f"""UPDATE Phones SET
+                        number = '+' || ? || '-' || number,
+                        number_key = ? || number_key
+                    WHERE {where}""", (code, code, *params))
+            return cur.rowcount
+
+    def explain_filtered(self, condition: str, params: Sequence) -> List[str]:
+        """Returns the steps of the query plan of `iter_filtered`, nested
+        steps are indented
+
+        :rtype: List[str]
+        """
+
+        return self.explain(self._filtered_query(condition), (*params, -1))
+
+    def explain(self, query: str, params: Sequence = ()) -> List[str]:
+        """Returns the steps of the query plan SQLite uses for `query`,
+        nested steps are indented
+
+        :param query: Any SQL statement
+        :type query: str
+        :param params: Its parameters, missing ones are taken as NULL
+        :type params: Sequence
+
+        :rtype: List[str]
+        """
+
+        cur = self.__conn.cursor()
+        cur.execute("EXPLAIN QUERY PLAN " + query, params)
+        depths: Dict[int, int] = {0: -1}
+        steps = []
+        for step_id, parent, _, detail in cur.fetchall():
+            depths[step_id] = depths.get(parent, -1) + 1
+            steps.append("  " * depths[step_id] + detail)
+        return steps
+
+    def iter_added_between(
+            self, start: datetime, end: Optional[datetime] = None,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_added_between`,
+        the range is searched through the index on date_added
+
+        :param start: Earliest time of addition
+        :type start: datetime
+        :param end: Time of addition up to which (exclusive) to fetch
+        :type end: Optional[datetime]
+        :param batch_size: No. of rows fetched at once
+        :type batch_size: Optional[int]
+
+        :rtype: Iterator[Contact]
+        """
+
+        query = f"""
+            SELECT {CONTACT_COLUMNS}
+            FROM Contacts
+            WHERE date_added >= ? AND date_added < ?
+            ORDER BY date_added
+        """
+        # Timestamps are 64-bit integers, so this is past any of them
+        end_ts = to_timestamp(end) if end else 2**63 - 1
+        params = (to_timestamp(start), end_ts)
+        return self._iter_contacts(query, params, batch_size)
 
     def get_contact_count(self) -> int:
-        """Returns the total number of contacts present in the database
+        """Returns the total number of contacts present in the database,
+        read from the counter maintained by triggers
 
         :returns: no. of contacts
         :rtype: int
         """
+        return self._get_counter("contacts")
+
+    def get_group_size(self, group_id: int) -> int:
+        """Returns the number of contacts in group with id `group_id`
+
+        :param group_id: Group ID
+        :type group_id: int
+
+        :returns: no. of contacts in the group
+        :rtype: int
+        """
+        return self._get_counter("group", str(group_id))
+
+    def get_country_code_counts(self) -> List[Tuple[str, int]]:
+        """Returns the number of contacts per country code of their
+        personal phone no., an empty code stands for numbers without one
+
+        :returns: List of (country_code, no. of contacts)
+        :rtype: List[Tuple[str, int]]
+        """
         cur = self.__conn.cursor()
-        query = "SELECT COUNT(*) FROM Contacts"
+        query = """SELECT key, value FROM Counters
+                WHERE name = 'country_code' AND value > 0
+                ORDER BY value DESC, key"""
         cur.execute(query)
+        return cur.fetchall()
+
+    def _get_counter(self, name: str, key: str = "") -> int:
+        cur = self.__conn.cursor()
+        query = "SELECT value FROM Counters WHERE name = ? AND key = ?"
+        cur.execute(query, (name, key))
         data = cur.fetchone()
         if data:
             return data[0]
         return 0
 
+    def check_counters(self) -> List[Tuple[str, str, int, int]]:
+        """Compares the stored counters with the actual counts, returns
+        the ones which differ
+
+        :returns: List of (name, key, stored value, actual value)
+        :rtype: List[Tuple[str, str, int, int]]
+        """
+        cur = self.__conn.cursor()
+        query = f"""
+            WITH Actual(name, key, value) AS ({COUNTERS_QUERY})
+            SELECT name, key, Counters.value, COALESCE(Actual.value, 0)
+            FROM Counters LEFT JOIN Actual USING(name, key)
+            WHERE Counters.value <> COALESCE(Actual.value, 0)
+            UNION ALL
+            SELECT name, key, 0, Actual.value
+            FROM Actual LEFT JOIN Counters USING(name, key)
+            WHERE Counters.value IS NULL AND Actual.value <> 0
+        """
+        cur.execute(query)
+        return cur.fetchall()
+
+    def rebuild_counters(self) -> None:
+        """Recomputes all the counters from the data"""
+
+        with self._atomic() as cur:
+            cur.execute("DELETE FROM Counters")
+            cur.execute(
+                f"INSERT INTO Counters(name, key, value) {COUNTERS_QUERY}")
+            cur.execute("INSERT OR IGNORE INTO Counters "
+                        "VALUES('contacts', '', 0)")
+
     def create_contact(self, contact: Contact) -> bool:
         """Creates and stores a new contact into the database, returns 
         `True` if contact is created successfully `False` otherwise
@@ -161,15 +1848,25 @@ class DataManager:
         :rtype: bool
         """
         try:
-            cur = self.__conn.cursor()
-            query = "INSERT INTO Contacts VALUES(?, ?, ?, ?, ?, ?)"
-            params = (contact.db_id, contact.first_name, contact.last_name,
-                      contact.email, contact.address, contact.date_added)
-            cur.execute(query, params)
-            query = "INSERT INTO Phone_numbers VALUES(?, ?, ?, ?)"
-            params = (contact.db_id, contact.phone_personal,
-                      contact.phone_work, contact.phone_home)
-            cur.execute(query, params)
+            with self._atomic() as cur:
+                # A contact reusing the id of a deleted one (i.e. restored
+                # from the trash) takes over its uid
+                query = """INSERT INTO Contacts(id, first_name, last_name,
+                        email, address, date_added, modified, first_key,
+                        last_key, uid)
+                        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, (SELECT uid
+                            FROM Deleted_contacts WHERE id = ?))"""
+                params = (contact.db_id, contact.first_name,
+                          contact.last_name, contact.email,
+                          contact.address, contact.added_timestamp,
+                          to_timestamp(datetime.now()),
+                          name_key(contact.first_name),
+                          name_key(contact.last_name), contact.db_id)
+                cur.execute(query, params)
+                self._insert_phones(cur, contact)
+                # The id may be reused after the last contact is deleted
+                query = "DELETE FROM Deleted_contacts WHERE id = ?"
+                cur.execute(query, (contact.db_id,))
             return True
         except sqlite3.Error:
             return False
@@ -188,40 +1885,305 @@ class DataManager:
         """
 
         try:
-            cur = self.__conn.cursor()
-            # Updating the Contacts table
-            query = """UPDATE Contacts
-                    SET first_name = ?, last_name = ?, email = ?, address = ?
-                    WHERE id = ?"""
-            params = (contact.first_name, contact.last_name,
-                      contact.email, contact.address, contact.db_id)
-            cur.execute(query, params)
+            with self._atomic() as cur:
+                # Updating the Contacts table
+                query = """UPDATE Contacts
+                        SET first_name = ?, last_name = ?, email = ?,
+                            address = ?, modified = ?, first_key = ?,
+                            last_key = ?
+                        WHERE id = ?"""
+                params = (contact.first_name, contact.last_name,
+                          contact.email, contact.address,
+                          to_timestamp(datetime.now()),
+                          name_key(contact.first_name),
+                          name_key(contact.last_name), contact.db_id)
+                cur.execute(query, params)
 
-            # Updating the Phone_numbers table
-            query = """UPDATE Phone_numbers
-                    SET personal = ?, work = ?, home =?
-                    WHERE c_id = ?"""
-            params = (contact.phone_personal, contact.phone_work,
-                      contact.phone_home, contact.db_id)
-            cur.execute(query, params)
+                # Only touching the personal, work and home numbers that
+                # changed, so unchanged ones keep their rows (and their
+                # order) and aren't logged as changes
+                numbers = (contact.phone_personal, contact.phone_work,
+                           contact.phone_home)
+                query = """INSERT INTO Phones(c_id, kind, number, number_key)
+                        VALUES(?, ?, ?, ?)
+                        ON CONFLICT(c_id, kind)
+                            WHERE kind IN ('personal', 'work', 'home')
+                        DO UPDATE SET number = excluded.number,
+                            number_key = excluded.number_key
+                        WHERE number IS NOT excluded.number"""
+                cur.executemany(query, [
+                    (contact.db_id, kind, number, phone_key(number))
+                    for kind, number in zip(PHONE_SLOTS, numbers) if number])
+                query = "DELETE FROM Phones WHERE c_id = ? AND kind = ?"
+                cur.executemany(query, [
+                    (contact.db_id, kind)
+                    for kind, number in zip(PHONE_SLOTS, numbers)
+                    if not number])
             return True
         except sqlite3.Error:
             return False
 
     def delete_contact(self, contact: Contact) -> None:
-        """Deletes a given contact from the database"""
+        """Deletes a given contact from the database, its phone numbers,
+        group memberships and rank are deleted along with it"""
+
+        with self._atomic() as cur:
+            # Leaving a tombstone, so syncing doesn't bring the contact back
+            query = """INSERT OR REPLACE INTO Deleted_contacts(id, modified,
+                        uid)
+                    SELECT id, ?, uid FROM Contacts WHERE id = ?"""
+            cur.execute(query, (to_timestamp(datetime.now()), contact.db_id))
+            query = "DELETE FROM Contacts WHERE id = ?"
+            cur.execute(query, (contact.db_id, ))
+
+    def _in_chunks(
+            self, ids: List[int],
+            delete: Callable[[sqlite3.Cursor, str], int],
+            chunk_size: int,
+            progress: Optional[Callable[[int, int], None]]) -> int:
+        """Calls `delete` with the ids in `ids` a chunk at a time (as a
+        JSON array, so chunks of any size fit in a single parameter) and
+        commits after each chunk, so other connections are never locked
+        out for the whole deletion. Returns the total of `delete`"""
+
+        if self._transactions:
+            raise RuntimeError("Bulk deletes commit after every chunk, they"
+                               " can't run inside a transaction")
+        deleted = 0
+        for start in range(0, len(ids), chunk_size):
+            chunk = json.dumps(ids[start:start + chunk_size])
+            with self._atomic() as cur:
+                deleted += delete(cur, chunk)
+            self.__conn.commit()
+            if progress:
+                progress(min(start + chunk_size, len(ids)), len(ids))
+        return deleted
+
+    def delete_contacts(
+            self, ids: Iterable[int], chunk_size: int = DELETE_CHUNK,
+            progress: Optional[Callable[[int, int], None]] = None,
+            trash: bool = False) -> int:
+        """Deletes the contacts with ids in `ids`, `chunk_size` of them
+        per transaction, their phone numbers, group memberships and ranks
+        are deleted along with them. Changes made before are committed
+        too
+
+        :param ids: ids of the contacts
+        :type ids: Iterable[int]
+        :param chunk_size: No. of contacts deleted per transaction
+        :type chunk_size: int
+        :param progress: Called with the no. of ids processed and the
+         total after each chunk
+        :type progress: Optional[Callable[[int, int], None]]
+        :param trash: Move the contacts to the trash instead
+        :type trash: bool
+
+        :raises RuntimeError: If called inside `transaction`
+
+        :returns: No. of contacts deleted
+        :rtype: int
+        """
+
+        def delete(cur: sqlite3.Cursor, chunk: str) -> int:
+            selected = "id IN (SELECT value FROM json_each(?))"
+            if trash:
+                self._trash(cur, selected, (chunk,))
+            cur.execute(f"""INSERT OR REPLACE INTO Deleted_contacts(id,
+                        modified, uid)
+                    SELECT id, ?, uid FROM Contacts WHERE {selected}""",
+                        (to_timestamp(datetime.now()), chunk))
+            cur.execute(f"DELETE FROM Contacts WHERE {selected}", (chunk,))
+            return cur.rowcount
+
+        return self._in_chunks(list(ids), delete, chunk_size, progress)
+
+    def delete_filtered(
+            self, condition: str, params: Sequence,
+            chunk_size: int = DELETE_CHUNK,
+            progress: Optional[Callable[[int, int], None]] = None,
+            dry_run: bool = False, trash: bool = False) -> int:
+        """Deletes all the contacts matching an SQL condition on the
+        Contacts table in chunks, see `delete_contacts`
+
+        :param condition: The condition, e.g. compiled from a filter by
+         `query.compile_filter`
+        :type condition: str
+        :param params: Values of the placeholders of `condition`
+        :type params: Sequence
+        :param dry_run: Only count the contacts which would be deleted
+        :type dry_run: bool
+        :param trash: Move the contacts to the trash instead
+        :type trash: bool
+
+        :returns: No. of contacts deleted, or which would be deleted
+        :rtype: int
+        """
+
+        cur = self.__conn.cursor()
+        cur.execute(f"SELECT id FROM Contacts WHERE {condition}", params)
+        ids = [row[0] for row in cur.fetchall()]
+        if dry_run:
+            return len(ids)
+        return self.delete_contacts(ids, chunk_size, progress, trash)
+
+    def _trash(self, cur: sqlite3.Cursor, selected: str,
+               params: tuple) -> None:
+        """Copies the contacts matching the condition `selected` into
+        the trash, before they are deleted"""
+
+        cur.execute(f"""INSERT INTO Trash(c_id, deleted, data)
+                SELECT id, ?, {TRASH_DATA} FROM Contacts WHERE {selected}""",
+                    (to_timestamp(datetime.now()), *params))
+
+    def trash_contact(self, contact: Contact) -> bool:
+        """Moves a contact to the trash along with its phone nos. and
+        groups, from where it can be restored with `restore_contact`
+
+        :param contact: The contact to delete
+        :type contact: Contact
+
+        :returns: `False` if there is no such contact
+        :rtype: bool
+        """
+
+        with self._atomic() as cur:
+            self._trash(cur, "id = ?", (contact.db_id,))
+            if not cur.rowcount:
+                return False
+            self.delete_contact(contact)
+        return True
+
+    def fetch_trash(self, trash_id: Optional[int] = None) -> List[TrashEntry]:
+        """Returns the entries of the trash, most recently deleted first,
+        or just the one with id `trash_id`
+
+        :rtype: List[TrashEntry]
+        """
 
         cur = self.__conn.cursor()
+        query = "SELECT trash_id, c_id, deleted, data FROM Trash"
+        if trash_id is None:
+            cur.execute(query + " ORDER BY trash_id DESC")
+        else:
+            cur.execute(query + " WHERE trash_id = ?", (trash_id,))
+        return [trash_entry(tid, cid, deleted, json.loads(data))
+                for tid, cid, deleted, data in cur.fetchall()]
+
+    def remove_from_trash(self, trash_id: int) -> None:
+        """Removes an entry from the trash for good"""
+
+        cur = self.__conn.cursor()
+        cur.execute("DELETE FROM Trash WHERE trash_id = ?", (trash_id,))
+
+    def purge_trash(
+            self, older_than: Optional[datetime] = None,
+            chunk_size: int = DELETE_CHUNK,
+            progress: Optional[Callable[[int, int], None]] = None) -> int:
+        """Removes the entries deleted before `older_than` (all of them
+        if `None`) from the trash for good, `chunk_size` of them per
+        transaction. Changes made before are committed too
+
+        :param older_than: Time before which entries are purged
+        :type older_than: Optional[datetime]
+        :param chunk_size: No. of entries removed per transaction
+        :type chunk_size: int
+        :param progress: Called with the no. of entries removed and the
+         total after each chunk
+        :type progress: Optional[Callable[[int, int], None]]
+
+        :raises RuntimeError: If called inside `transaction`
+
+        :returns: No. of entries removed
+        :rtype: int
+        """
+
+        cur = self.__conn.cursor()
+        if older_than is None:
+            cur.execute("SELECT trash_id FROM Trash")
+        else:
+            cur.execute("SELECT trash_id FROM Trash WHERE deleted < ?",
+                        (to_timestamp(older_than),))
+        ids = [row[0] for row in cur.fetchall()]
+
+        def delete(cur: sqlite3.Cursor, chunk: str) -> int:
+            cur.execute("""DELETE FROM Trash
+                    WHERE trash_id IN (SELECT value FROM json_each(?))""",
+                        (chunk,))
+            return cur.rowcount
+
+        return self._in_chunks(ids, delete, chunk_size, progress)
+
+    def page_stats(self) -> Tuple[int, int, int]:
+        """Returns the (page_count, freelist_count, page_size) of the
+        database, its size is page_count * page_size bytes of which the
+        pages in the freelist are unused
+
+        :rtype: Tuple[int, int, int]
+        """
+
+        cur = self.__conn.cursor()
+        return tuple(cur.execute(f"PRAGMA {name}").fetchone()[0]
+                     for name in ("page_count", "freelist_count",
+                                  "page_size"))  # type: ignore[return-value]
+
+    def optimize(self, analysis_limit: Optional[int] = None) -> str:
+        """Refreshes the statistics used by the query planner, with a
+        full ANALYZE the first time and `PRAGMA optimize` (which only
+        analyzes the tables needing it) afterwards. Returns which one ran
+
+        :param analysis_limit: Approximate no. of rows of each index
+         analyzed, all of them if `None`
+        :type analysis_limit: Optional[int]
+
+        :rtype: str
+        """
+
+        self.__conn.commit()
+        cur = self.__conn.cursor()
+        cur.execute("""SELECT 1 FROM sqlite_master
+                WHERE type = 'table' AND name = 'sqlite_stat1'""")
+        statement = "PRAGMA optimize" if cur.fetchone() else "ANALYZE"
+        cur.execute(f"PRAGMA analysis_limit = {int(analysis_limit or 0)}")
+        try:
+            cur.execute(statement)
+        finally:
+            cur.execute("PRAGMA analysis_limit = 0")
+        self.__conn.commit()
+        return statement
+
+    def incremental_vacuum(
+            self, pages: Optional[int] = None, convert: bool = True) -> int:
+        """Returns up to `pages` (all if `None`) unused pages to the file
+        system. Databases not created with `auto_vacuum = INCREMENTAL`
+        are switched to it first if `convert` is `True`, which takes a
+        full VACUUM locking the database until it is done, and left
+        alone otherwise. Changes made before are committed
+
+        :param pages: Maximum no. of pages freed
+        :type pages: Optional[int]
+        :param convert: Switch the database to `auto_vacuum = INCREMENTAL`
+        :type convert: bool
+
+        :raises RuntimeError: If called inside `transaction`
 
-        # Deleting the phone numbers from Phone_numbers table
-        query = "DELETE FROM Phone_numbers WHERE c_id = ?"
-        cur.execute(query, (contact.db_id, ))
-        # Removing the user from all groups
-        query = "DELETE FROM Group_members WHERE c_id = ?"
-        cur.execute(query, (contact.db_id, ))
-        # Deleting the actual contact
-        query = "DELETE FROM Contacts WHERE id = ?"
-        cur.execute(query, (contact.db_id, ))
+        :returns: No. of pages the database shrank by
+        :rtype: int
+        """
+
+        if self._transactions:
+            raise RuntimeError("VACUUM can't run inside a transaction")
+        self.__conn.commit()
+        before = self.page_stats()[0]
+        cur = self.__conn.cursor()
+        if cur.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if not convert:
+                return 0
+            cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cur.execute("VACUUM")
+        else:
+            cur.execute(f"PRAGMA incremental_vacuum({pages or 0})").fetchall()
+        self.__conn.commit()
+        return before - self.page_stats()[0]
 
     def get_new_id(self) -> int:
         """Returns a new id for the contact to use
@@ -230,12 +2192,17 @@ class DataManager:
         :rtype: int
         """
         cur = self.__conn.cursor()
-        cur.execute("SELECT id FROM Contacts")
-        data = cur.fetchall()
-        # Select the last id from contact
-        # Generate new id by adding 1 to it
-        if data:
-            new_id = data[-1][0] + 1
+        # The largest ids are the last entries of the primary keys, so
+        # this doesn't scan the tables. Ids of deleted contacts aren't
+        # reused, so syncing tells the contacts apart
+        cur.execute("""SELECT MAX(id) FROM (
+                SELECT MAX(id) AS id FROM Contacts
+                UNION ALL
+                SELECT MAX(id) FROM Deleted_contacts)""")
+        data = cur.fetchone()
+        # Generate new id by adding 1 to the last id
+        if data[0] is not None:
+            new_id = data[0] + 1
         else:
             new_id = 1
         return new_id
@@ -283,35 +2250,79 @@ class DataManager:
         with id `group_id`"""
 
         cur = self.__conn.cursor()
-        query = "DELETE FORM Group_members WHERE g_id = ? AND c_id = ?"
+        query = "DELETE FROM Group_members WHERE g_id = ? AND c_id = ?"
         cur.execute(query, (group_id, contact_id))
 
-    def get_contacts_from_group(self, group_id: int) -> List[Contact]:
-        """Fetches and returns all the contacts from group with id `group_id`
+    def iter_contacts_from_group(
+            self, group_id: int,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts from group with id `group_id`
 
         :param group_id: The group_id from which to fetch contacts
         :type group_id: int
-        :returns: List of present contacts
-        :rtype: List[Contact]"""
+        :param batch_size: No. of rows fetched at once
+        :type batch_size: Optional[int]
 
-        cur = self.__conn.cursor()
-        query = """
-            SELECT id, first_name, last_name, date_added, personal, work, home, email, address
-            FROM Contacts JOIN Phone_numbers ON Contacts.id = Phone_numbers.c_id
+        :rtype: Iterator[Contact]"""
+
+        query = f"""
+            SELECT {CONTACT_COLUMNS}
+            FROM Contacts
             WHERE id IN (SELECT c_id FROM Group_members WHERE g_id = ?)
         """
-        cur.execute(query, (group_id, ))
-        contacts = [Contact(*row) for row in cur]
-        return contacts
+        return self._iter_contacts(query, (group_id,), batch_size)
 
     def delete_group(self, group_id: int) -> None:
-        """Deletes a group with id `group_id`"""
+        """Deletes a group with id `group_id`, its memberships are deleted
+        along with it"""
 
         cur = self.__conn.cursor()
-        query1 = "DELETE FROM Group_members WHERE g_id = ?"
-        query2 = "DELETE FROM Groups WHERE id = ?"
-        cur.execute(query1, (group_id,))
-        cur.execute(query2, (group_id,))
+        cur.execute("DELETE FROM Groups WHERE id = ?", (group_id,))
+
+    def delete_group_in_chunks(
+            self, group_id: int, chunk_size: int = DELETE_CHUNK,
+            progress: Optional[Callable[[int, int], None]] = None) -> int:
+        """Deletes a large group, removing `chunk_size` of its members per
+        transaction before deleting the group itself. Changes made before
+        are committed too
+
+        :param group_id: id of the group
+        :type group_id: int
+        :param chunk_size: No. of members removed per transaction
+        :type chunk_size: int
+        :param progress: Called with the no. of members removed and the
+         total after each chunk
+        :type progress: Optional[Callable[[int, int], None]]
+
+        :raises RuntimeError: If called inside `transaction`
+
+        :returns: No. of members the group had
+        :rtype: int
+        """
+
+        cur = self.__conn.cursor()
+        cur.execute("SELECT c_id FROM Group_members WHERE g_id = ?",
+                    (group_id,))
+        ids = [row[0] for row in cur.fetchall()]
+
+        def delete(cur: sqlite3.Cursor, chunk: str) -> int:
+            cur.execute("""DELETE FROM Group_members WHERE g_id = ?
+                    AND c_id IN (SELECT value FROM json_each(?))""",
+                        (group_id, chunk))
+            return cur.rowcount
+
+        removed = self._in_chunks(ids, delete, chunk_size, progress)
+        self.delete_group(group_id)
+        self.__conn.commit()
+        return removed
+
+    def commit(self) -> None:
+        """Commits the pending changes, so that other connections (e.g.
+        backups) can see them"""
 
-    def __del__(self):
         self.__conn.commit()
+
+    def __del__(self):
+        # There is no connection if the database couldn't be opened
+        if hasattr(self, "_DataManager__conn"):
+            self.__conn.commit()
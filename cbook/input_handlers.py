@@ -2,9 +2,15 @@
 beginning with `ask_*` used by different other
 functions"""
 import configparser as cf
-from pathlib import Path
 import re
-from typing import Optional
+from typing import Callable, List, Optional
+
+try:
+    import readline
+except ImportError:     # Not available on Windows
+    readline = None  # type: ignore[assignment]
+
+from config import CONF_PATH
 
 
 def ask_int(
@@ -37,12 +43,12 @@ def ask_int(
         except ValueError:
             print("Invalid integer")
             continue
-        # Chiecking for low and high if defined
-        if low and data < low:
+        # Chiecking for low and high if defined, 0 is a bound too
+        if low is not None and data < low:
             print(f"Minimum: {low}")
             continue
 
-        if high and data > high:
+        if high is not None and data > high:
             print(f"Maximum: {high}")
             continue
 
@@ -125,7 +131,7 @@ def ask_phone_no(
             code, ph_no = match.groups()
             if not code:
                 # If country code is not present, it will be added
-                conf_path = Path.home() / ".cbook_conf.ini"
+                conf_path = CONF_PATH
                 with conf_path.open() as cfile:
                     parser = cf.ConfigParser()
                     parser.read_file(cfile)
@@ -141,15 +147,51 @@ def ask_phone_no(
     return default
 
 
+def _input_with_completion(
+        prompt: str, completer: Callable[[str], List[str]]) -> str:
+    """Reads a line like `input`, pressing <Tab> completes the whole
+    line typed so far with the suggestions of `completer`"""
+
+    if readline is None:
+        return input(prompt)
+
+    matches: List[str] = []
+
+    def complete(text: str, state: int) -> Optional[str]:
+        # Called with state 0, 1, 2, ... until it returns `None`
+        if state == 0:
+            matches[:] = completer(readline.get_line_buffer())
+        return matches[state] if state < len(matches) else None
+
+    old_completer = readline.get_completer()
+    old_delims = readline.get_completer_delims()
+    readline.set_completer(complete)
+    # Names contain spaces, so the whole line is completed at once
+    readline.set_completer_delims("")
+    readline.parse_and_bind("tab: complete")
+    try:
+        return input(prompt)
+    finally:
+        readline.set_completer(old_completer)
+        readline.set_completer_delims(old_delims)
+
+
 def ask_text(
         prompt: str = "",
         required: bool = False,
-        default: Optional[str] = None) -> Optional[str]:
+        default: Optional[str] = None,
+        completer: Optional[Callable[[str], List[str]]] = None
+        ) -> Optional[str]:
     """Prompts the user to enter a text, if no text is entered
-    and required is False, returns default otherwise text"""
+    and required is False, returns default otherwise text. If a
+    `completer` is given, it's called with the text typed so far to
+    suggest completions when <Tab> is pressed"""
 
     while True:
-        text = input(prompt)
+        if completer:
+            text = _input_with_completion(prompt, completer)
+        else:
+            text = input(prompt)
         # Checking for empty string
         if not text:
             if required:
@@ -0,0 +1,250 @@
+"""
+This module measures where the time of the application goes. Every
+public method of the storage backend and every option of the menu can be
+wrapped so that its calls are counted and their latencies recorded in
+histograms, and the SQL statements run by SQLite can be timed too. The
+figures are shown by the "Show performance stats" option and dumped as
+JSON when the application exits
+"""
+import collections.abc
+from contextlib import AbstractContextManager, contextmanager
+import functools
+import inspect
+import json
+import math
+from pathlib import Path
+import re
+import time
+from typing import (
+    Callable, ContextManager, Dict, Iterator, List, Optional, Tuple, Union)
+
+from datamanager import StorageBackend
+
+# Buckets of the histograms per doubling of the latency, the percentiles
+# are within 2 ** (1 / 8) - 1 = 9% of the actual values
+BUCKETS_PER_DOUBLING = 8
+# Upper bound of the first bucket, in seconds
+MIN_LATENCY = 1e-7
+# Longest SQL statement kept in the stats, in characters
+MAX_STATEMENT = 200
+
+# Kinds of the timed operations, which prefix their names in the stats
+METHOD, OPTION, SQL = "method", "option", "sql"
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class Histogram:
+    """Latencies of the calls to an operation in logarithmic buckets,
+    so any number of calls takes a bounded amount of memory"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # keys: bucket no., values: no. of latencies in it
+        self._buckets: Dict[int, int] = dict()
+
+    def add(self, seconds: float) -> None:
+        """Records a latency"""
+
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        bucket = 0
+        if seconds > MIN_LATENCY:
+            bucket = math.ceil(
+                math.log2(seconds / MIN_LATENCY) * BUCKETS_PER_DOUBLING)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def percentile(self, q: float) -> float:
+        """Returns the latency below which a fraction `q` of the calls
+        took, e.g. the median for 0.5
+
+        :param q: Fraction between 0 and 1
+        :type q: float
+
+        :rtype: float
+        """
+
+        if not self.count:
+            return 0.0
+        rank = max(math.ceil(q * self.count), 1)
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                break
+        upper = MIN_LATENCY * 2 ** (bucket / BUCKETS_PER_DOUBLING)
+        return min(upper, self.max)
+
+    def summary(self) -> Dict[str, float]:
+        """Returns the count, total, p50, p95, p99 and max of the
+        latencies in seconds"""
+
+        return {"count": self.count, "total": self.total,
+                "p50": self.percentile(0.5), "p95": self.percentile(0.95),
+                "p99": self.percentile(0.99), "max": self.max}
+
+
+class Stats:
+    """Histograms of the timed operations by their names, e.g.
+    `method:fetch_by_name` or `option:List contacts`"""
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = dict()
+        # The SQL statement running and when it started, see `sql_started`
+        self._statement: Optional[Tuple[str, float]] = None
+
+    def record(self, kind: str, name: str, seconds: float) -> None:
+        """Records a call to the operation `name` of kind `kind`"""
+
+        key = f"{kind}:{name}"
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.add(seconds)
+
+    def sql_started(self, statement: str) -> None:
+        """Trace callback timing the SQL statements. A statement is timed
+        until the next one starts or the instrumented call running it
+        returns, as SQLite doesn't report when a statement ends, so the
+        time spent reading its rows is included"""
+
+        now = time.perf_counter()
+        self.sql_finished(now)
+        statement = _LITERALS.sub("?", " ".join(statement.split()))
+        self._statement = (statement[:MAX_STATEMENT], now)
+
+    def sql_finished(self, now: Optional[float] = None) -> None:
+        """Stops timing the running SQL statement, if any"""
+
+        if self._statement is not None:
+            statement, start = self._statement
+            self._statement = None
+            self.record(SQL, statement,
+                        (now or time.perf_counter()) - start)
+
+    def rows(self, kind: Optional[str] = None) -> List[Tuple[str, dict]]:
+        """Returns the (name, summary) of the operations of kind `kind`
+        (all of them if `None`), the most time consuming first"""
+
+        rows = [(key, histogram.summary())
+                for key, histogram in self.histograms.items()
+                if kind is None or key.startswith(f"{kind}:")]
+        rows.sort(key=lambda row: row[1]["total"], reverse=True)
+        return rows
+
+    def dump(self, path: Union[str, Path]) -> None:
+        """Writes the summaries of all the operations to `path` as JSON"""
+
+        with Path(path).open("w") as file:
+            json.dump(dict(self.rows()), file, indent=2)
+
+    def reset(self) -> None:
+        """Forgets everything recorded so far"""
+
+        self.histograms.clear()
+        self._statement = None
+
+
+STATS = Stats()
+
+
+def _timed_items(items: Iterator, elapsed: float,
+                 finish: Callable[[float], None]) -> Iterator:
+    """Yields the `items`, adding the time spent producing them to
+    `elapsed` and calling `finish` with the total once they are
+    exhausted or the generator is closed"""
+
+    start = time.perf_counter()
+    try:
+        for item in items:
+            elapsed += time.perf_counter() - start
+            yield item
+            start = time.perf_counter()
+        elapsed += time.perf_counter() - start
+    finally:
+        finish(elapsed)
+
+
+@contextmanager
+def _timed_context(context: ContextManager, elapsed: float,
+                   finish: Callable[[float], None]) -> Iterator:
+    """Enters `context` and calls `finish` with `elapsed` plus the time
+    spent until it is exited, the body of the block included"""
+
+    start = time.perf_counter()
+    try:
+        with context as value:
+            yield value
+    finally:
+        finish(elapsed + time.perf_counter() - start)
+
+
+def timed(kind: str, name: str, func: Callable,
+          stats: Stats = STATS) -> Callable:
+    """Wraps `func` so that the latency of each call is recorded under
+    `name`. When `func` returns an iterator (other than a sized
+    container), e.g. a generator streaming rows, the time spent producing
+    the items is recorded once it is exhausted or closed, the time the
+    caller spends between the items isn't counted. When it returns a
+    context manager, e.g. `transaction`, the whole `with` block is timed"""
+
+    def finish(elapsed: float) -> None:
+        stats.sql_finished()
+        stats.record(kind, name, elapsed)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            finish(time.perf_counter() - start)
+            raise
+        elapsed = time.perf_counter() - start
+        if isinstance(result, AbstractContextManager):
+            return _timed_context(result, elapsed, finish)
+        if isinstance(result, collections.abc.Iterator) \
+                and not isinstance(result, collections.abc.Sized):
+            return _timed_items(result, elapsed, finish)
+        finish(elapsed)
+        return result
+    return wrapper
+
+
+def instrument_backend(dmgr: StorageBackend, stats: Stats = STATS,
+                       trace_sql: bool = False) -> StorageBackend:
+    """Wraps every public method of `dmgr` (on the instance, so every
+    module holding it is instrumented) to record its latencies
+
+    :param dmgr: The contact book
+    :type dmgr: StorageBackend
+    :param stats: Where the latencies are recorded
+    :type stats: Stats
+    :param trace_sql: Also time every SQL statement, which slows down
+     statements a little
+    :type trace_sql: bool
+
+    :returns: `dmgr`
+    :rtype: StorageBackend
+    """
+
+    if trace_sql:
+        dmgr.set_trace_callback(stats.sql_started)
+    for name, _ in inspect.getmembers(type(dmgr), inspect.isfunction):
+        if not name.startswith("_"):
+            setattr(dmgr, name, timed(METHOD, name,
+                                      getattr(dmgr, name), stats))
+    return dmgr
+
+
+def instrument_options(options: Dict[str, Callable],
+                       stats: Stats = STATS) -> None:
+    """Wraps the handlers of the menu options in `options` in place to
+    record their latencies, which include the time the user takes to
+    answer the prompts"""
+
+    for text, handler in options.items():
+        options[text] = timed(OPTION, text, handler, stats)
@@ -0,0 +1,273 @@
+"""
+This module contains the search-as-you-type mode, the search is re-run
+after every keystroke and only the results visible on the screen are
+rendered, so it stays responsive for large contact books
+"""
+import sqlite3
+import time
+from typing import Iterator, List, Optional
+
+try:
+    import curses
+except ImportError:     # Not available on Windows
+    curses = None  # type: ignore[assignment]
+
+from datamanager import Contact, StorageBackend, name_key
+
+# Seconds without a keystroke before the search is run
+DEBOUNCE = 0.12
+# No. of results fetched between checks for new keystrokes
+CHUNK = 200
+# No. of SQLite instructions between checks for new keystrokes
+PROGRESS_STEPS = 20000
+
+ESCAPE = 27
+
+
+class IncrementalSearch:
+    """Runs the searches of one mode (by name or by phone no.), when
+    the query is extended the previous results are narrowed down in
+    memory instead of searching the whole book again
+
+    Results are fetched `step` by `step`, so a search made stale by a
+    new keystroke can be dropped before it finishes"""
+
+    def __init__(self, dmgr: StorageBackend, by_phone: bool = False):
+        self.dmgr = dmgr
+        self.by_phone = by_phone
+        self.query: Optional[str] = None
+        self.results: List[Contact] = []
+        # Whether `results` holds all the matches of `query`
+        self.complete = False
+        # No. of searches answered without querying the book
+        self.narrowed = 0
+        # Whether `results` are exact matches of a phone no.
+        self._exact = False
+        self._source: Optional[Iterator[Contact]] = None
+
+    def _matches(self, contact: Contact, query: str) -> bool:
+        """Same test as the backend's search by name or partial phone
+        no., for the fields of `Contact` (numbers other than personal,
+        work and home are only matched by searching the book again)"""
+
+        if self.by_phone:
+            numbers = (contact.phone_personal, contact.phone_work,
+                       contact.phone_home)
+            return any(query in number for number in numbers if number)
+        key = name_key(query)
+        return key in name_key(contact.first_name) or (
+            contact.last_name is not None
+            and key in name_key(contact.last_name))
+
+    def _narrowable(self, query: str) -> bool:
+        if not self.complete or self.query is None:
+            return False
+        if self.by_phone:
+            return self.query in query
+        return name_key(self.query) in name_key(query)
+
+    def start(self, query: str) -> None:
+        """Starts searching for `query`, dropping the unfinished search
+        for the previous query"""
+
+        self.cancel()
+        if self.by_phone:
+            # Exact matches take precedence, like in `fetch_by_phone_no`,
+            # and are found through the index at once
+            try:
+                exact = list(self.dmgr.iter_by_exact_phone(query))
+            except sqlite3.OperationalError:
+                # Interrupted by the next keystroke
+                self.results, self.complete, self.query = [], False, None
+                return
+            if exact:
+                self.results, self.complete, self._exact = exact, True, True
+                self.query = query
+                return
+            if self._exact:
+                # Exact matches can't be narrowed into partial ones
+                self.complete = self._exact = False
+        if self._narrowable(query):
+            self.results = [contact for contact in self.results
+                            if self._matches(contact, query)]
+            self.narrowed += 1
+        else:
+            self.results = []
+            self.complete = False
+            if self.by_phone:
+                # Only partial matches are left
+                self._source = self.dmgr.iter_by_phone_no(query)
+            else:
+                self._source = self.dmgr.iter_by_name(query)
+        self.query = query
+
+    def step(self, count: int = CHUNK) -> bool:
+        """Fetches up to `count` more results, returns `True` once there
+        is nothing more to fetch, i.e. the search is `complete` or was
+        cancelled. A search interrupted through the backend's progress
+        handler counts as cancelled"""
+
+        if self._source is None:
+            return True
+        try:
+            for _ in range(count):
+                self.results.append(next(self._source))
+            return False
+        except StopIteration:
+            self._source = None
+            self.complete = True
+        except sqlite3.OperationalError:
+            self.cancel()
+        return True
+
+    def cancel(self) -> None:
+        """Drops the unfinished search, closing its cursor"""
+
+        if self._source is not None:
+            # Closing the generator closes its cursor
+            close = getattr(self._source, "close", None)
+            if close:
+                close()
+            self._source = None
+        if not self.complete:
+            self.query = None
+
+    def run(self, query: str) -> List[Contact]:
+        """Searches for `query` to the end and returns all the results"""
+
+        self.start(query)
+        while not self.step():
+            pass
+        return self.results
+
+
+def _contact_line(contact: Contact, width: int) -> str:
+    name = contact.first_name
+    if contact.last_name:
+        name += f" {contact.last_name}"
+    return f"{name:<32} {contact.phone_personal or ''}"[:width - 1]
+
+
+def _search_screen(
+        stdscr, dmgr: StorageBackend, by_phone: bool) -> Optional[Contact]:
+    """Runs the search screen until a contact is selected with <Enter>
+    or the search is left with <Esc>"""
+
+    searches = {False: IncrementalSearch(dmgr),
+                True: IncrementalSearch(dmgr, by_phone=True)}
+    search = searches[by_phone]
+    query = ""
+    pending = True          # The search is behind the query
+    last_key = 0.0
+    selected = top = 0
+    started = elapsed = 0.0
+
+    def key_pressed() -> int:
+        # Called by SQLite while a query runs, interrupts it if a key
+        # is waiting to be read
+        stdscr.nodelay(True)
+        key = stdscr.getch()
+        if key == -1:
+            return 0
+        curses.ungetch(key)
+        return 1
+
+    dmgr.set_progress_handler(key_pressed, PROGRESS_STEPS)
+    try:
+        while True:
+            height, width = stdscr.getmaxyx()
+            rows = max(height - 3, 1)
+            # Keeping the selection inside the visible window
+            selected = min(selected, max(len(search.results) - 1, 0))
+            top = min(max(top, selected - rows + 1), selected)
+
+            stdscr.erase()
+            label = "Phone" if search.by_phone else "Name"
+            status = f"{len(search.results)}"
+            if pending or not search.complete:
+                status += "+ results, searching..."
+            else:
+                status += f" results in {elapsed * 1000:.1f} ms"
+            stdscr.addnstr(1, 0, status + "   <Tab> name/phone, <Esc> quit",
+                           width - 1)
+            for row, contact in enumerate(
+                    search.results[top:top + rows]):
+                attr = curses.A_REVERSE if top + row == selected else 0
+                stdscr.addnstr(row + 2, 0, _contact_line(contact, width),
+                               width - 1, attr)
+            stdscr.addnstr(0, 0, f"{label}: {query}", width - 1)
+            stdscr.refresh()
+
+            # Waiting for a key only as long as there is nothing to do
+            if pending:
+                wait = max(DEBOUNCE - (time.perf_counter() - last_key), 0)
+                stdscr.timeout(int(wait * 1000))
+            elif not search.complete:
+                stdscr.timeout(0)
+            else:
+                stdscr.timeout(-1)
+            key = stdscr.getch()
+
+            if key == -1:
+                if pending:
+                    search.start(query)
+                    started = time.perf_counter()
+                    pending = False
+                    selected = top = 0
+                if not search.step():
+                    continue
+                elapsed = time.perf_counter() - started
+            elif key == ESCAPE:
+                return None
+            elif key in (curses.KEY_ENTER, 10, 13):
+                # Searching for the latest query if it was still behind
+                if pending:
+                    search.start(query)
+                    pending = False
+                    selected = top = 0
+                while len(search.results) <= selected:
+                    if search.step():
+                        break
+                if len(search.results) > selected:
+                    return search.results[selected]
+            elif key == 9:
+                search.cancel()
+                search = searches[not search.by_phone]
+                pending = True
+            elif key == curses.KEY_UP:
+                selected = max(selected - 1, 0)
+            elif key == curses.KEY_DOWN:
+                selected += 1
+            elif key == curses.KEY_NPAGE:
+                selected += rows
+            elif key == curses.KEY_PPAGE:
+                selected = max(selected - rows, 0)
+            elif key in (curses.KEY_BACKSPACE, 127, 8):
+                query = query[:-1]
+                pending = True
+            elif 32 <= key < 127:
+                query += chr(key)
+                pending = True
+            if pending:
+                last_key = time.perf_counter()
+    finally:
+        search.cancel()
+        dmgr.set_progress_handler(None, 0)
+
+
+def live_search(
+        dmgr: StorageBackend, by_phone: bool = False) -> Optional[Contact]:
+    """Shows the search-as-you-type screen, returns the contact selected
+    by the user or `None`
+
+    :param dmgr: The contact book to search
+    :type dmgr: StorageBackend
+    :param by_phone: Start in phone no. mode instead of name mode
+    :type by_phone: bool
+
+    :rtype: Optional[Contact]
+    """
+
+    if curses is None:
+        raise RuntimeError("Search as you type needs the curses module")
+    return curses.wrapper(_search_screen, dmgr, by_phone)
@@ -0,0 +1,199 @@
+"""
+This module keeps the contact book small and its queries fast. Old
+entries of the trash are purged in chunks, the statistics of the query
+planner are refreshed and the pages freed by deletions are given back
+to the file system with `incremental_vacuum`. Maintenance runs through
+the `maintain` command or in the background while the app is idle. The
+background runs work in short steps, stop as soon as the app is busy
+again, and never switch the book to incremental vacuuming, which takes
+a full VACUUM locking the book for as long as it runs
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional, Union
+
+from config import open_book
+from datamanager import DataManager
+
+# Days a contact stays in the trash before it is purged
+TRASH_DAYS = 30
+# Seconds without user activity before maintenance runs in the background
+IDLE_SECONDS = 300
+# Minimum seconds between two background maintenance runs
+INTERVAL = 24 * 3600
+# Seconds between checks of the background scheduler
+POLL_SECONDS = 5
+# Pages given back to the file system per step of the vacuum
+VACUUM_STEP = 1000
+# Approximate no. of rows of each index analyzed by background runs
+ANALYSIS_LIMIT = 1000
+
+
+class MaintenanceCancelled(Exception):
+    """Raised by `maintain` when it is cancelled between two steps, the
+    steps already done are kept"""
+
+
+class MaintenanceResult(NamedTuple):
+    """Details of a finished maintenance run"""
+
+    purged: int                 # No. of entries purged from the trash
+    reclaimed: int              # Bytes the database file shrank by
+    timings: Dict[str, float]   # Seconds spent in each step
+    elapsed: float              # Seconds taken by the whole run
+
+
+def maintain(
+        dmgr: DataManager, trash_days: Optional[int] = TRASH_DAYS,
+        vacuum: bool = True,
+        progress: Optional[Callable[[int, int], None]] = None,
+        convert: bool = True,
+        cancelled: Optional[Callable[[], bool]] = None,
+        analysis_limit: Optional[int] = None) -> MaintenanceResult:
+    """Purges the trash, refreshes the query planner's statistics and
+    gives the unused pages back to the file system
+
+    :param dmgr: The contact book, which must be stored in SQLite
+    :type dmgr: DataManager
+    :param trash_days: Entries deleted more than this many days ago are
+     purged, the trash is left alone if `None`
+    :type trash_days: Optional[int]
+    :param vacuum: Run `incremental_vacuum`
+    :type vacuum: bool
+    :param progress: Called with the no. of entries purged and the total
+     after each chunk
+    :type progress: Optional[Callable[[int, int], None]]
+    :param convert: Switch a book not created with incremental vacuuming
+     to it with a full VACUUM, its pages aren't given back otherwise
+    :type convert: bool
+    :param cancelled: Checked between the steps, the run stops as soon as
+     it returns `True`
+    :type cancelled: Optional[Callable[[], bool]]
+    :param analysis_limit: See `DataManager.optimize`
+    :type analysis_limit: Optional[int]
+
+    :raises MaintenanceCancelled: If `cancelled` returned `True`
+
+    :returns: Details of the run
+    :rtype: MaintenanceResult
+    """
+
+    def check():
+        if cancelled is not None and cancelled():
+            raise MaintenanceCancelled()
+
+    def purge_progress(done: int, total: int) -> None:
+        if progress:
+            progress(done, total)
+        check()
+
+    start = time.perf_counter()
+    timings: Dict[str, float] = dict()
+    pages, _, page_size = dmgr.page_stats()
+    purged = 0
+
+    if trash_days is not None:
+        check()
+        step = time.perf_counter()
+        # Each chunk is committed, so the chunks purged are kept when
+        # the run is cancelled
+        purged = dmgr.purge_trash(
+            datetime.now() - timedelta(days=trash_days),
+            progress=purge_progress)
+        timings["purge"] = time.perf_counter() - step
+
+    check()
+    step = time.perf_counter()
+    statement = dmgr.optimize(analysis_limit)
+    timings[statement.lower().replace("pragma ", "")] = \
+        time.perf_counter() - step
+
+    if vacuum:
+        check()
+        step = time.perf_counter()
+        while dmgr.incremental_vacuum(VACUUM_STEP, convert) > 0:
+            check()
+        timings["vacuum"] = time.perf_counter() - step
+
+    reclaimed = (pages - dmgr.page_stats()[0]) * page_size
+    return MaintenanceResult(purged, reclaimed, timings,
+                             time.perf_counter() - start)
+
+
+class MaintenanceScheduler(threading.Thread):
+    """Runs `maintain` on the book at `path` in the background, once the
+    app has been idle for `idle_seconds` and at most once per `interval`
+    seconds, until `stop` is called. The app marks itself `busy` while
+    an option runs and `idle` afterwards, a run in progress stops at the
+    end of its current step when the app gets busy and runs again once
+    it is idle. Books not created with incremental vacuuming are only
+    switched to it by the `maintain` command
+
+    The thread opens its own connection, as SQLite connections can't be
+    shared between threads"""
+
+    def __init__(self, path: Union[str, Path],
+                 idle_seconds: float = IDLE_SECONDS,
+                 interval: float = INTERVAL, poll: float = POLL_SECONDS,
+                 **maintain_args):
+        super().__init__(daemon=True)
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self.interval = interval
+        self.poll = poll
+        self.maintain_args = maintain_args
+        self.last_result: Optional[MaintenanceResult] = None
+        self.last_error: Optional[Exception] = None
+        self._busy = False
+        self._idle_since = time.monotonic()
+        self._last_run: Optional[float] = None
+        self._stopped = threading.Event()
+
+    def busy(self) -> None:
+        """Marks the app as busy, maintenance doesn't start meanwhile and
+        a run in progress stops after its current step"""
+
+        self._busy = True
+
+    def idle(self) -> None:
+        """Marks the app as idle from now on"""
+
+        self._busy = False
+        self._idle_since = time.monotonic()
+
+    def due(self, now: Optional[float] = None) -> bool:
+        """Whether maintenance should run at `now` (a `time.monotonic`
+        value, the current time if `None`)"""
+
+        now = time.monotonic() if now is None else now
+        if self._busy or now - self._idle_since < self.idle_seconds:
+            return False
+        return self._last_run is None \
+            or now - self._last_run >= self.interval
+
+    def run_once(self) -> None:
+        """Maintains the book once, as the thread does when it is due. A
+        run cancelled because the app got busy is retried when it is
+        idle again"""
+
+        self._last_run = time.monotonic()
+        args = {"analysis_limit": ANALYSIS_LIMIT, **self.maintain_args,
+                "convert": False, "cancelled": lambda: self._busy}
+        try:
+            self.last_result = maintain(open_book(self.path), **args)
+            self.last_error = None
+        except MaintenanceCancelled:
+            self._last_run = None
+        except (OSError, sqlite3.Error) as error:
+            self.last_error = error
+
+    def run(self):
+        while not self._stopped.wait(self.poll):
+            if self.due():
+                self.run_once()
+
+    def stop(self):
+        self._stopped.set()
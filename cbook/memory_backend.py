@@ -0,0 +1,512 @@
+"""
+This module contains an in-memory storage backend, contacts are kept in
+dicts and indexed by sorted lists, so tests and benchmarks can run
+without touching the disk. It follows the same rules as the SQLite
+database, e.g. unique phone numbers and contacts belonging to groups
+"""
+import bisect
+from contextlib import contextmanager
+import copy
+import heapq
+from datetime import datetime
+from typing import (
+    Callable, Dict, Hashable, Iterator, List, Optional, Set, Tuple, Union)
+
+from datamanager import (
+    Contact, PHONE_SLOTS, StorageBackend, TrashEntry, access_rank, logaddexp,
+    name_key, phone_key, to_timestamp)
+
+# A phone no. of a contact as (kind, number, number_key)
+Phone = Tuple[str, str, str]
+
+# Marks the entries a transaction added, which are removed on rollback
+_MISSING = object()
+
+
+def _name_order(contact: Contact) -> tuple:
+    # Same order as `ORDER BY first_key, last_key, id` in SQLite,
+    # where a missing last name sorts first
+    return (name_key(contact.first_name), contact.last_name is not None,
+            name_key(contact.last_name) or "", contact.db_id)
+
+
+def _country_code(key: str) -> str:
+    # Same as `datamanager.COUNTRY_CODE`
+    return key[:-10] if len(key) > 10 else ""
+
+
+class MemoryBackend(StorageBackend):
+    """Stores the contact book in memory, nothing is persisted"""
+
+    def __init__(self):
+        self.path = ":memory:"
+        self._contacts: Dict[int, Contact] = dict()
+        self._phones: Dict[int, List[Phone]] = dict()
+        # keys: number_key, values: {kind: contact id}
+        self._by_key: Dict[str, Dict[str, int]] = dict()
+        # Sorted lists of `_name_order` and (date_added, id) tuples
+        self._by_name: List[tuple] = []
+        self._by_added: List[Tuple[int, int]] = []
+        self._groups: Dict[int, str] = dict()
+        self._members: Dict[int, List[int]] = dict()
+        self._last_group_id = 0
+        # keys: contact id, values: frecency rank
+        self._ranks: Dict[int, float] = dict()
+        # keys: trash id, values: soft deleted contacts
+        self._trash: Dict[int, TrashEntry] = dict()
+        self._last_trash_id = 0
+        # Functions undoing the changes made by the running transactions,
+        # in order, and the (table, key) entries already saved by each of
+        # the nested transactions
+        self._undo: List[Callable[[], None]] = []
+        self._saved: List[Set[Tuple[str, Hashable]]] = []
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Groups all the changes made inside the `with` block, if an
+        exception is raised all of them are undone. Only the entries
+        changed are saved, so a transaction costs the same on a book of
+        any size"""
+
+        start = len(self._undo)
+        last_ids = (self._last_group_id, self._last_trash_id)
+        self._saved.append(set())
+        try:
+            yield
+        except BaseException:
+            while len(self._undo) > start:
+                self._undo.pop()()
+            self._last_group_id, self._last_trash_id = last_ids
+            raise
+        finally:
+            self._saved.pop()
+            if not self._saved:
+                self._undo.clear()
+
+    def _touch(self, table: str, key: Hashable) -> None:
+        """Saves the entry `key` of the dict `table` before it's changed,
+        so that the running transaction can put it back"""
+
+        if not self._saved or (table, key) in self._saved[-1]:
+            return
+        self._saved[-1].add((table, key))
+        entries = getattr(self, table)
+        old = entries.get(key, _MISSING)
+        # Lists of phone nos. and members and dicts of kinds are changed
+        # in place
+        if isinstance(old, (list, dict)):
+            old = copy.copy(old)
+
+        def undo() -> None:
+            if old is _MISSING:
+                entries.pop(key, None)
+            else:
+                entries[key] = old
+        self._undo.append(undo)
+
+    def _insort(self, table: str, item: tuple) -> None:
+        """Inserts `item` into the sorted list `table`"""
+
+        entries = getattr(self, table)
+        bisect.insort(entries, item)
+        if self._saved:
+            self._undo.append(lambda: entries.pop(
+                bisect.bisect_left(entries, item)))
+
+    def _unsort(self, table: str, item: tuple) -> None:
+        """Removes `item` from the sorted list `table`"""
+
+        entries = getattr(self, table)
+        del entries[bisect.bisect_left(entries, item)]
+        if self._saved:
+            self._undo.append(lambda: bisect.insort(entries, item))
+
+    def commit(self) -> None:
+        """Does nothing, changes are applied immediately"""
+
+    def _numbers(self, contact: Contact) -> List[Phone]:
+        """Returns the personal, work and home numbers of `contact`"""
+
+        numbers = (contact.phone_personal, contact.phone_work,
+                   contact.phone_home)
+        return [(kind, number, phone_key(number))
+                for kind, number in zip(PHONE_SLOTS, numbers) if number]
+
+    def _can_add(self, contact_id: int, phone: Phone) -> bool:
+        """Checks the constraints of the Phones table for `phone`"""
+
+        kind, _, key = phone
+        if key in self._by_key and kind in self._by_key[key]:
+            return False
+        if kind in PHONE_SLOTS:
+            return all(kind != other[0] for other in self._phones[contact_id])
+        return True
+
+    def _add_phone(self, contact_id: int, phone: Phone) -> None:
+        self._touch("_phones", contact_id)
+        self._touch("_by_key", phone[2])
+        self._phones[contact_id].append(phone)
+        self._by_key.setdefault(phone[2], dict())[phone[0]] = contact_id
+
+    def _remove_phones(self, contact_id: int, kinds=None) -> None:
+        self._touch("_phones", contact_id)
+        kept = []
+        for phone in self._phones[contact_id]:
+            kind, _, key = phone
+            if kinds is None or kind in kinds:
+                self._touch("_by_key", key)
+                del self._by_key[key][kind]
+                if not self._by_key[key]:
+                    del self._by_key[key]
+            else:
+                kept.append(phone)
+        self._phones[contact_id] = kept
+
+    def _build(self, contact_id: int) -> Contact:
+        """Returns the stored contact with its current phone numbers"""
+
+        slots = dict.fromkeys(PHONE_SLOTS)
+        for kind, number, _ in self._phones[contact_id]:
+            if kind in slots:
+                slots[kind] = number
+        contact = self._contacts[contact_id]
+        return contact._replace(
+            phone_personal=slots["personal"], phone_work=slots["work"],
+            phone_home=slots["home"])
+
+    def _sorted(self, ids) -> Iterator[Contact]:
+        """Yields the contacts with ids in `ids` ordered by name"""
+
+        for contact in sorted((self._contacts[cid] for cid in ids),
+                              key=_name_order):
+            yield self._build(contact.db_id)
+
+    def iter_by_name(
+            self, name: str,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_by_name`"""
+
+        key = name_key(name)
+        for first_key, _, last_key, cid in self._by_name:
+            if key in first_key or (
+                    self._contacts[cid].last_name is not None
+                    and key in last_key):
+                yield self._build(cid)
+
+    def iter_by_phone_no(
+            self, phone: str,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_by_phone_no`"""
+
+        found = False
+        for contact in self.iter_by_exact_phone(phone):
+            found = True
+            yield contact
+        if found:
+            return
+        yield from self._sorted(
+            cid for cid, phones in self._phones.items()
+            if any(phone in number for _, number, _ in phones))
+
+    def iter_by_exact_phone(
+            self, phone: str,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_by_exact_phone`"""
+
+        key = phone_key(phone)
+        if key is None or key not in self._by_key:
+            return iter(())
+        return self._sorted(set(self._by_key[key].values()))
+
+    def iter_contacts(
+            self, limit: Optional[int] = None,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields a maximum of `limit` contacts (all of them if
+        `limit` is `None`) in sorted order"""
+
+        for *_, cid in self._by_name[:limit]:
+            yield self._build(cid)
+
+    def iter_added_between(
+            self, start: datetime, end: Optional[datetime] = None,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts returned by `fetch_added_between`,
+        the range is found by bisecting the contacts sorted by
+        date_added"""
+
+        low = bisect.bisect_left(self._by_added, (to_timestamp(start),))
+        if end is None:
+            high = len(self._by_added)
+        else:
+            high = bisect.bisect_left(self._by_added, (to_timestamp(end),))
+        for _, cid in self._by_added[low:high]:
+            yield self._build(cid)
+
+    def iter_contacts_from_group(
+            self, group_id: int,
+            batch_size: Optional[int] = None) -> Iterator[Contact]:
+        """Lazily yields the contacts from group with id `group_id`"""
+
+        for cid in self._members.get(group_id, []):
+            yield self._build(cid)
+
+    def get_contact(self, contact_id: int) -> Optional[Contact]:
+        """Returns the contact with id `contact_id`, `None` if there is
+        no such contact"""
+
+        if contact_id not in self._contacts:
+            return None
+        return self._build(contact_id)
+
+    def fetch_phone_numbers(self, contact_id: int) -> List[Tuple[str, str]]:
+        """Returns all the (kind, number) pairs of a contact"""
+
+        return [(kind, number)
+                for kind, number, _ in self._phones.get(contact_id, [])]
+
+    def add_phone_number(
+            self, contact_id: int, number: str, kind: str = "mobile") -> bool:
+        """Adds another phone no. to a contact, returns `True` if added"""
+
+        key = phone_key(number)
+        if key is None or contact_id not in self._contacts:
+            return False
+        phone = (kind, number, key)
+        if not self._can_add(contact_id, phone):
+            return False
+        self._add_phone(contact_id, phone)
+        return True
+
+    def remove_phone_number(self, contact_id: int, number: str) -> None:
+        """Removes a phone no. from a contact"""
+
+        if contact_id not in self._phones:
+            return
+        key = phone_key(number)
+        kinds = [kind for kind, _, other in self._phones[contact_id]
+                 if other == key]
+        self._remove_phones(contact_id, kinds)
+
+    def fetch_caller_ids(self) -> List[Tuple[str, int, str, Optional[str]]]:
+        """Returns (number_key, id, first_name, last_name) for every
+        stored phone no."""
+
+        data = []
+        for cid, phones in self._phones.items():
+            contact = self._contacts[cid]
+            data.extend((key, cid, contact.first_name, contact.last_name)
+                        for _, _, key in phones)
+        return data
+
+    def record_access(
+            self, contact_id: int,
+            when: Optional[datetime] = None) -> Optional[float]:
+        """Adds an access to the frecency rank of a contact, returns its
+        new rank or `None` if there is no such contact"""
+
+        if contact_id not in self._contacts:
+            return None
+        rank = logaddexp(self._ranks.get(contact_id),
+                         access_rank(when or datetime.now()))
+        self._touch("_ranks", contact_id)
+        self._ranks[contact_id] = rank
+        return rank
+
+    def iter_frecent(self, limit: int) -> Iterator[Tuple[float, Contact]]:
+        """Lazily yields the (rank, contact) of the `limit` contacts with
+        the highest frecency rank, highest first"""
+
+        ranked = heapq.nlargest(limit, self._ranks.items(),
+                                key=lambda item: item[1])
+        for cid, rank in ranked:
+            yield rank, self._build(cid)
+
+    def get_contact_count(self) -> int:
+        """Returns the total number of contacts"""
+
+        return len(self._contacts)
+
+    def get_group_size(self, group_id: int) -> int:
+        """Returns the number of contacts in a group"""
+
+        return len(self._members.get(group_id, []))
+
+    def get_country_code_counts(self) -> List[Tuple[str, int]]:
+        """Returns the (country_code, no. of contacts) pairs, most
+        common first"""
+
+        counts: Dict[str, int] = dict()
+        for phones in self._phones.values():
+            for kind, _, key in phones:
+                if kind == "personal":
+                    code = _country_code(key)
+                    counts[code] = counts.get(code, 0) + 1
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+    def create_contact(self, contact: Contact) -> bool:
+        """Stores a new contact, returns `True` if created"""
+
+        if contact.db_id in self._contacts:
+            return False
+        # Timestamps are stored the same way as in SQLite
+        contact = contact._replace(date_added=contact.added_timestamp)
+        self._touch("_contacts", contact.db_id)
+        self._touch("_phones", contact.db_id)
+        self._contacts[contact.db_id] = contact
+        self._phones[contact.db_id] = []
+        try:
+            for phone in self._numbers(contact):
+                if not self._can_add(contact.db_id, phone):
+                    raise ValueError("Phone no. already exists")
+                self._add_phone(contact.db_id, phone)
+        except ValueError:
+            self._remove_phones(contact.db_id)
+            del self._phones[contact.db_id]
+            del self._contacts[contact.db_id]
+            return False
+        self._insort("_by_name", _name_order(contact))
+        self._insort("_by_added", (contact.added_timestamp, contact.db_id))
+        return True
+
+    def update_contact(self, contact: Contact) -> bool:
+        """Updates the contact with id `contact.db_id`, returns `True` if
+        updated"""
+
+        cid = contact.db_id
+        if cid not in self._contacts:
+            return False
+        old_phones = self._phones[cid]
+        self._remove_phones(cid, PHONE_SLOTS)
+        added = []
+        for phone in self._numbers(contact):
+            if not self._can_add(cid, phone):
+                # Putting back the numbers replaced so far
+                self._remove_phones(cid, [kind for kind, _, _ in added])
+                for old in old_phones:
+                    if old[0] in PHONE_SLOTS:
+                        self._add_phone(cid, old)
+                self._phones[cid] = old_phones
+                return False
+            self._add_phone(cid, phone)
+            added.append(phone)
+
+        old = self._contacts[cid]
+        new = old._replace(
+            first_name=contact.first_name, last_name=contact.last_name,
+            email=contact.email, address=contact.address)
+        self._unsort("_by_name", _name_order(old))
+        self._insort("_by_name", _name_order(new))
+        self._touch("_contacts", cid)
+        self._contacts[cid] = new
+        return True
+
+    def delete_contact(self, contact: Contact) -> None:
+        """Deletes a contact along with its numbers and memberships"""
+
+        cid = contact.db_id
+        if cid not in self._contacts:
+            return
+        self._touch("_contacts", cid)
+        self._touch("_ranks", cid)
+        stored = self._contacts.pop(cid)
+        self._ranks.pop(cid, None)
+        self._remove_phones(cid)
+        del self._phones[cid]
+        for group_id, members in self._members.items():
+            if cid in members:
+                self._touch("_members", group_id)
+                members.remove(cid)
+        self._unsort("_by_name", _name_order(stored))
+        self._unsort("_by_added", (stored.added_timestamp, cid))
+
+    def trash_contact(self, contact: Contact) -> bool:
+        """Moves a contact to the trash along with its phone nos. and
+        groups, returns `False` if there is no such contact"""
+
+        cid = contact.db_id
+        if cid not in self._contacts:
+            return False
+        groups = [gid for gid, members in self._members.items()
+                  if cid in members]
+        self._last_trash_id += 1
+        self._touch("_trash", self._last_trash_id)
+        self._trash[self._last_trash_id] = TrashEntry(
+            self._last_trash_id, datetime.now(), self._build(cid),
+            self.fetch_phone_numbers(cid), groups)
+        self.delete_contact(contact)
+        return True
+
+    def fetch_trash(self, trash_id: Optional[int] = None) -> List[TrashEntry]:
+        """Returns the entries of the trash, most recently deleted first,
+        or just the one with id `trash_id`"""
+
+        if trash_id is not None:
+            entry = self._trash.get(trash_id)
+            return [entry] if entry else []
+        return sorted(self._trash.values(), reverse=True)
+
+    def remove_from_trash(self, trash_id: int) -> None:
+        """Removes an entry from the trash for good"""
+
+        self._touch("_trash", trash_id)
+        self._trash.pop(trash_id, None)
+
+    def purge_trash(self, older_than: Optional[datetime] = None) -> int:
+        """Removes the entries deleted before `older_than` (all of them
+        if `None`) from the trash for good, returns how many"""
+
+        purged = [tid for tid, entry in self._trash.items()
+                  if older_than is None or entry.deleted < older_than]
+        for tid in purged:
+            self._touch("_trash", tid)
+            del self._trash[tid]
+        return len(purged)
+
+    def get_new_id(self) -> int:
+        """Returns a new id for the contact to use"""
+
+        return max(self._contacts, default=0) + 1
+
+    def create_group(self, name: str) -> None:
+        """Creates a group named `name`"""
+
+        # Group ids are never reused, like SQLite's AUTOINCREMENT
+        self._last_group_id += 1
+        self._touch("_groups", self._last_group_id)
+        self._touch("_members", self._last_group_id)
+        self._groups[self._last_group_id] = name
+        self._members[self._last_group_id] = []
+
+    def fetch_groups(self) -> List[Tuple[Union[int, str]]]:
+        """Returns the (id, name) of all the groups"""
+
+        return list(self._groups.items())  # type: ignore[arg-type]
+
+    def add_contacts_to_group(self, group_id: int, contact_id: int) -> bool:
+        """Adds a contact to a group, returns `True` if added"""
+
+        if group_id not in self._groups or contact_id not in self._contacts:
+            return False
+        members = self._members[group_id]
+        if contact_id in members:
+            return False
+        self._touch("_members", group_id)
+        bisect.insort(members, contact_id)
+        return True
+
+    def remove_contacts_from_group(
+            self, group_id: int, contact_id: int) -> None:
+        """Removes a contact from a group"""
+
+        members = self._members.get(group_id, [])
+        if contact_id in members:
+            self._touch("_members", group_id)
+            members.remove(contact_id)
+
+    def delete_group(self, group_id: int) -> None:
+        """Deletes a group, but not its contacts"""
+
+        self._touch("_groups", group_id)
+        self._touch("_members", group_id)
+        self._groups.pop(group_id, None)
+        self._members.pop(group_id, None)
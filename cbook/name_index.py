@@ -0,0 +1,113 @@
+"""
+This module contains an in-memory prefix index over the names of the
+contacts, used to complete names while the user types them
+"""
+import bisect
+from typing import List, Optional, Tuple
+
+from datamanager import Contact, StorageBackend, name_key
+
+# An entry of the index: (`name_key` of the name, name as displayed, id)
+Entry = Tuple[str, str, int]
+
+
+def _entries(contact: Contact) -> List[Entry]:
+    """Returns the entries under which `contact` is found, i.e. its full
+    name in both orders so it can be completed from the last name too"""
+
+    names = [contact.first_name]
+    if contact.last_name:
+        names = [f"{contact.first_name} {contact.last_name}",
+                 f"{contact.last_name} {contact.first_name}"]
+    return [(name_key(name), name, contact.db_id) for name in names]
+
+
+class NameIndex:
+    """Names of the contacts of `dmgr` in a sorted list, prefixes are
+    found by bisecting it. The index is built on first use and must be
+    told about the contacts created, updated and deleted afterwards"""
+
+    def __init__(self, dmgr: StorageBackend):
+        self.dmgr = dmgr
+        self._entries: Optional[List[Entry]] = None
+
+    def _loaded(self) -> List[Entry]:
+        if self._entries is None:
+            entries = []
+            for contact in self.dmgr.iter_contacts():
+                entries.extend(_entries(contact))
+            entries.sort()
+            self._entries = entries
+        return self._entries
+
+    def _matches(self, prefix: str) -> List[Entry]:
+        """Returns the entries starting with `prefix`, ignoring the case"""
+
+        entries = self._loaded()
+        key = name_key(prefix)
+        matches = []
+        for i in range(bisect.bisect_left(entries, (key,)), len(entries)):
+            if not entries[i][0].startswith(key):
+                break
+            matches.append(entries[i])
+        return matches
+
+    def complete(self, prefix: str, limit: int = 50) -> List[str]:
+        """Returns a maximum of `limit` distinct names starting with
+        `prefix`, ignoring the case
+
+        :param prefix: Beginning of a first or last name
+        :type prefix: str
+        :param limit: Maximum no. of names returned
+        :type limit: int
+
+        :rtype: List[str]
+        """
+
+        names: List[str] = []
+        for _, name, _ in self._matches(prefix):
+            if not names or names[-1] != name:
+                names.append(name)
+                if len(names) == limit:
+                    break
+        return names
+
+    def lookup(self, name: str) -> List[int]:
+        """Returns the ids of the contacts named exactly `name` (in
+        either order of first and last name), ignoring the case
+
+        :rtype: List[int]
+        """
+
+        key = name_key(name)
+        return sorted({cid for entry_key, _, cid in self._matches(name)
+                       if entry_key == key})
+
+    def add(self, contact: Contact) -> None:
+        """Adds a newly created contact to the index"""
+
+        if self._entries is not None:
+            for entry in _entries(contact):
+                bisect.insort(self._entries, entry)
+
+    def remove(self, contact: Contact) -> None:
+        """Removes a deleted contact from the index"""
+
+        if self._entries is not None:
+            for entry in _entries(contact):
+                i = bisect.bisect_left(self._entries, entry)
+                if i < len(self._entries) and self._entries[i] == entry:
+                    del self._entries[i]
+
+    def reset(self) -> None:
+        """Drops the index after many contacts are changed at once, it is
+        rebuilt on next use"""
+
+        self._entries = None
+
+    def replace(self, old: Contact, new: Contact) -> None:
+        """Updates the index after the contact `old` is updated to
+        `new`"""
+
+        self.remove(old)
+        self.add(new)
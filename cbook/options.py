@@ -1,24 +1,81 @@
-from datetime import datetime
-from typing import Union
+from datetime import datetime, timedelta
+from typing import List, Union
 
 from tabulate import tabulate
 
-from datamanager import Contact, DataManager
+from backup import backup_database
+from books import search_books
+from config import open_storage
+from datamanager import BATCH_FIELDS, Contact, PHONE_SLOTS
 from data_display import format_for_display, display_full, display_table
 from input_handlers import ask_int, ask_email, ask_phone_no, ask_text
-
-dmgr = DataManager()
+from instrumentation import STATS
+from live_search import live_search
+from name_index import NameIndex
+import query
+from recent import RecentContacts
+
+dmgr = open_storage()
+# Names of the contacts for completing them, kept up to date below
+names = NameIndex(dmgr)
+# Most frecently accessed contacts, offered before searching
+recent = RecentContacts(dmgr)
 
 OPTIONS = dict()    # keys: Help text, values: function responsible
 
 
-def _select_contact() -> Union[Contact, None]:  # type: ignore[return]
+def _select_contact() -> Union[Contact, None]:
+    """Offers the recently and frequently accessed contacts first, if
+    none of them is picked prompts the user to search for a contact by
+    name instead. The access to the selected contact is recorded and
+    it is returned"""
+
+    contact = _select_recent() or _search_contact()
+    if contact:
+        recent.touch(contact)
+    return contact
+
+
+def _select_recent() -> Union[Contact, None]:
+    """Shows the recent contacts and lets the user pick one of them"""
+
+    contacts = recent.contacts()
+    if not contacts:
+        return None
+    print("Recent contacts")
+    display_table(format_for_display(contacts))  # type: ignore[arg-type]
+    index = ask_int("Enter the index or just press <Enter> to search: ",
+                    low=0, high=len(contacts)-1, default=None)
+    return None if index is None else contacts[index]
+
+
+def _search_contact() -> Union[Contact, None]:  # type: ignore[return]
     """Prompts the user to search for a contact by name and then
     select one from the found contacts, it finally returns the
      selected contact"""
 
-    search_name = ask_text("Enter the name: ", True)
-    contacts = dmgr.fetch_by_name(search_name) # type: ignore
+    # Names <Tab> completed to the only suggestion, the user has seen
+    # there is no other contact starting with them
+    completed = set()
+
+    def complete(text: str) -> List[str]:
+        suggestions = names.complete(text)
+        if len(suggestions) == 1:
+            completed.add(suggestions[0])
+        return suggestions
+
+    search_name = ask_text("Enter the name (<Tab> to complete): ", True,
+                           completer=complete)
+    # A completed full name selects its contact straight away, a typed
+    # one is listed first along with the other contacts matching it
+    ids = names.lookup(search_name)  # type: ignore[arg-type]
+    if len(ids) == 1 and search_name in completed:
+        return dmgr.get_contact(ids[0])
+    contacts = [contact for contact in map(dmgr.get_contact, ids)
+                if contact]
+    contacts.extend(
+        contact for contact in dmgr.fetch_by_name(search_name)  # type: ignore
+        if contact.db_id not in ids)
     print(f"Found {len(contacts)} contacts")
     if contacts:
         tb_data = format_for_display(contacts)
@@ -48,6 +105,7 @@ def create_contact():
                       ph_personal, ph_work, ph_home, email, address)
 
     if dmgr.create_contact(contact):
+        names.add(contact)
         print("Contact created successfully")
     else:
         print("Couldn't create the contact")
@@ -68,6 +126,10 @@ def view_contact():
     if not contact: 
         return
     tb_data = format_for_display([contact], full=True)
+    # Showing the numbers which don't fit into the contact's fields
+    for kind, number in dmgr.fetch_phone_numbers(contact.db_id):
+        if kind not in PHONE_SLOTS:
+            tb_data[0][f"Phone {kind}"] = number
     display_full(tb_data[0])
 
 
@@ -97,9 +159,76 @@ def edit_contact():
     new_contact = Contact(contact.db_id, fname, lname, contact.date_added,
                           ph_personal, ph_work, ph_home, email, address)
     if dmgr.update_contact(new_contact):
+        names.replace(contact, new_contact)
+        recent.replace(contact, new_contact)
         print("Contact updated successfully")
 
 
+def batch_edit_contacts():
+    """Prompts the user for a filter and a change, shows how many
+    contacts the change affects and applies it to all of them at once"""
+
+    print("e.g. group:Work or added<2023 or just a name")
+    text = ask_text("Enter the filter: ", True)
+    for i, field in enumerate(BATCH_FIELDS):
+        print(f"{i}: Set {field.replace('_', ' ')}")
+    print(f"{len(BATCH_FIELDS)}: Add a country code to numbers without one")
+    choice = ask_int("Enter the change: ", required=True, low=0,
+                     high=len(BATCH_FIELDS))
+    if choice < len(BATCH_FIELDS):
+        field = BATCH_FIELDS[choice]
+        value = ask_text(f"Enter the new {field.replace('_', ' ')}"
+                         " (<Enter> to clear it): ")
+
+        def apply(dry_run: bool) -> int:
+            return query.update(dmgr, text, field, value,  # type: ignore
+                                dry_run)
+        what = "contacts"
+    else:
+        code = ask_text("Enter the country code, e.g. 91: ", True)
+
+        def apply(dry_run: bool) -> int:
+            return query.add_country_code(dmgr, text, code,  # type: ignore
+                                          dry_run)
+        what = "phone numbers"
+
+    try:
+        count = apply(dry_run=True)
+        if not count:
+            print(f"No {what} to change")
+            return
+        answer = ask_text(f"This changes {count} {what}, continue? (y/N): ")
+        if not (answer or "").lower().startswith("y"):
+            return
+        count = apply(dry_run=False)
+    except ValueError as error:
+        print(error)
+        return
+    # Many names and numbers may have changed
+    names.reset()
+    recent.reset()
+    print(f"Changed {count} {what}")
+
+
+def add_phone_number():
+    """Prompts the user to select a contact and adds another phone no.
+    (e.g. a second mobile) to it"""
+
+    contact = _select_contact()
+    if not contact:
+        return
+    number = ask_phone_no("Enter phone no.(Required): ", True)
+    kind = ask_text("Enter the kind of number(default: mobile): ",
+                    default="mobile")
+    if dmgr.add_phone_number(contact.db_id, number, kind.lower()):
+        # The number may fill one of the fields of the contact
+        recent.replace(contact, dmgr.get_contact(contact.db_id))
+        print("Phone no. added successfully")
+    else:
+        print("Couldn't add the phone no.")
+        print("This number is already stored with the same kind")
+
+
 def print_contacts_by_name():
     """Prompts the user to search for a matching name and shows
     the related contacts"""
@@ -111,6 +240,41 @@ def print_contacts_by_name():
     print(f"\nFound {len(data)} contacts")
 
 
+def print_contacts_in_all_books():
+    """Prompts the user for a name and shows the matching contacts from
+    all the configured contact books"""
+
+    search_name = ask_text("Enter the name: ", True)
+    matches, timings = search_books(search_name)
+    tb_data = format_for_display([match.contact for match in matches])
+    for row, match in zip(tb_data, matches):
+        row["Book"] = match.book
+    display_table(tb_data)
+    print(f"\nFound {len(matches)} contacts")
+    for book, elapsed in timings.items():
+        print(f"{book}: {elapsed * 1000:.3f} ms")
+
+
+def filter_contacts():
+    """Prompts the user for a filter on several fields and shows the
+    matching contacts, warning when the filter scans every contact"""
+
+    print("e.g. name:raj group:Work added>2023-01 -email:null")
+    text = ask_text("Enter the filter: ", True)
+    try:
+        data = query.search(dmgr, text)  # type: ignore[arg-type]
+        plan = query.explain(dmgr, text)  # type: ignore[arg-type]
+    except ValueError as error:
+        print(error)
+        return
+    display_table(format_for_display(data))
+    print(f"\nFound {len(data)} contacts")
+    if query.scans(plan):
+        print("This filter reads every contact, prefixes (first:raj*),"
+              " phone nos., groups and dates are looked up faster:")
+        print("\n".join(plan))
+
+
 def print_contacts_by_phone():
     """Prompts the user to enter a phone number and the shows all the matching
     contacts with that number
@@ -123,6 +287,20 @@ def print_contacts_by_phone():
     print(f"\nFound {len(data)} contacts")
 
 
+def search_as_you_type():
+    """Searches the contacts after every keystroke and shows the full
+    information of the selected one"""
+
+    try:
+        contact = live_search(dmgr)
+    except RuntimeError as error:
+        print(error)
+        return
+    if contact:
+        recent.touch(contact)
+        display_full(format_for_display([contact], full=True)[0])
+
+
 def print_available_contacts():
     """Prints all the available contacts"""
 
@@ -135,6 +313,17 @@ def print_available_contacts():
     print(f"Showing {len(data)} contacts out of {total_contacts}.")
 
 
+def print_recent_contacts():
+    """Prints the contacts added in the last few days"""
+
+    days = ask_int("Enter the number of days(default: 7): ",
+                   low=1, default=7)
+    data = dmgr.fetch_added_since(datetime.now() - timedelta(days=days))
+    tb_data = format_for_display(data, full=True)
+    display_table(tb_data)
+    print(f"\nFound {len(data)} contacts added in the last {days} days")
+
+
 def _select_group():
     """Prompts the user to select a group
     from the given options"""
@@ -161,8 +350,8 @@ def show_groups():
 
     if groups:
         tb_data = tabulate(
-                [group[1:] for group in groups],
-                headers=["Group name"],
+                [(name, dmgr.get_group_size(g_id)) for g_id, name in groups],
+                headers=["Group name", "Contacts"],
                 tablefmt="mixed_grid",
                 showindex=True
             )
@@ -245,15 +434,108 @@ def delete_group():
 
 
 def delete_contact():
-    """Prompts the user to select a contact and then deletes
-    it from the database, also deletes the associated phone numbers
-    and removes it from any of the groups"""
+    """Prompts the user to select a contact and then moves it to the
+    trash along with its phone numbers and groups, from where it can be
+    restored until the trash is purged"""
 
     contact = _select_contact()
     if not contact:
         return
-    dmgr.delete_contact(contact)
-    print("Contact deleted.")
+    dmgr.trash_contact(contact)
+    names.remove(contact)
+    recent.remove(contact)
+    print("Contact moved to the trash.")
+
+
+def restore_from_trash():
+    """Shows the contacts in the trash and restores the one chosen by
+    the user"""
+
+    entries = dmgr.fetch_trash()
+    if not entries:
+        print("The trash is empty")
+        return
+    tb_data = format_for_display(
+        [entry.contact for entry in entries])  # type: ignore[arg-type]
+    for row, entry in zip(tb_data, entries):
+        row["Deleted on"] = entry.deleted
+    display_table(tb_data)
+    index = ask_int("Choose the contact to restore: ",
+                    low=0, high=len(entries)-1)
+    contact = dmgr.restore_contact(entries[index].trash_id)
+    if contact is None:
+        print("Can't restore, one of its phone numbers belongs to another"
+              " contact now")
+        return
+    names.add(contact)
+    print("Contact restored.")
+
+
+def delete_filtered_contacts():
+    """Prompts the user for a filter and deletes all the matching
+    contacts after showing how many they are"""
+
+    print("e.g. group:Old or added<2020")
+    text = ask_text("Enter the filter: ", True)
+    try:
+        count = query.delete(dmgr, text, dry_run=True)  # type: ignore
+        if not count:
+            print("No contacts to delete")
+            return
+        answer = ask_text(f"This deletes {count} contacts, continue? (y/N): ")
+        if not (answer or "").lower().startswith("y"):
+            return
+        count = query.delete(
+            dmgr, text,  # type: ignore[arg-type]
+            progress=lambda done, total: print(
+                f"\rDeleted {done}/{total} contacts", end=""),
+            trash=True)
+    except ValueError as error:
+        print(error)
+        return
+    names.reset()
+    recent.reset()
+    print(f"\n{count} contacts moved to the trash.")
+
+
+def backup_contacts():
+    """Backs up the contact book into the backup directory"""
+
+    if dmgr.path == ":memory:":
+        print("In-memory contact books can't be backed up.")
+        return
+    # Backups only see committed changes
+    dmgr.commit()
+    result = backup_database(
+        dmgr.path,
+        progress=lambda remaining, total: print(
+            f"\rCopied {total - remaining}/{total} pages", end=""))
+    print(f"\nBacked up to {result.path}")
+    print(f"Took {result.elapsed:.3f}s ({result.throughput:.1f} MB/s)")
+
+
+def show_stats():
+    """Shows the no. of calls and the latencies of the menu options, of
+    the methods of the contact book and of the SQL statements (if they
+    are traced) in this session, the most time consuming first"""
+
+    for kind, title in (("option", "Menu options"),
+                        ("method", "Contact book methods"),
+                        ("sql", "SQL statements")):
+        rows = STATS.rows(kind)
+        if not rows:
+            continue
+        print(title)
+        print(tabulate(
+            [(name.split(":", 1)[1][:60], summary["count"],
+              *(summary[column] * 1000 for column in
+                ("total", "p50", "p95", "p99", "max")))
+             for name, summary in rows[:20]],
+            headers=["Name", "Calls", "Total ms", "p50 ms", "p95 ms",
+                     "p99 ms", "Max ms"],
+            tablefmt="mixed_grid", floatfmt=".3f"))
+    if not STATS.histograms:
+        print("Nothing has been measured yet")
 
 
 def quit_program():
@@ -264,10 +546,16 @@ def quit_program():
 # Registering all the options
 OPTIONS["Create new contact"] = create_contact
 OPTIONS["List contacts"] = print_available_contacts
+OPTIONS["List recently added contacts"] = print_recent_contacts
 OPTIONS["Search contacts by name"] = print_contacts_by_name
 OPTIONS["Search contacts by phone number"] = print_contacts_by_phone
+OPTIONS["Search contacts as you type"] = search_as_you_type
+OPTIONS["Filter contacts by several fields"] = filter_contacts
+OPTIONS["Search contacts in all books"] = print_contacts_in_all_books
 OPTIONS["View a contact's info"] = view_contact
 OPTIONS["Edit an existing contact"] = edit_contact
+OPTIONS["Add a phone number to a contact"] = add_phone_number
+OPTIONS["Edit all contacts matching a filter"] = batch_edit_contacts
 OPTIONS["Create a group"] = create_group
 OPTIONS["Show groups"] = show_groups
 OPTIONS["Add contacts to a group"] = add_contact_to_group
@@ -275,4 +563,8 @@ OPTIONS["Remove contact from a group"] = remove_contact_from_group
 OPTIONS["View contact from a group"] = view_group
 OPTIONS["Delete a group"] = delete_group
 OPTIONS["Delete a contact"] = delete_contact
+OPTIONS["Delete all contacts matching a filter"] = delete_filtered_contacts
+OPTIONS["Restore a contact from the trash"] = restore_from_trash
+OPTIONS["Back up contacts"] = backup_contacts
+OPTIONS["Show performance stats"] = show_stats
 OPTIONS["Exit"] = quit_program
@@ -0,0 +1,372 @@
+"""
+This module contains the filter language used to search contacts by
+several fields at once, e.g.
+
+    name:raj group:Work added>2023-01 -email:null
+
+A filter is parsed into a tree of `Term`, `Not`, `And` and `Or` nodes
+which is compiled into the condition of a single parameterized SQL
+statement. Terms are compiled to conditions on the indexed columns
+where possible (name keys, phone no. keys, group members and dates), so
+SQLite can look the contacts up instead of scanning all of them
+
+Terms are written as `field<op>value`, a word without a field is
+matched against the names. Terms are combined with AND unless joined
+by `OR`, `-` negates a term and parentheses group terms. With the `:`
+operator names, emails and addresses contain the value and phone nos.
+contain its digits, `=` matches them exactly and a value ending in `*`
+matches by prefix. `null` matches a missing last name, email or address
+"""
+from datetime import datetime
+import re
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
+
+from datamanager import (
+    Contact, DataManager, StorageBackend, name_key, phone_key, to_timestamp)
+
+
+class Term(NamedTuple):
+    """A condition on a single field, `value` is `None` for null"""
+
+    field: str
+    op: str
+    value: Optional[str]
+
+
+class Not(NamedTuple):
+    node: "Node"
+
+
+class And(NamedTuple):
+    nodes: Tuple["Node", ...]
+
+
+class Or(NamedTuple):
+    nodes: Tuple["Node", ...]
+
+
+Node = Union[Term, Not, And, Or]
+
+# keys: field, values: operators accepted by it
+FIELDS = {
+    "name": (":", "="),
+    "first": (":", "="),
+    "last": (":", "="),
+    "email": (":", "="),
+    "address": (":", "="),
+    "phone": (":", "="),
+    "group": (":", "="),
+    "added": (":", "=", "<", "<=", ">", ">="),
+}
+# Fields which may be missing
+NULLABLE = ("last", "email", "address")
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<paren>[()])
+      | (?P<neg>-)(?=\S)
+      | (?:(?P<field>[A-Za-z_]+)(?P<op><=|>=|[:=<>]))?
+        (?P<value>"[^"]*"|[^\s()"]+)
+    )""", re.VERBOSE)
+
+_DATE_FORMATS = {4: "%Y", 7: "%Y-%m", 10: "%Y-%m-%d"}
+
+
+def _tokenize(text: str) -> List[Union[str, Term]]:
+    """Splits `text` into parentheses, `-`, `OR` and `Term` tokens"""
+
+    tokens: List[Union[str, Term]] = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if not match:
+            raise ValueError(f"Unexpected character at {pos + 1}: "
+                             f"{text[pos:].strip()[:1]!r}")
+        pos = match.end()
+        if match["paren"] or match["neg"]:
+            tokens.append(match["paren"] or match["neg"])
+            continue
+        value = match["value"]
+        quoted = value.startswith('"')
+        if quoted:
+            value = value[1:-1]
+        if match["field"] is None:
+            if value == "OR" and not quoted:
+                tokens.append("OR")
+                continue
+            if not quoted and ":" in value:
+                raise ValueError(f"Missing value in {value!r}")
+            tokens.append(Term("name", ":", value))
+            continue
+        field, op = match["field"].lower(), match["op"]
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field: {field}")
+        if op not in FIELDS[field]:
+            raise ValueError(f"Operator {op} can't be used with {field}")
+        if value.lower() == "null" and not quoted:
+            if field not in NULLABLE or op not in (":", "="):
+                raise ValueError(f"{field} can't be null")
+            tokens.append(Term(field, "=", None))
+            continue
+        tokens.append(Term(field, op, value))
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser of the tokens of a filter, AND binds
+    tighter than OR"""
+
+    def __init__(self, tokens: List[Union[str, Term]]):
+        self.tokens = tokens
+        self.pos = 0
+
+    def _peek(self) -> Union[str, Term, None]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parse(self) -> Node:
+        node = self._or()
+        if self._peek() is not None:
+            raise ValueError(f"Unexpected {self._peek()!r}")
+        return node
+
+    def _or(self) -> Node:
+        nodes = [self._and()]
+        while self._peek() == "OR":
+            self.pos += 1
+            nodes.append(self._and())
+        return nodes[0] if len(nodes) == 1 else Or(tuple(nodes))
+
+    def _and(self) -> Node:
+        nodes = []
+        while self._peek() not in (None, "OR", ")"):
+            nodes.append(self._unary())
+        if not nodes:
+            raise ValueError("Expected a term")
+        return nodes[0] if len(nodes) == 1 else And(tuple(nodes))
+
+    def _unary(self) -> Node:
+        token = self._peek()
+        self.pos += 1
+        if token == "-":
+            return Not(self._unary())
+        if token == "(":
+            node = self._or()
+            if self._peek() != ")":
+                raise ValueError("Missing )")
+            self.pos += 1
+            return node
+        if isinstance(token, Term):
+            return token
+        raise ValueError(f"Unexpected {token!r}")
+
+
+def parse(text: str) -> Node:
+    """Parses a filter into its tree of nodes
+
+    :param text: The filter, e.g. `name:raj group:Work added>2023-01`
+    :type text: str
+
+    :raises ValueError: If the filter is invalid
+
+    :rtype: Node
+    """
+
+    return _Parser(_tokenize(text)).parse()
+
+
+def _period(value: str) -> Tuple[int, int]:
+    """Returns the [start, end) timestamps of a year, month or day"""
+
+    try:
+        start = datetime.strptime(value, _DATE_FORMATS[len(value)])
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid date: {value} (use YYYY, YYYY-MM or"
+                         " YYYY-MM-DD)") from None
+    if len(value) == 4:
+        end = start.replace(year=start.year + 1)
+    elif len(value) == 7:
+        end = (start.replace(year=start.year + 1, month=1)
+               if start.month == 12 else start.replace(month=start.month + 1))
+    else:
+        end = datetime.fromordinal(start.toordinal() + 1)
+    return to_timestamp(start), to_timestamp(end)
+
+
+def _escape_like(value: str) -> str:
+    return re.sub(r"([\\%_])", r"\\\1", value)
+
+
+def _text_condition(
+        column: str, op: str, value: Optional[str],
+        nullable: bool) -> Tuple[str, list]:
+    """Condition on a text column, missing values never match so the
+    condition is never NULL and can be negated safely"""
+
+    if value is None:
+        return f"{column} IS NULL", []
+    if value.endswith("*") and op == ":":
+        # Prefix as a range, so an index on the column can be used
+        prefix = value[:-1]
+        if not prefix:
+            return f"{column} IS NOT NULL", []
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        sql, params = f"{column} >= ? AND {column} < ?", [prefix, upper]
+    elif op == "=":
+        sql, params = f"{column} = ?", [value]
+    else:
+        sql = f"{column} LIKE ? ESCAPE '\\'"
+        params = [f"%{_escape_like(value)}%"]
+    if nullable:
+        sql = f"{column} IS NOT NULL AND {sql}"
+    return f"({sql})", params
+
+
+def _term(term: Term) -> Tuple[str, list]:
+    field, op, value = term
+    if field in ("name", "first", "last"):
+        key = None if value is None else name_key(value)
+        if field == "name":
+            first, params = _text_condition("first_key", op, key, False)
+            last, more = _text_condition("last_key", op, key, True)
+            return f"({first} OR {last})", params + more
+        column = "first_key" if field == "first" else "last_key"
+        return _text_condition(column, op, key, field == "last")
+    if field in ("email", "address"):
+        return _text_condition(field, op, value, True)
+    if field == "phone":
+        digits = phone_key(value)
+        if digits is None:
+            raise ValueError(f"Invalid phone no.: {value}")
+        if value.endswith("*"):
+            digits += "*"
+        condition, params = _text_condition("number_key", op, digits, False)
+        return f"Contacts.id IN (SELECT c_id FROM Phones WHERE {condition})", \
+            params
+    if field == "group":
+        return """Contacts.id IN (SELECT c_id FROM Group_members
+            WHERE g_id IN (SELECT id FROM Groups WHERE name = ?))""", [value]
+
+    # added
+    start, end = _period(value)  # type: ignore[arg-type]
+    if op in (":", "="):
+        return "(date_added >= ? AND date_added < ?)", [start, end]
+    bound = {">": ("date_added >= ?", end), ">=": ("date_added >= ?", start),
+             "<": ("date_added < ?", start), "<=": ("date_added < ?", end)}
+    sql, param = bound[op]
+    return sql, [param]
+
+
+def compile_filter(node: Node) -> Tuple[str, list]:
+    """Compiles a parsed filter into an SQL condition on the Contacts
+    table and its parameters
+
+    :param node: The parsed filter, see `parse`
+    :type node: Node
+
+    :returns: (condition, parameters)
+    :rtype: Tuple[str, list]
+    """
+
+    if isinstance(node, Term):
+        return _term(node)
+    if isinstance(node, Not):
+        sql, params = compile_filter(node.node)
+        return f"NOT ({sql})", params
+    parts = [compile_filter(child) for child in node.nodes]
+    joiner = " AND " if isinstance(node, And) else " OR "
+    sql = joiner.join(f"({part})" for part, _ in parts)
+    return f"({sql})", [param for _, params in parts for param in params]
+
+
+def _sqlite(dmgr: StorageBackend) -> DataManager:
+    if not isinstance(dmgr, DataManager):
+        raise ValueError("Filters are only supported by the SQLite backend")
+    return dmgr
+
+
+def search(dmgr: StorageBackend, text: str,
+           limit: Optional[int] = None) -> List[Contact]:
+    """Returns the contacts matching the filter `text` in sorted order
+
+    :param dmgr: The contact book, which must be stored in SQLite
+    :type dmgr: StorageBackend
+    :param text: The filter
+    :type text: str
+    :param limit: Maximum number of contacts returned
+    :type limit: Optional[int]
+
+    :raises ValueError: If the filter is invalid
+
+    :rtype: List[Contact]
+    """
+
+    condition, params = compile_filter(parse(text))
+    return list(_sqlite(dmgr).iter_filtered(condition, params, limit))
+
+
+def update(dmgr: StorageBackend, text: str, field: str,
+           value: Optional[str], dry_run: bool = False) -> int:
+    """Sets `field` to `value` for all the contacts matching the filter
+    `text`, see `DataManager.update_filtered`
+
+    :raises ValueError: If the filter or the change is invalid
+
+    :returns: No. of contacts changed, or which would be changed
+    :rtype: int
+    """
+
+    condition, params = compile_filter(parse(text))
+    return _sqlite(dmgr).update_filtered(condition, params, field, value,
+                                         dry_run)
+
+
+def add_country_code(dmgr: StorageBackend, text: str, code: str,
+                     dry_run: bool = False) -> int:
+    """Adds the country code `code` to the phone nos. without one of all
+    the contacts matching the filter `text`, see
+    `DataManager.add_country_code`
+
+    :raises ValueError: If the filter or the code is invalid
+
+    :returns: No. of phone nos. changed, or which would be changed
+    :rtype: int
+    """
+
+    condition, params = compile_filter(parse(text))
+    return _sqlite(dmgr).add_country_code(condition, params, code, dry_run)
+
+
+def delete(dmgr: StorageBackend, text: str, dry_run: bool = False,
+           progress: Optional[Callable[[int, int], None]] = None,
+           trash: bool = False) -> int:
+    """Deletes all the contacts matching the filter `text` in chunks, or
+    moves them to the trash, see `DataManager.delete_filtered`
+
+    :raises ValueError: If the filter is invalid
+
+    :returns: No. of contacts deleted, or which would be deleted
+    :rtype: int
+    """
+
+    condition, params = compile_filter(parse(text))
+    return _sqlite(dmgr).delete_filtered(condition, params,
+                                         progress=progress, dry_run=dry_run,
+                                         trash=trash)
+
+
+def explain(dmgr: StorageBackend, text: str) -> List[str]:
+    """Returns the query plan SQLite would use for the filter `text`,
+    one step per line, so users can see whether it scans every contact
+
+    :rtype: List[str]
+    """
+
+    condition, params = compile_filter(parse(text))
+    return _sqlite(dmgr).explain_filtered(condition, params)
+
+
+def scans(plan: List[str]) -> bool:
+    """Whether a query plan returned by `explain` reads every contact"""
+
+    return any(re.match(r"\s*SCAN Contacts\b", step) for step in plan)
@@ -0,0 +1,69 @@
+"""
+This module keeps the contacts the user accesses most often and most
+recently in memory, ranked by frecency (see `datamanager.access_rank`),
+so they can be offered before searching without querying the book
+"""
+from typing import List, Optional, Tuple
+
+from datamanager import Contact, StorageBackend
+
+# No. of contacts offered
+RECENT_SIZE = 9
+
+
+class RecentContacts:
+    """The `size` contacts with the highest frecency rank of `dmgr`,
+    highest first. They are loaded on first use, afterwards accesses
+    are recorded through `touch` and the list is kept up to date in
+    memory, as an access only changes the rank of its own contact"""
+
+    def __init__(self, dmgr: StorageBackend, size: int = RECENT_SIZE):
+        self.dmgr = dmgr
+        self.size = size
+        self._entries: Optional[List[Tuple[float, Contact]]] = None
+
+    def _loaded(self) -> List[Tuple[float, Contact]]:
+        if self._entries is None:
+            self._entries = list(self.dmgr.iter_frecent(self.size))
+        return self._entries
+
+    def contacts(self) -> List[Contact]:
+        """Returns the recent contacts, highest ranked first
+
+        :rtype: List[Contact]
+        """
+
+        return [contact for _, contact in self._loaded()]
+
+    def touch(self, contact: Contact) -> None:
+        """Records an access to `contact` and updates the list"""
+
+        rank = self.dmgr.record_access(contact.db_id)
+        if rank is None:
+            return
+        entries = [entry for entry in self._loaded()
+                   if entry[1].db_id != contact.db_id]
+        entries.append((rank, contact))
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+        self._entries = entries[:self.size]
+
+    def remove(self, contact: Contact) -> None:
+        """Removes a deleted contact from the list"""
+
+        if self._entries is not None and any(
+                other.db_id == contact.db_id for _, other in self._entries):
+            # The next ranked contact has to come from the book
+            self._entries = None
+
+    def reset(self) -> None:
+        """Drops the list after many contacts are changed at once, it is
+        loaded again on next use"""
+
+        self._entries = None
+
+    def replace(self, old: Contact, new: Contact) -> None:
+        """Updates the list after the contact `old` is updated to `new`"""
+
+        if self._entries is not None:
+            self._entries = [(rank, new if other.db_id == old.db_id
+                              else other) for rank, other in self._entries]
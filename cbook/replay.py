@@ -0,0 +1,330 @@
+"""
+This module replays scripted sessions through the menu options, so the
+latency of whole user flows can be measured end to end on books of any
+size. A script lists the options chosen, each followed by the answers
+typed at its prompts, one per line:
+
+    # Comments start with #, an empty line is <Enter>
+    > Search contacts by name
+    aarav
+    > List contacts
+    50
+
+Answers starting with `>`, `#` or `\\` are escaped with a `\\`. Scripts
+can be written by hand or recorded from a real session with the
+`CBOOK_RECORD` environment variable. They are replayed with the input
+injected and the output captured, against synthetic books built by
+`synthetic_book`, by pytest or by the `replay` command
+"""
+import builtins
+from contextlib import contextmanager, redirect_stdout
+import copy
+from datetime import datetime, timedelta
+import io
+import os
+from pathlib import Path
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Union
+
+from config import BACKEND_ENV
+from datamanager import Contact, DataManager, StorageBackend
+from instrumentation import OPTION, Stats
+from memory_backend import MemoryBackend
+
+# Environment variable naming the file a session is recorded to
+RECORD_ENV = "CBOOK_RECORD"
+
+FIRST_NAMES = ("Aarav", "Vivaan", "Aditya", "Ananya", "Diya", "Ishaan",
+               "Kavya", "Rohan", "Saanvi", "Vihaan")
+LAST_NAMES = ("Sharma", "Verma", "Gupta", "Kumar", "Singh", "Patel",
+              "Reddy", "Iyer", "Das", "Nair")
+# Every this many contacts of a synthetic book are in the Work group
+GROUP_EVERY = 7
+
+# Script replayed when none is given, it works the same on any synthetic
+# book of at least 200 contacts stored in SQLite
+DEFAULT_SCRIPT = """\
+> List contacts
+50
+> Search contacts by name
+aarav
+> Search contacts by phone number
+900000001
+> Filter contacts by several fields
+group:Work first:di*
+> View a contact's info
+Diya Verma
+0
+> Show groups
+> Create new contact
+Replay
+Tester
++919999999999
+
+
+
+
+> List recently added contacts
+30
+"""
+
+
+class Action(NamedTuple):
+    """A menu option and the answers typed at its prompts"""
+
+    option: str
+    inputs: List[str]
+
+
+class ActionResult(NamedTuple):
+    """Details of a replayed action"""
+
+    option: str
+    elapsed: float      # Seconds taken by the option's handler
+    prompts: List[str]  # Prompts shown, in order
+    output: str         # Everything printed by the handler
+
+
+class ScriptError(ValueError):
+    """Raised when a script doesn't match the prompts of the options"""
+
+
+def _escape(answer: str) -> str:
+    return "\\" + answer if answer[:1] in (">", "#", "\\") else answer
+
+
+def parse_script(text: str) -> List[Action]:
+    """Parses a script into its actions
+
+    :raises ScriptError: If there are answers before the first option
+
+    :rtype: List[Action]
+    """
+
+    actions: List[Action] = []
+    # The newline ending the last line isn't an extra <Enter>, which
+    # `splitlines` takes care of
+    for number, line in enumerate(text.splitlines(), start=1):
+        if line.startswith("#"):
+            continue
+        if line.startswith(">"):
+            actions.append(Action(line[1:].strip(), []))
+            continue
+        if not actions:
+            if not line.strip():
+                continue
+            raise ScriptError(f"Line {number}: answer before any option")
+        actions[-1].inputs.append(line[1:] if line.startswith("\\")
+                                  else line)
+    return actions
+
+
+def load_script(path: Union[str, Path]) -> List[Action]:
+    """Reads and parses the script at `path`"""
+
+    return parse_script(Path(path).read_text())
+
+
+@contextmanager
+def _injected(answers: List[str], prompts: List[str]) -> Iterator[None]:
+    """Replaces `input` with a function returning `answers` one by one
+    and recording the prompts"""
+
+    pending = list(answers)
+
+    def scripted_input(prompt: object = "") -> str:
+        prompts.append(str(prompt))
+        if not pending:
+            raise ScriptError(f"No answer left for the prompt {prompt!r}")
+        return pending.pop(0)
+
+    real_input = builtins.input
+    builtins.input = scripted_input
+    try:
+        yield
+    finally:
+        builtins.input = real_input
+    if pending:
+        raise ScriptError(f"{len(pending)} answers left unread, the last"
+                          f" prompt was {prompts[-1] if prompts else None!r}")
+
+
+@contextmanager
+def using_book(dmgr: StorageBackend) -> Iterator[Dict[str, Callable]]:
+    """Points the menu options at `dmgr`, with fresh name and recent
+    contact caches, and yields the options"""
+
+    if "options" not in sys.modules:
+        # The book `options` opens on import is replaced anyway, so it
+        # shouldn't touch the user's database
+        unset = BACKEND_ENV not in os.environ
+        os.environ.setdefault(BACKEND_ENV, "memory")
+        try:
+            import options
+        finally:
+            if unset:
+                del os.environ[BACKEND_ENV]
+    import options
+    from name_index import NameIndex
+    from recent import RecentContacts
+
+    saved = (options.dmgr, options.names, options.recent)
+    options.dmgr = dmgr
+    options.names = NameIndex(dmgr)
+    options.recent = RecentContacts(dmgr)
+    try:
+        yield options.OPTIONS
+    finally:
+        options.dmgr, options.names, options.recent = saved
+
+
+def replay(actions: List[Action], dmgr: StorageBackend,
+           stats: Optional[Stats] = None) -> List[ActionResult]:
+    """Runs the `actions` one after the other on the book `dmgr`, like
+    the main loop does, with their answers injected and their output
+    captured
+
+    :param actions: The parsed script
+    :type actions: List[Action]
+    :param dmgr: The book the options work on
+    :type dmgr: StorageBackend
+    :param stats: Where the latency of each action is also recorded
+    :type stats: Optional[Stats]
+
+    :raises ScriptError: If an option doesn't exist or the answers don't
+     match its prompts
+
+    :returns: The results in the order of the actions
+    :rtype: List[ActionResult]
+    """
+
+    results = []
+    with using_book(dmgr) as menu:
+        for action in actions:
+            if action.option not in menu:
+                raise ScriptError(f"Unknown option: {action.option!r}")
+            prompts: List[str] = []
+            output = io.StringIO()
+            with _injected(action.inputs, prompts), redirect_stdout(output):
+                start = time.perf_counter()
+                menu[action.option]()
+                elapsed = time.perf_counter() - start
+                dmgr.commit()
+            if stats is not None:
+                stats.record(OPTION, action.option, elapsed)
+            results.append(ActionResult(action.option, elapsed, prompts,
+                                        output.getvalue()))
+    return results
+
+
+def synthetic_book(
+        size: int, backend: str = "memory",
+        path: Union[str, Path, None] = None, seed: int = 0
+        ) -> StorageBackend:
+    """Builds a book of `size` contacts named after `FIRST_NAMES` and
+    `LAST_NAMES` (so a name matches a tenth of the book), with the phone
+    nos. `+91-9000000000` onwards, added over the last year and every
+    `GROUP_EVERY`th of them in the Work group
+
+    :param size: No. of contacts
+    :type size: int
+    :param backend: `memory` or `sqlite`
+    :type backend: str
+    :param path: Database of the `sqlite` backend, in memory if `None`
+    :type path: Union[str, Path, None]
+    :param seed: Seed of the dates the contacts were added on
+    :type seed: int
+
+    :rtype: StorageBackend
+    """
+
+    rng = random.Random(seed)
+    dmgr: StorageBackend = MemoryBackend() if backend == "memory" \
+        else DataManager(path or ":memory:")
+    now = datetime.now()
+    with dmgr.transaction():
+        for i in range(size):
+            first = FIRST_NAMES[i % len(FIRST_NAMES)]
+            last = LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]
+            added = now - timedelta(minutes=rng.randrange(365 * 24 * 60))
+            email = f"{first}.{i}@example.com".lower() if i % 2 else None
+            dmgr.create_contact(Contact(i + 1, first, last, added,
+                                        f"+91-{9000000000 + i}",
+                                        email=email))
+    dmgr.create_group("Work")
+    group_id = dmgr.fetch_groups()[0][0]
+    for cid in range(1, size + 1, GROUP_EVERY):
+        dmgr.add_contacts_to_group(group_id, cid)  # type: ignore
+    dmgr.commit()
+    return dmgr
+
+
+def _copy_database(source: Path, target: Path) -> None:
+    # Through the backup API, so changes still in the WAL are copied too
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def load_test(actions: List[Action], sizes: List[int],
+              backend: str = "memory", repeat: int = 1) -> Dict[int, Stats]:
+    """Replays the script `repeat` times on a synthetic book of each of
+    the `sizes`, every time on a fresh copy of the book so each run
+    sees the same data, and returns the latencies of the actions by size
+
+    :rtype: Dict[int, Stats]
+    """
+
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            template = Path(tmp_dir) / f"book-{size}.sqlite"
+            book = synthetic_book(size, backend, template)
+            stats = Stats()
+            for run in range(repeat):
+                if backend == "memory":
+                    copied: StorageBackend = copy.deepcopy(book)
+                else:
+                    path = Path(tmp_dir) / f"run-{size}-{run}.sqlite"
+                    _copy_database(template, path)
+                    copied = DataManager(path)
+                replay(actions, copied, stats)
+            results[size] = stats
+    return results
+
+
+class ScriptRecorder:
+    """Records the options chosen in a session and the answers typed at
+    their prompts to a script at `path`, see the module's docs"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.write_text(f"# Recorded on {datetime.now():%Y-%m-%d %H:%M}"
+                             "\n")
+
+    @contextmanager
+    def action(self, option: str) -> Iterator[None]:
+        """Records the answers typed while the option `option` runs"""
+
+        lines = [f"> {option}"]
+        real_input = builtins.input
+
+        def recording_input(prompt: object = "") -> str:
+            answer = real_input(prompt)
+            lines.append(_escape(answer))
+            return answer
+
+        builtins.input = recording_input
+        try:
+            yield
+        finally:
+            builtins.input = real_input
+            with self.path.open("a") as script:
+                script.write("\n".join(lines) + "\n")
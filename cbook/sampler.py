@@ -0,0 +1,152 @@
+"""
+This module contains an opt-in sampling profiler, so a slow session on a
+user's book can be recorded without having the book. A timer signal
+interrupts the application every few milliseconds and the stack of the
+main thread is counted, at exit the counts are written in the collapsed
+format read by flamegraph tools, e.g.
+
+    __main__:main;options:print_available_contacts;datamanager:... 42
+
+Nothing is installed unless sampling is turned on, so it costs nothing
+otherwise. Only the main thread is sampled
+"""
+from collections import Counter
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import signal
+import sys
+import time
+from types import FrameType
+from typing import Iterator, List, Optional, Tuple, Union
+
+# Environment variable naming the file the samples are written to
+SAMPLE_ENV = "CBOOK_SAMPLE"
+# Environment variable setting the milliseconds between samples
+INTERVAL_ENV = "CBOOK_SAMPLE_INTERVAL"
+# Seconds between samples
+DEFAULT_INTERVAL = 0.005
+# Deepest stack recorded, deeper frames are dropped from the root side
+MAX_DEPTH = 200
+
+
+def _label(frame: FrameType) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__") or Path(code.co_filename).stem
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    """Counts the stacks of the main thread every `interval` seconds of
+    CPU time, or of wall clock time if `wall` is `True`, which also
+    counts the time spent waiting for input
+
+    A signal arriving while SQLite (or any other C code) runs is only
+    handled once it returns, so each sample is weighted by the no. of
+    intervals elapsed since the previous one instead of being counted
+    once"""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL,
+                 wall: bool = False):
+        if not hasattr(signal, "setitimer"):
+            raise RuntimeError("Sampling needs signal.setitimer, which isn't"
+                               " available on this platform")
+        self.interval = interval
+        self.wall = wall
+        self.counts: Counter = Counter()
+        self._timer = signal.ITIMER_REAL if wall else signal.ITIMER_PROF
+        self._signal = signal.SIGALRM if wall else signal.SIGPROF
+        self._clock = time.perf_counter if wall else time.process_time
+        self._last = 0.0
+        self._previous_handler = None
+
+    @property
+    def samples(self) -> int:
+        """Total weight of the samples taken"""
+
+        return sum(self.counts.values())
+
+    def _sample(self, signum: int, frame: Optional[FrameType]) -> None:
+        now = self._clock()
+        weight = max(round((now - self._last) / self.interval), 1)
+        self._last = now
+        stack: List[str] = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            stack.append(_label(frame))
+            frame = frame.f_back
+        self.counts[tuple(reversed(stack))] += weight
+
+    def start(self) -> None:
+        """Starts sampling, must be called from the main thread"""
+
+        self._previous_handler = signal.signal(self._signal, self._sample)
+        self._last = self._clock()
+        signal.setitimer(self._timer, self.interval, self.interval)
+
+    def stop(self) -> None:
+        """Stops sampling, the samples taken are kept"""
+
+        signal.setitimer(self._timer, 0)
+        signal.signal(self._signal, self._previous_handler or signal.SIG_DFL)
+
+    def collapsed(self) -> List[str]:
+        """Returns the samples as collapsed stacks, `frame;frame count`
+        with the outermost frame first, the most sampled stack first
+
+        :rtype: List[str]
+        """
+
+        return [f"{';'.join(stack)} {count}"
+                for stack, count in self.counts.most_common()]
+
+    def write(self, path: Union[str, Path]) -> None:
+        """Writes the collapsed stacks to `path`"""
+
+        Path(path).write_text("".join(line + "\n"
+                                      for line in self.collapsed()))
+
+
+def settings(
+        path: Optional[str] = None,
+        interval_ms: Optional[float] = None) -> Tuple[Optional[str], float]:
+    """Returns the file the samples are written to (`None` if sampling is
+    off) and the seconds between samples, from the arguments or else
+    from the `CBOOK_SAMPLE` and `CBOOK_SAMPLE_INTERVAL` environment
+    variables"""
+
+    path = path or os.environ.get(SAMPLE_ENV) or None
+    if interval_ms is None and os.environ.get(INTERVAL_ENV):
+        interval_ms = float(os.environ[INTERVAL_ENV])
+    interval = interval_ms / 1000 if interval_ms else DEFAULT_INTERVAL
+    return path, interval
+
+
+@contextmanager
+def sampling(path: Optional[Union[str, Path]],
+             interval: float = DEFAULT_INTERVAL,
+             wall: bool = False) -> Iterator[Optional[StackSampler]]:
+    """Samples the enclosed block and writes the collapsed stacks to
+    `path` when it is left, even through `exit`. Does nothing if `path`
+    is `None`
+
+    :param path: File the collapsed stacks are written to
+    :type path: Optional[Union[str, Path]]
+    :param interval: Seconds between samples
+    :type interval: float
+    :param wall: Sample wall clock time instead of CPU time
+    :type wall: bool
+
+    :rtype: Iterator[Optional[StackSampler]]
+    """
+
+    if path is None:
+        yield None
+        return
+    sampler = StackSampler(interval, wall)
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
+        sampler.write(path)
+        print(f"Wrote {sampler.samples} samples to {path}", file=sys.stderr)
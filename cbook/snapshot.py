@@ -0,0 +1,270 @@
+"""
+This module compiles the contact book into a compact read-only binary
+snapshot and reads it back through `mmap`, so lookups on kiosks and
+other read-only deployments don't need SQLite at all
+
+Layout of a snapshot (all integers little endian)::
+
+    header    magic, counts and offsets of the sections below
+    contacts  fixed size records sorted by name (as listed by the book)
+    phones    (key, record no.) entries sorted by phone no. key
+    names     (key, record no.) entries sorted by `name_key`
+    pool      UTF-8 strings referenced by (offset, length) pairs
+"""
+from bisect import bisect_right
+import mmap
+from pathlib import Path
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from datamanager import Contact, DataManager, name_key, phone_key
+
+SNAPSHOT_PATH = Path.home() / ".cbook_contacts.snap"
+
+MAGIC = b"CBSNAP01"
+# magic, no. of contacts, phone entries and name entries, followed by
+# the offsets of the contacts, phones, names and pool sections
+HEADER = struct.Struct("<8sIIIQQQQ")
+# id, date_added (microseconds since epoch) and (offset, length) of the
+# first_name, last_name, phone_personal, phone_work, phone_home, email
+# and address strings
+RECORD = struct.Struct("<qq" + "II" * 7)
+# (offset, length) of the key and the record no.
+ENTRY = struct.Struct("<III")
+
+NULL = 0xFFFFFFFF
+
+
+def _name_keys(contact: Contact) -> List[str]:
+    """Returns the keys under which `contact` is found by name"""
+
+    keys = [name_key(contact.first_name)]
+    if contact.last_name:
+        keys.append(name_key(contact.last_name))
+    return keys
+
+
+def compile_snapshot(
+        dmgr: DataManager, path: Union[str, Path] = SNAPSHOT_PATH) -> int:
+    """Writes a snapshot of all the contacts managed by `dmgr` to
+    `path`, returns the number of contacts written
+
+    :param dmgr: The contact book to compile
+    :type dmgr: DataManager
+    :param path: Path of the snapshot file
+    :type path: Union[str, Path]
+
+    :rtype: int
+    """
+
+    record_no = dict()
+
+    pool = bytearray()
+    strings = dict()
+
+    def intern(text: Optional[str]):
+        if text is None:
+            return NULL, 0
+        if text not in strings:
+            data = text.encode()
+            strings[text] = (len(pool), len(data))
+            pool.extend(data)
+        return strings[text]
+
+    records = bytearray()
+    names = []
+    for i, contact in enumerate(dmgr.iter_contacts()):
+        record_no[contact.db_id] = i
+        refs = []
+        for text in (contact.first_name, contact.last_name,
+                     contact.phone_personal, contact.phone_work,
+                     contact.phone_home, contact.email, contact.address):
+            refs.extend(intern(text))
+        records.extend(
+            RECORD.pack(contact.db_id, contact.added_timestamp, *refs))
+        names.extend((key, i) for key in _name_keys(contact))
+
+    phones = [(key, record_no[cid])
+              for key, cid, _, _ in dmgr.fetch_caller_ids()
+              if cid in record_no]
+
+    def pack_entries(entries) -> bytearray:
+        data = bytearray()
+        for key, i in sorted(entries, key=lambda e: e[0].encode()):
+            data.extend(ENTRY.pack(*intern(key), i))
+        return data
+
+    phone_data = pack_entries(phones)
+    name_data = pack_entries(names)
+
+    contacts_at = HEADER.size
+    phones_at = contacts_at + len(records)
+    names_at = phones_at + len(phone_data)
+    pool_at = names_at + len(name_data)
+    header = HEADER.pack(MAGIC, len(record_no), len(phones), len(names),
+                         contacts_at, phones_at, names_at, pool_at)
+
+    # Writing to a temporary file first, so readers never see a
+    # partially written snapshot
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as sfile:
+        for section in (header, records, phone_data, name_data, pool):
+            sfile.write(section)
+    tmp_path.replace(path)
+    return len(record_no)
+
+
+class SnapshotReader:
+    """Reads a snapshot written by `compile_snapshot`, lookups are binary
+    searches over the memory mapped file and return the same `Contact`
+    objects as `DataManager`"""
+
+    def __init__(self, path: Union[str, Path] = SNAPSHOT_PATH):
+        with open(path, "rb") as sfile:
+            self._mm = mmap.mmap(sfile.fileno(), 0, access=mmap.ACCESS_READ)
+        # Slices of a memoryview share the mapped memory instead of
+        # copying it
+        self._view = memoryview(self._mm)
+        # See `_name_strings`
+        self._names_by_offset: Optional[
+            Tuple[List[int], List[Tuple[int, List[int]]]]] = None
+        (magic, self._n_contacts, self._n_phones, self._n_names,
+         self._contacts_at, self._phones_at, self._names_at,
+         self._pool_at) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a contact book snapshot")
+
+    def close(self):
+        self._view.release()
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _string(self, offset: int, length: int) -> Optional[str]:
+        if offset == NULL:
+            return None
+        start = self._pool_at + offset
+        return str(self._view[start:start + length], "utf-8")
+
+    def _contact(self, i: int) -> Contact:
+        db_id, added, *refs = RECORD.unpack_from(
+            self._mm, self._contacts_at + i * RECORD.size)
+        texts = [self._string(refs[j], refs[j + 1])
+                 for j in range(0, len(refs), 2)]
+        first_name, last_name, personal, work, home, email, address = texts
+        # The timestamp is decoded by `Contact` only if it's accessed
+        return Contact(db_id, first_name, last_name,  # type: ignore
+                       added, personal, work, home, email, address)
+
+    def _entry(self, section_at: int, i: int) -> Tuple[memoryview, int]:
+        offset, length, record = ENTRY.unpack_from(
+            self._mm, section_at + i * ENTRY.size)
+        start = self._pool_at + offset
+        return self._view[start:start + length], record
+
+    def _search(
+            self, section_at: int, count: int, key: bytes) -> Iterator[int]:
+        """Yields the record no. of the entries whose key equals `key`"""
+
+        size = len(key)
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            # Memoryviews can't be ordered, but an entry sorts before
+            # `key` iff its first `size` bytes do, so only they are copied
+            if bytes(self._entry(section_at, mid)[0][:size]) < key:
+                low = mid + 1
+            else:
+                high = mid
+        for i in range(low, count):
+            entry_key, record = self._entry(section_at, i)
+            if len(entry_key) != size or entry_key != key:
+                break
+            yield record
+
+    def _name_strings(self) -> Tuple[List[int], List[Tuple[int, List[int]]]]:
+        """Returns the pool offsets of the name keys, sorted, and the
+        (length, record nos.) of the key at each offset. Built on the
+        first substring search, which is the only one needing them"""
+
+        if self._names_by_offset is None:
+            strings: Dict[int, Tuple[int, List[int]]] = dict()
+            for i in range(self._n_names):
+                offset, length, record = ENTRY.unpack_from(
+                    self._mm, self._names_at + i * ENTRY.size)
+                strings.setdefault(offset, (length, []))[1].append(record)
+            offsets = sorted(strings)
+            self._names_by_offset = (offsets,
+                                     [strings[o] for o in offsets])
+        return self._names_by_offset
+
+    def _contacts(self, records) -> List[Contact]:
+        # Records are stored in name order, so sorting them by their
+        # position gives the same order as `DataManager`
+        return [self._contact(i) for i in sorted(set(records))]
+
+    def get_contact_count(self) -> int:
+        """Returns the total number of contacts in the snapshot"""
+
+        return self._n_contacts
+
+    def fetch_contacts(self, limit: int = 10) -> List[Contact]:
+        """Returns a maximum of `limit` contacts in sorted order"""
+
+        return [self._contact(i)
+                for i in range(min(limit, self._n_contacts))]
+
+    def fetch_by_exact_phone(self, phone: str) -> List[Contact]:
+        """Returns all the contacts having `phone` as one of their
+        phone numbers, compared by their canonical key"""
+
+        key = phone_key(phone)
+        if key is None:
+            return []
+        records = self._search(self._phones_at, self._n_phones, key.encode())
+        return self._contacts(records)
+
+    def fetch_by_phone_no(self, phone: str) -> List[Contact]:
+        """Returns the contacts having a phone no. equal to `phone`, if
+        no number matches exactly then the contacts with a number
+        containing `phone` are returned"""
+
+        data = self.fetch_by_exact_phone(phone)
+        if data:
+            return data
+        # Partial numbers can't be binary searched
+        data = []
+        for i in range(self._n_contacts):
+            contact = self._contact(i)
+            numbers = (contact.phone_personal, contact.phone_work,
+                       contact.phone_home)
+            if any(phone in number for number in numbers if number):
+                data.append(contact)
+        return data
+
+    def fetch_by_name(self, name: str) -> List[Contact]:
+        """Returns all the contacts whose first or last name contains
+        `name`, compared by their `name_key` like `DataManager` does
+
+        The string pool is searched for `name` and the matches falling
+        inside a name key are kept, so the names aren't decoded"""
+
+        key = name_key(name).encode()  # type: ignore[union-attr]
+        if not key:
+            return self._contacts(range(self._n_contacts))
+        offsets, strings = self._name_strings()
+        records: List[int] = []
+        found = self._mm.find(key, self._pool_at)
+        while found != -1:
+            offset = found - self._pool_at
+            i = bisect_right(offsets, offset) - 1
+            if i >= 0 and offset + len(key) <= offsets[i] + strings[i][0]:
+                records.extend(strings[i][1])
+            found = self._mm.find(key, found + 1)
+        return self._contacts(records)
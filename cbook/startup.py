@@ -1,11 +1,23 @@
+import atexit
 import configparser as cfg
+import os
 from pathlib import Path
 
 import pyfiglet as pfg  # type: ignore
 
+from backup import BackupScheduler
+from config import CONF_PATH, load_config
+from datamanager import DataManager, StorageBackend
 from input_handlers import ask_text
+from instrumentation import STATS, instrument_backend, instrument_options
+from maintenance import MaintenanceScheduler, TRASH_DAYS
 from options import OPTIONS
 
+# Default file the performance stats are written to at exit
+STATS_PATH = Path.home() / ".cbook_stats.json"
+# Environment variable turning on the timing of SQL statements
+TRACE_SQL_ENV = "CBOOK_TRACE_SQL"
+
 
 def show_help():
     """Shows a list of available options and other helpful
@@ -24,7 +36,7 @@ def setup():
     """Prompt's the user for his details and set's up
     the configuration file used by the program"""
 
-    conf_path = Path.home() / ".cbook_conf.ini"
+    conf_path = CONF_PATH
     if not conf_path.exists():
         full_name = ask_text("Please provide your full name: ", True)
         country_code = ask_text(
@@ -49,10 +61,63 @@ def greet_user():
     print(formatted_text)
 
     # Displaying the user's name
-    conf_path = Path.home() / ".cbook_conf.ini"
+    conf_path = CONF_PATH
     with conf_path.open() as cfile:
         parser = cfg.ConfigParser()
         parser.read_file(cfile)
         name = parser.get("USER", "name")
     print(f"Welcome, {name}!")
 
+
+def start_backups(dmgr: StorageBackend):
+    """Starts backing up the contact book `dmgr` in the background if an
+    interval is set in the `BACKUP` section of the configuration file,
+    e.g. `interval_hours = 24` and optionally `keep = 7`"""
+
+    parser = load_config()
+    if (not parser.has_option("BACKUP", "interval_hours")
+            or not isinstance(dmgr, DataManager) or dmgr.path == ":memory:"):
+        return None
+    interval = parser.getfloat("BACKUP", "interval_hours") * 3600
+    keep = parser.getint("BACKUP", "keep", fallback=7)
+    scheduler = BackupScheduler(dmgr.path, interval, keep=keep)
+    scheduler.start()
+    return scheduler
+
+
+def start_maintenance(dmgr: StorageBackend):
+    """Starts maintaining the contact book in the background whenever
+    the app is idle, configured in the `MAINTENANCE` section of the
+    configuration file with `idle_minutes` (5 by default, 0 disables
+    it) and `trash_days` (30 by default)"""
+
+    parser = load_config()
+    idle_minutes = parser.getfloat("MAINTENANCE", "idle_minutes",
+                                   fallback=5)
+    if (idle_minutes <= 0 or not isinstance(dmgr, DataManager)
+            or dmgr.path == ":memory:"):
+        return None
+    trash_days = parser.getint("MAINTENANCE", "trash_days",
+                               fallback=TRASH_DAYS)
+    scheduler = MaintenanceScheduler(
+        dmgr.path, idle_seconds=idle_minutes * 60, trash_days=trash_days)
+    scheduler.start()
+    return scheduler
+
+
+def start_instrumentation(dmgr: StorageBackend, options: dict):
+    """Starts recording the latencies of the methods of the contact book
+    and of the menu options, configured in the `STATS` section of the
+    configuration file with `dump` (where they are written as JSON at
+    exit, `~/.cbook_stats.json` by default, empty to not write them)
+    and `trace_sql` (time every SQL statement, also turned on by the
+    `CBOOK_TRACE_SQL` environment variable)"""
+
+    parser = load_config()
+    trace_sql = bool(os.environ.get(TRACE_SQL_ENV)) or parser.getboolean(
+        "STATS", "trace_sql", fallback=False)
+    instrument_backend(dmgr, trace_sql=trace_sql)
+    instrument_options(options)
+    dump = parser.get("STATS", "dump", fallback=str(STATS_PATH))
+    if dump:
+        atexit.register(STATS.dump, Path(dump).expanduser())
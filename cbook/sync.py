@@ -0,0 +1,278 @@
+"""
+This module syncs two contact books both ways. Instead of comparing
+every contact, both books are split into ranges of ids whose digests
+are compared, and only the ranges which differ are split further, like
+the nodes of a Merkle tree. The contacts of the differing leaf ranges
+are then compared one by one and the most recently modified version of
+each wins, deletions included
+
+Contacts are compared by id, but each of them also carries a uid shared
+by all the copies of the book. Two different uids under the same id mean
+that each book created a contact of its own under this id, one of them
+is then given a new id, so both contacts end up in both books
+"""
+from pathlib import Path
+import sqlite3
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from config import get_storage_settings, open_book
+from datamanager import apply_settings
+
+# No. of sub ranges a differing range is split into
+FANOUT = 16
+# Ranges with at most this many contacts are compared row by row
+LEAF_SIZE = 256
+
+# Digest of the contacts and tombstones with ids in [?, ?), two sums of
+# differently mixed (id, modified, uid) triples computed by SQLite
+# itself, so hashing doesn't need the rows to leave the database.
+# Tombstones are mixed in with a negated modification time
+DIGEST_QUERY = """
+    SELECT COUNT(*),
+        COALESCE(SUM(((id % 2147483647) * 2654435761 + modified
+                      + uid % 2147483647) % 2147483647), 0),
+        COALESCE(SUM(((modified % 1000000007) * 40503 + id)
+                     % 1000000007), 0)
+    FROM (
+        SELECT id, modified, uid FROM {schema}.Contacts
+            WHERE id >= ? AND id < ?
+        UNION ALL
+        SELECT id, -modified, ifnull(uid, 0) FROM {schema}.Deleted_contacts
+            WHERE id >= ? AND id < ?
+    )
+"""
+
+ROWS_QUERY = """
+    SELECT id, modified, 1, uid FROM {schema}.Contacts
+        WHERE id >= ? AND id < ?
+    UNION ALL
+    SELECT id, modified, 0, uid FROM {schema}.Deleted_contacts
+        WHERE id >= ? AND id < ?
+"""
+
+BOUNDS_QUERY = """
+    SELECT MIN(id), MAX(id) FROM (
+        SELECT id FROM {schema}.Contacts
+        UNION ALL
+        SELECT id FROM {schema}.Deleted_contacts
+    )
+"""
+
+# State of a contact in a book: (modified, exists, uid), `None` if
+# unknown. Tombstones written before uids existed have a `None` uid
+State = Optional[Tuple[int, bool, Optional[int]]]
+
+
+class SyncResult(NamedTuple):
+    """Details of a finished sync"""
+
+    to_local: int       # Contacts copied or deleted in the local book
+    to_remote: int      # Contacts copied or deleted in the remote book
+    ranges: int         # No. of id ranges whose digests were compared
+    differing: int      # No. of contacts which differed
+    rekeyed: int        # Contacts given a new id, as the other book had
+                        # created a different contact under their id
+    elapsed: float      # Seconds taken by the sync
+
+
+def _diff(
+        conn: sqlite3.Connection,
+        low: int, high: int) -> Tuple[Dict[int, Tuple[State, State]], int]:
+    """Returns the (local, remote) states of the contacts with ids in
+    [`low`, `high`) which differ between the books, along with the
+    number of ranges compared"""
+
+    differing: Dict[int, Tuple[State, State]] = dict()
+    ranges = 0
+    pending = [(low, high)]
+    while pending:
+        low, high = pending.pop()
+        ranges += 1
+        params = (low, high, low, high)
+        local = conn.execute(DIGEST_QUERY.format(schema="main"),
+                             params).fetchone()
+        remote = conn.execute(DIGEST_QUERY.format(schema="remote"),
+                              params).fetchone()
+        if local == remote:
+            continue
+        if max(local[0], remote[0]) > LEAF_SIZE and high - low > FANOUT:
+            step = -(-(high - low) // FANOUT)
+            pending.extend((start, min(start + step, high))
+                           for start in range(low, high, step))
+            continue
+
+        states: Dict[int, List[State]] = dict()
+        for i, schema in enumerate(("main", "remote")):
+            query = ROWS_QUERY.format(schema=schema)
+            for cid, modified, exists, uid in conn.execute(query, params):
+                states.setdefault(cid, [None, None])[i] = \
+                    (modified, bool(exists), uid)
+        for cid, (local_state, remote_state) in states.items():
+            if local_state != remote_state:
+                differing[cid] = (local_state, remote_state)
+    return differing, ranges
+
+
+def _separate(
+        conn: sqlite3.Connection,
+        differing: Dict[int, Tuple[State, State]], next_id: int) -> int:
+    """Gives a new id, from `next_id` onwards, to each contact sharing
+    its id with a different contact (or the tombstone of one) in the
+    other book, and updates `differing` accordingly. When both books
+    have a contact under the id, the one of the remote book is moved.
+    Returns the no. of contacts moved"""
+
+    moved = 0
+    for cid, states in list(differing.items()):
+        local_state, remote_state = states
+        if local_state is None or remote_state is None:
+            continue
+        uids = (local_state[2], remote_state[2])
+        if None in uids or uids[0] == uids[1] or not (
+                local_state[1] or remote_state[1]):
+            continue
+        side = 1 if remote_state[1] else 0
+        _rekey(conn, ("main", "remote")[side], cid, next_id)
+        moved_states: List[State] = [None, None]
+        moved_states[side] = states[side]
+        differing[next_id] = tuple(moved_states)  # type: ignore
+        remaining: List[State] = list(states)
+        remaining[side] = None
+        differing[cid] = tuple(remaining)  # type: ignore
+        next_id += 1
+        moved += 1
+    return moved
+
+
+def _rekey(conn: sqlite3.Connection, schema: str, old: int, new: int):
+    """Moves the contact with id `old` of the book attached as `schema`
+    to the id `new` along with its phone nos., groups and rank. Foreign
+    keys must be deferred"""
+
+    # The change log sees the contact leave its old id and be updated
+    # under the new one
+    conn.execute(f"""INSERT INTO {schema}.Changes(table_name, op, key, data)
+            VALUES('Contacts', 'delete', json_object('id', ?), NULL)""",
+                 (old,))
+    conn.execute(f"UPDATE {schema}.Contacts SET id = ? WHERE id = ?",
+                 (new, old))
+    for table in ("Phones", "Group_members", "Contact_ranks"):
+        conn.execute(f"UPDATE {schema}.{table} SET c_id = ? WHERE c_id = ?",
+                     (new, old))
+
+
+def _copy(conn: sqlite3.Connection, src: str, dst: str,
+          ids: List[int]) -> None:
+    """Makes the contacts with ids in `ids` in the book attached as
+    `dst` identical to the ones in `src`, including deletions"""
+
+    if not ids:
+        return
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS Sync_ids"
+                 "(id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM Sync_ids")
+    conn.executemany("INSERT INTO Sync_ids VALUES(?)",
+                     ((cid,) for cid in ids))
+    selected = "IN (SELECT id FROM temp.Sync_ids)"
+
+    conn.execute(f"DELETE FROM {dst}.Phones WHERE c_id {selected}")
+    # Deleted contacts also leave their groups, through the foreign keys
+    conn.execute(f"""DELETE FROM {dst}.Contacts WHERE id {selected}
+            AND id NOT IN (SELECT id FROM {src}.Contacts)""")
+    conn.execute(f"""INSERT INTO {dst}.Contacts(id, first_name, last_name,
+                email, address, date_added, modified, first_key, last_key,
+                uid)
+            SELECT id, first_name, last_name, email, address, date_added,
+                modified, first_key, last_key, uid
+            FROM {src}.Contacts WHERE id {selected}
+            ON CONFLICT(id) DO UPDATE SET
+                uid = excluded.uid,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                first_key = excluded.first_key,
+                last_key = excluded.last_key,
+                email = excluded.email,
+                address = excluded.address,
+                date_added = excluded.date_added,
+                modified = excluded.modified""")
+    # A number taken over by one of these contacts is removed from any
+    # other contact still holding it
+    conn.execute(f"""DELETE FROM {dst}.Phones WHERE (number_key, kind) IN (
+            SELECT number_key, kind FROM {src}.Phones WHERE c_id {selected})
+            """)
+    conn.execute(f"""INSERT INTO {dst}.Phones(c_id, kind, number, number_key)
+            SELECT c_id, kind, number, number_key FROM {src}.Phones
+            WHERE c_id {selected} ORDER BY rowid""")
+    conn.execute(f"DELETE FROM {dst}.Deleted_contacts WHERE id {selected}")
+    conn.execute(f"""INSERT INTO {dst}.Deleted_contacts(id, modified, uid)
+            SELECT id, modified, uid FROM {src}.Deleted_contacts
+            WHERE id {selected}""")
+
+
+def sync_books(
+        local: Union[str, Path],
+        remote: Union[str, Path],
+        dry_run: bool = False) -> SyncResult:
+    """Syncs the books at `local` and `remote` both ways, so that both
+    end up with the most recently modified version of every contact.
+    All the changes to both books are applied in a single transaction
+
+    Only contacts and their phone numbers are synced, groups are local
+    to each book
+
+    :param local: Path of one of the books
+    :type local: Union[str, Path]
+    :param remote: Path of the other book
+    :type remote: Union[str, Path]
+    :param dry_run: Only count the contacts which would be synced
+    :type dry_run: bool
+
+    :returns: Details of the sync
+    :rtype: SyncResult
+    """
+
+    start = time.perf_counter()
+    # Opening each book once brings its schema up to date
+    open_book(local).commit()
+    open_book(remote).commit()
+
+    conn = sqlite3.connect(local, isolation_level=None)
+    apply_settings(conn, get_storage_settings())
+    try:
+        conn.execute("ATTACH DATABASE ? AS remote", (str(remote),))
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("BEGIN IMMEDIATE")
+        # Contacts moved to a new id are only consistent with their phone
+        # nos. and groups again once all of them are moved
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+        try:
+            bounds = [conn.execute(BOUNDS_QUERY.format(schema=schema))
+                      .fetchone() for schema in ("main", "remote")]
+            lows = [low for low, _ in bounds if low is not None]
+            highs = [high for _, high in bounds if high is not None]
+            differing: Dict[int, Tuple[State, State]] = dict()
+            ranges = rekeyed = 0
+            if lows:
+                differing, ranges = _diff(conn, min(lows), max(highs) + 1)
+                rekeyed = _separate(conn, differing, max(highs) + 1)
+
+            to_local, to_remote = [], []
+            for cid, (local_state, remote_state) in differing.items():
+                # Unknown contacts are older than any known state
+                if (remote_state or (-1, False))[:2] \
+                        > (local_state or (-1, False))[:2]:
+                    to_local.append(cid)
+                else:
+                    to_remote.append(cid)
+            if not dry_run:
+                _copy(conn, "remote", "main", to_local)
+                _copy(conn, "main", "remote", to_remote)
+            conn.execute("ROLLBACK" if dry_run else "COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return SyncResult(len(to_local), len(to_remote), ranges,
+                      len(differing), rekeyed, time.perf_counter() - start)
@@ -0,0 +1,150 @@
+"""
+This module measures the effect of the storage profiles
+(`datamanager.PROFILES`) and storage backends on common operations, so
+the settings can be tuned for a given contact book without code changes
+"""
+from datetime import datetime
+from pathlib import Path
+import random
+import sqlite3
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+from datamanager import (
+    Contact, DataManager, PROFILES, StorageBackend, storage_settings)
+from memory_backend import MemoryBackend
+
+# Operations measured by `benchmark_profiles` and `benchmark_backends`,
+# in the order of the report
+OPERATIONS = ("open", "list all", "search by name", "exact phone lookup",
+              "bulk insert")
+
+
+def _timed(func: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _bulk_insert(dmgr: StorageBackend, count: int) -> None:
+    new_id = dmgr.get_new_id()
+    now = datetime.now()
+    with dmgr.transaction():
+        for i in range(count):
+            number = f"+99-{random.randrange(10**9, 10**10)}"
+            dmgr.create_contact(
+                Contact(new_id + i, f"Bench{i}", "Profile", now, number))
+    dmgr.commit()
+
+
+def _run_operations(
+        open_backend: Callable[[], StorageBackend],
+        lookups: int, inserts: int) -> Dict[str, float]:
+    """Runs the `OPERATIONS` on the backend returned by `open_backend`,
+    returns the seconds taken by each"""
+
+    timings = dict()
+    start = time.perf_counter()
+    dmgr = open_backend()
+    timings["open"] = time.perf_counter() - start
+
+    contacts: List[Contact] = []
+    timings["list all"] = _timed(
+        lambda: contacts.extend(dmgr.iter_contacts()))
+    names = [c.first_name for c in random.sample(
+        contacts, min(lookups, len(contacts)))]
+    timings["search by name"] = _timed(
+        lambda: [dmgr.fetch_by_name(name) for name in names])
+    numbers = [c.phone_personal for c in random.sample(
+        contacts, min(lookups, len(contacts)))]
+    timings["exact phone lookup"] = _timed(
+        lambda: [dmgr.fetch_by_exact_phone(n) for n in numbers])
+    timings["bulk insert"] = _timed(lambda: _bulk_insert(dmgr, inserts))
+    del dmgr
+    return timings
+
+
+def _copy_book(source: Union[str, Path], target: Path,
+               page_size: Optional[int] = None) -> None:
+    """Copies the book at `source` to `target` with pages of `page_size`
+    bytes (the ones of `source` if `None`)
+
+    The backup copies the pages as they are, so the page size of the
+    copy is changed afterwards, which takes a VACUUM outside WAL mode
+
+    :raises RuntimeError: If SQLite didn't apply the page size
+    """
+
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+        if page_size is not None:
+            dst.execute("PRAGMA journal_mode = delete").fetchall()
+            dst.execute(f"PRAGMA page_size = {int(page_size)}")
+            dst.execute("VACUUM")
+            actual = dst.execute("PRAGMA page_size").fetchone()[0]
+            if actual != page_size:
+                raise RuntimeError(f"The page size of the copy is {actual}"
+                                   f" instead of {page_size}")
+    finally:
+        src.close()
+        dst.close()
+
+
+def benchmark_profile(
+        source: Union[str, Path],
+        profile: str,
+        lookups: int = 100,
+        inserts: int = 1000) -> Dict[str, float]:
+    """Runs the `OPERATIONS` on a copy of the book at `source` opened
+    with the settings of `profile`, returns the seconds taken by each
+
+    The copy is needed as settings like journal_mode persist in the
+    database file"""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        copy = Path(tmp_dir) / "bench.sqlite"
+        settings = storage_settings(profile)
+        _copy_book(source, copy, settings.get("page_size"))  # type: ignore
+        timings = _run_operations(
+            lambda: DataManager(copy, settings=settings), lookups, inserts)
+    return timings
+
+
+def benchmark_profiles(
+        source: Union[str, Path],
+        profiles: Optional[List[str]] = None,
+        **options) -> Dict[str, Dict[str, float]]:
+    """Runs `benchmark_profile` for each of the `profiles` (all of them
+    if `None`), returns the timings by profile name"""
+
+    return {profile: benchmark_profile(source, profile, **options)
+            for profile in (profiles or list(PROFILES))}
+
+
+def _load_into(backend: StorageBackend, source: DataManager):
+    """Copies every contact of `source` into `backend`"""
+
+    with backend.transaction():
+        for contact in source.iter_contacts():
+            backend.create_contact(contact)
+    return backend
+
+
+def benchmark_backends(
+        source: Union[str, Path],
+        lookups: int = 100,
+        inserts: int = 1000) -> Dict[str, Dict[str, float]]:
+    """Runs the `OPERATIONS` on the contacts of the book at `source`
+    loaded into each in-memory backend, so they can be compared on the
+    same workload as the profiles. For these backends "open" is the
+    time taken to load the contacts"""
+
+    dmgr = DataManager(source)
+    backends = {
+        "sqlite-memory": lambda: _load_into(DataManager(":memory:"), dmgr),
+        "memory": lambda: _load_into(MemoryBackend(), dmgr),
+    }
+    return {name: _run_operations(open_backend, lookups, inserts)
+            for name, open_backend in backends.items()}
@@ -4,6 +4,18 @@ from cbook.datamanager import Contact
 import datetime
 
 
+def pytest_addoption(parser):
+    group = parser.getgroup("performance")
+    group.addoption("--perf", action="store_true",
+                    help="Also run the timing tests of test_performance")
+    group.addoption("--update-baselines", action="store_true",
+                    help="Store the measured timings and query plans as the"
+                         " new baselines")
+    group.addoption("--perf-tolerance", type=float, default=0.5,
+                    help="Slowdown over the baselines tolerated by the"
+                         " timing tests, 0.5 is 50%%")
+
+
 @pytest.fixture
 def dummy_contacts():
     contacts = [
@@ -3,6 +3,8 @@ import sys
 
 # Adding the previous directory to path so that tests can import modules
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Modules inside cbook import each other by their plain names
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'cbook')))
 import cbook
 
 
@@ -0,0 +1,243 @@
+import copy
+import datetime
+import pytest
+
+from .context import cbook
+import config
+from datamanager import Contact, DataManager
+from memory_backend import MemoryBackend
+
+
+def load(backend, contacts):
+    with backend.transaction():
+        for contact in contacts:
+            assert backend.create_contact(contact)
+    backend.create_group("family")
+    backend.create_group("servants")
+    for g_id, c_id in [(1, 1), (1, 4), (1, 7), (2, 12), (2, 10)]:
+        assert backend.add_contacts_to_group(g_id, c_id)
+    return backend
+
+
+def workload(backend, contacts):
+    """Runs the same changes and queries on `backend`, returns the
+    results of all of them"""
+
+    results = [
+        backend.fetch_by_name("raju"),
+        backend.fetch_by_name("y"),
+        backend.fetch_by_phone_no("+741923905397"),
+        backend.fetch_by_phone_no("6100"),
+        backend.fetch_by_exact_phone("74-19-23905397"),
+        backend.fetch_contacts(12),
+        backend.fetch_added_between(contacts[3].date_added,
+                                    contacts[9].date_added),
+        backend.get_contacts_from_group(1),
+        backend.get_country_code_counts(),
+        sorted(backend.fetch_caller_ids()),
+        backend.get_new_id(),
+        backend.get_contact(5),
+        backend.get_contact(99),
+    ]
+
+    # Duplicate id and phone no. are rejected
+    results.append(backend.create_contact(contacts[0]))
+    results.append(backend.create_contact(
+        contacts[0]._replace(db_id=31, phone_personal="+1 (633) 347-347957")))
+    results.append(backend.update_contact(
+        contacts[1]._replace(phone_work="+894107995871")))
+    results.append(backend.update_contact(contacts[1]._replace(db_id=99)))
+    results.append(backend.update_contact(
+        contacts[1]._replace(first_name="Zoya", phone_home=None)))
+    results.append(backend.add_phone_number(2, "+91 11 2345 6789", "fax"))
+    results.append(backend.add_phone_number(2, "+911123456789", "fax"))
+    results.append(backend.add_phone_number(99, "+919999999999"))
+    backend.remove_phone_number(3, "+438791346098")
+    backend.delete_contact(contacts[3])
+    backend.remove_contacts_from_group(2, 12)
+    results.append(backend.add_contacts_to_group(1, 1))
+    results.append(backend.add_contacts_to_group(3, 1))
+    backend.delete_group(2)
+
+    results += [
+        backend.fetch_contacts(100),
+        backend.fetch_phone_numbers(2),
+        backend.fetch_phone_numbers(3),
+        backend.fetch_groups(),
+        backend.get_contacts_from_group(1),
+        backend.get_contact_count(),
+        backend.get_group_size(1),
+        backend.get_group_size(2),
+        backend.get_country_code_counts(),
+    ]
+    return results
+
+
+def test_backends_agree(dummy_contacts):
+    expected = workload(load(DataManager(":memory:"), dummy_contacts),
+                        dummy_contacts)
+    assert workload(load(MemoryBackend(), dummy_contacts),
+                    dummy_contacts) == expected
+
+
+def test_memory_transaction_rollback(dummy_contacts):
+    backend = load(MemoryBackend(), dummy_contacts)
+    with pytest.raises(RuntimeError):
+        with backend.transaction():
+            backend.delete_contact(dummy_contacts[0])
+            backend.create_group("friends")
+            raise RuntimeError
+    assert backend.get_contact_count() == 30
+    assert backend.fetch_by_exact_phone("+633347347957") == [
+        dummy_contacts[0]]
+    assert len(backend.fetch_groups()) == 2
+
+
+def test_memory_transaction_undo_log(dummy_contacts, monkeypatch):
+    backend = load(MemoryBackend(), dummy_contacts)
+    backend.record_access(2)
+    new = Contact(31, "Rahul", "Verma", datetime.datetime.now(),
+                  "+91-2188195975")
+    before = copy.deepcopy(backend.__dict__)
+    # Only the changed entries are saved, never the whole book
+    monkeypatch.setattr(copy, "deepcopy", None)
+
+    with pytest.raises(RuntimeError):
+        with backend.transaction():
+            assert backend.update_contact(dummy_contacts[1]._replace(
+                first_name="Zed", phone_work=None))
+            backend.remove_contacts_from_group(1, 1)
+            with backend.transaction():
+                assert backend.trash_contact(dummy_contacts[3])
+                assert backend.add_phone_number(5, "+911234567890")
+            backend.record_access(2)
+            backend.delete_group(2)
+            backend.create_group("friends")
+            assert backend.create_contact(new)
+            raise RuntimeError
+    assert backend.__dict__ == before
+
+    # An inner transaction is undone on its own
+    with backend.transaction():
+        assert backend.create_contact(new)
+        with pytest.raises(RuntimeError):
+            with backend.transaction():
+                backend.delete_contact(new)
+                raise RuntimeError
+    assert backend.get_contact(31) == new
+    assert backend._undo == []
+
+
+def test_memory_added_between(dummy_contacts):
+    backend = load(MemoryBackend(), dummy_contacts)
+    since = dummy_contacts[-2].date_added
+    assert backend.fetch_added_since(since) == dummy_contacts[-2:]
+    assert backend.fetch_added_between(
+        since - datetime.timedelta(days=1), since) == dummy_contacts[:-2]
+
+
+def test_open_storage(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "CONF_PATH", tmp_path / "conf.ini")
+    monkeypatch.setenv(config.BACKEND_ENV, "memory")
+    assert isinstance(config.open_storage(), MemoryBackend)
+    monkeypatch.setenv(config.BACKEND_ENV, "sqlite-memory")
+    assert config.open_storage().path == ":memory:"
+    monkeypatch.setenv(config.BACKEND_ENV, "sqlite")
+    path = tmp_path / "book.sqlite"
+    assert config.open_storage(path).path == path
+    monkeypatch.setenv(config.BACKEND_ENV, "mongodb")
+    with pytest.raises(ValueError):
+        config.open_storage()
+
+
+def test_settings_on_every_connection(monkeypatch, tmp_path):
+    import callerid
+    import maintenance
+
+    conf = tmp_path / "conf.ini"
+    conf.write_text("[STORAGE]\ncache_size = -1234\n")
+    monkeypatch.setattr(config, "CONF_PATH", conf)
+    path = tmp_path / "book.sqlite"
+    assert config.open_book(path).effective_settings()["cache_size"] == -1234
+
+    # Connections opened by the background threads get them too
+    opened = []
+    monkeypatch.setattr(
+        maintenance, "maintain",
+        lambda dmgr, **args: opened.append(dmgr.effective_settings()))
+    maintenance.MaintenanceScheduler(path).run_once()
+    index = callerid.NumberIndex(path)
+    index.refresh()
+    opened.append(index._dmgr.effective_settings())
+    assert [settings["cache_size"] for settings in opened] == [-1234, -1234]
+
+
+
+@pytest.mark.parametrize("backend", [DataManager, MemoryBackend])
+def test_unicode_names(backend):
+    book = backend() if backend is MemoryBackend else backend(":memory:")
+    now = datetime.datetime.now()
+    names = [("zoë", None), ("Émile", "Zola"), ("ÉMILIE", "Durand"),
+             ("Ze\u0301lie", "Roy"), ("आरव", "शर्मा"), ("Aarav", "STRASSE"),
+             ("éliane", "Roux")]
+    for i, (first, last) in enumerate(names, 1):
+        assert book.create_contact(
+            Contact(i, first, last, now, f"+91-99000000{i:02}"))
+
+    # Sorted ignoring the case, so "éliane" isn't listed after "ÉMILIE"
+    assert [c.db_id for c in book.fetch_contacts(10)] == [6, 1, 4, 7, 2, 3, 5]
+    assert [c.db_id for c in book.fetch_by_name("émil")] == [2, 3]
+    # A composed query matches a decomposed name
+    assert [c.db_id for c in book.fetch_by_name("Zé")] == [4]
+    assert [c.db_id for c in book.fetch_by_name("straße")] == [6]
+    assert [c.db_id for c in book.fetch_by_name("शर्")] == [5]
+
+
+@pytest.mark.parametrize("backend", [DataManager, MemoryBackend])
+def test_trash(backend, dummy_contacts):
+    book = load(backend() if backend is MemoryBackend else backend(":memory:"),
+                dummy_contacts)
+    assert book.add_phone_number(1, "+91 11 2345 6789", "fax")
+    before = book.get_contact(1)
+    phones = book.fetch_phone_numbers(1)
+
+    assert book.trash_contact(before)
+    assert not book.trash_contact(before)
+    assert book.get_contact(1) is None
+    assert book.get_group_size(1) == 2
+    [entry] = book.fetch_trash()
+    assert entry.contact == before and entry.phones == phones
+    assert entry.groups == [1]
+
+    # Restoring fails while another contact holds one of its numbers
+    other = dummy_contacts[1]._replace(db_id=40, phone_work=None,
+                                       phone_home=None,
+                                       phone_personal="+633347347957")
+    assert book.create_contact(other)
+    assert book.restore_contact(entry.trash_id) is None
+    assert book.get_contact(1) is None
+    assert len(book.fetch_trash()) == 1
+    book.delete_contact(other)
+
+    assert book.restore_contact(entry.trash_id) == before
+    assert book.get_contact(1) == before
+    assert book.fetch_phone_numbers(1) == phones
+    assert [c.db_id for c in book.get_contacts_from_group(1)] == [1, 4, 7]
+    assert book.fetch_trash() == []
+    assert book.restore_contact(entry.trash_id) is None
+
+    # A contact whose id was taken gets a new one
+    assert book.trash_contact(book.get_contact(4))
+    assert book.create_contact(dummy_contacts[4]._replace(
+        db_id=4, phone_personal=None, phone_work=None, phone_home=None))
+    new_id = book.get_new_id()
+    restored = book.restore_contact(book.fetch_trash()[0].trash_id)
+    assert restored.db_id == new_id and restored.first_name == "Hemant"
+
+    for contact in dummy_contacts[10:13]:
+        assert book.trash_contact(contact)
+    assert [e.contact.db_id for e in book.fetch_trash()] == [13, 12, 11]
+    cutoff = book.fetch_trash()[0].deleted + datetime.timedelta(seconds=1)
+    assert book.purge_trash(datetime.datetime(2000, 1, 1)) == 0
+    assert book.purge_trash(cutoff) == 3
+    assert book.fetch_trash() == []
@@ -0,0 +1,71 @@
+import sqlite3
+import time
+
+import pytest
+
+from .context import cbook
+from cbook.backup import (
+    BackupScheduler, backup_database, list_backups, restore_database)
+from cbook.datamanager import DataManager
+
+
+@pytest.fixture
+def book(tmp_path, dummy_contacts):
+    path = tmp_path / "book.sqlite"
+    mgr = DataManager(path)
+    for contact in dummy_contacts:
+        assert mgr.create_contact(contact)
+    mgr.commit()
+    return path
+
+
+def test_backup_and_restore(tmp_path, book):
+    backup_dir = tmp_path / "backups"
+    steps = []
+    result = backup_database(
+        book, backup_dir, pages=1,
+        progress=lambda remaining, total: steps.append(remaining))
+    assert result.path.name.endswith(".sqlite.gz")
+    assert result.size > 0
+    assert result.throughput > 0
+    # Copied one page at a time
+    assert len(steps) > 1 and steps[-1] == 0
+
+    mgr = DataManager(book)
+    mgr.delete_contact(mgr.fetch_by_name("Kumari")[0])
+    mgr.commit()
+    assert mgr.get_contact_count() == 29
+
+    restored = restore_database(result.path, book)
+    assert restored.size == result.size
+    assert DataManager(book).get_contact_count() == 30
+
+
+def test_backup_rotation(tmp_path, book):
+    backup_dir = tmp_path / "backups"
+    paths = [backup_database(book, backup_dir, compress=False, keep=2).path
+             for _ in range(3)]
+    assert list_backups(backup_dir) == paths[:0:-1]
+
+
+def test_restore_corrupt_backup(tmp_path, book):
+    corrupt = tmp_path / "corrupt.sqlite"
+    corrupt.write_bytes(b"SQLite format 3\0" + b"\xff" * 2000)
+    with pytest.raises(sqlite3.DatabaseError):
+        restore_database(corrupt, book)
+    assert DataManager(book).get_contact_count() == 30
+
+
+def test_scheduler_backs_up_source(tmp_path, book):
+    backup_dir = tmp_path / "backups"
+    scheduler = BackupScheduler(book, 0.01, backup_dir=backup_dir,
+                                compress=False, keep=1)
+    scheduler.start()
+    deadline = time.monotonic() + 5
+    while scheduler.last_result is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    scheduler.join()
+    assert scheduler.last_error is None
+    # The book given is copied, not the default one
+    assert DataManager(scheduler.last_result.path).get_contact_count() == 30
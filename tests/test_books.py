@@ -0,0 +1,64 @@
+import pytest
+
+from .context import cbook
+from cbook import books, config
+from cbook.datamanager import DataManager
+
+
+@pytest.fixture(autouse=True)
+def book_files(tmp_path, monkeypatch, dummy_contacts):
+    paths = dict()
+    for i, name in enumerate(("default", "team", "company")):
+        paths[name] = tmp_path / f"{name}.sqlite"
+        mgr = DataManager(paths[name])
+        # Every book gets every third contact
+        for contact in dummy_contacts[i::3]:
+            assert mgr.create_contact(contact)
+        del mgr
+    monkeypatch.setattr(books, "get_books", lambda: dict(paths))
+    return paths
+
+
+def test_get_books(tmp_path, monkeypatch):
+    conf_path = tmp_path / "conf.ini"
+    conf_path.write_text("[BOOKS]\nteam = ~/team.sqlite\n")
+    monkeypatch.setattr(config, "CONF_PATH", conf_path)
+    found = config.get_books()
+    assert found["default"] == config.DATA_PATH
+    assert found["team"] == config.Path.home() / "team.sqlite"
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_search_books(processes, dummy_contacts):
+    matches, timings = books.search_books("Raju", processes=processes)
+    assert set(timings) == {"default", "team", "company"}
+    expected = sorted(
+        (c for c in dummy_contacts if c.first_name == "Raju"),
+        key=lambda c: (c.first_name, c.last_name))
+    assert [m.contact.last_name for m in matches] == [
+        c.last_name for c in expected]
+    assert sorted(m.contact for m in matches) == sorted(expected)
+    # Book of each match
+    for match in matches:
+        assert match.book == ("default", "team", "company")[
+            (match.contact.db_id - 1) % 3]
+
+
+def test_search_selected_books():
+    matches, timings = books.search_books(
+        "+741923905397", by_phone=True, books=["default", "company"])
+    assert set(timings) == {"default", "company"}
+    assert [(m.book, m.contact.db_id) for m in matches] == [
+        ("company", 15), ("company", 18)]
+    with pytest.raises(KeyError):
+        books.search_books("Raju", books=["missing"])
+
+
+def test_attach_search():
+    matches, _ = books.search_books("Kumar")
+    attached, elapsed = books.attach_search("Kumar")
+    assert attached == matches
+    assert elapsed > 0
+    matches, _ = books.search_books("192390", by_phone=True)
+    attached, _ = books.attach_search("192390", by_phone=True)
+    assert attached == matches
@@ -0,0 +1,143 @@
+import socket
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from .context import cbook
+from cbook.callerid import CallerIDClient, CallerIDServer, load_test
+from cbook.datamanager import DataManager
+
+
+@pytest.fixture
+def server(tmp_path, dummy_contacts):
+    db_path = tmp_path / "book.sqlite"
+    mgr = DataManager(db_path)
+    for contact in dummy_contacts[:5]:
+        assert mgr.create_contact(contact)
+    del mgr
+
+    server = CallerIDServer(tmp_path / "cid.sock", db_path, 0.05)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_lookup(server):
+    with CallerIDClient(server.socket_path) as client:
+        assert client.lookup("+633347347957") == (1, "Aayushman Kumar")
+        assert client.lookup("81999863748") == (1, "Aayushman Kumar")
+        assert client.lookup("+85-5087558021") == (4, "Hemant Kumar")
+        assert client.lookup("+000000000000") is None
+        assert client.lookup("") is None
+
+
+def test_refresh_on_change(server):
+    mgr = DataManager(server.index.db_path)
+    assert mgr.add_phone_number(2, "+911234567890")
+    del mgr
+    # Waiting for the background refresh to pick up the change
+    for _ in range(100):
+        if server.index.lookup("+911234567890"):
+            break
+        time.sleep(0.01)
+    assert server.index.lookup("+911234567890") == (2, "Aayushman Gupta")
+
+
+def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_incremental_refresh(server):
+    mgr = DataManager(server.index.db_path)
+    contact = mgr.get_contact(1)
+    assert mgr.update_contact(contact._replace(last_name="Singh"))
+    mgr.commit()
+    assert wait_for(lambda: server.index.lookup("81999863748")
+                    == (1, "Aayushman Singh"))
+    # Only the changes were applied, the map wasn't rebuilt
+    rebuild = server.index._rebuild
+    server.index._rebuild = lambda: pytest.fail("The map was rebuilt")
+    try:
+        mgr.delete_contacts([1])
+        mgr.commit()
+        assert wait_for(lambda: server.index.lookup("+633347347957") is None)
+        assert server.index.lookup("81999863748") is None
+        assert server.index.lookup("+85-5087558021") == (4, "Hemant Kumar")
+    finally:
+        server.index._rebuild = rebuild
+
+
+def test_rebuild_after_compaction(server):
+    mgr = DataManager(server.index.db_path)
+    assert mgr.add_phone_number(3, "+911234567890")
+    mgr.compact_changes(upto=mgr.change_version())
+    mgr.commit()
+    assert wait_for(lambda: server.index.lookup("+911234567890")
+                    == (3, "Aayushman Yadav"))
+    assert len(server.index) == 16
+
+
+def test_startup_error(tmp_path):
+    with pytest.raises(sqlite3.OperationalError):
+        CallerIDServer(tmp_path / "cid.sock",
+                       tmp_path / "missing" / "book.sqlite")
+    assert not (tmp_path / "cid.sock").exists()
+
+
+def test_refresh_retried(server, monkeypatch, capsys):
+    refresh = server.index.refresh
+    failures = []
+
+    def locked():
+        if not failures:
+            failures.append(True)
+            raise sqlite3.OperationalError("database is locked")
+        return refresh()
+
+    monkeypatch.setattr(server.index, "refresh", locked)
+    mgr = DataManager(server.index.db_path)
+    assert mgr.add_phone_number(2, "+911234567890")
+    mgr.commit()
+    assert wait_for(lambda: server.index.lookup("+911234567890"))
+    assert failures
+    assert server.last_error is None
+    assert "database is locked" in capsys.readouterr().err
+
+
+def test_second_daemon_refused(server):
+    with pytest.raises(OSError, match="already listening"):
+        CallerIDServer(server.socket_path, server.index.db_path)
+    # The running daemon keeps its socket
+    with CallerIDClient(server.socket_path) as client:
+        assert client.lookup("+633347347957") == (1, "Aayushman Kumar")
+
+
+def test_stale_socket_replaced(tmp_path, server):
+    # A socket nobody listens on any more is taken over
+    stale = tmp_path / "stale.sock"
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(stale))
+    sock.close()
+    second = CallerIDServer(stale, server.index.db_path)
+    second.server_close()
+    assert not stale.exists()
+
+
+def test_load_test_few_samples(server, tmp_path):
+    stats = load_test(server.socket_path, server.index.db_path,
+                      requests=1, clients=1)
+    assert stats["requests"] == 1 and stats["failed_clients"] == 0
+    assert stats["p50_ms"] == stats["p99_ms"] > 0
+
+    stats = load_test(tmp_path / "missing.sock", server.index.db_path,
+                      requests=4, clients=2)
+    assert stats["requests"] == 0 and stats["failed_clients"] == 2
+    assert stats["p99_ms"] == 0.0
@@ -3,7 +3,8 @@ import sqlite3
 import pytest
 
 from .context import cbook
-from cbook.datamanager import DataManager, SCHEMA, Contact
+from cbook.datamanager import (
+    DataManager, SCHEMA, Contact, MigrationError, storage_settings)
 
 
 @pytest.fixture(autouse=True)
@@ -627,3 +628,337 @@ def test_get_contacts_from_group():
             address=None,
         ),
     ]
+
+
+def test_fetch_by_exact_phone():
+    mgr = DataManager()
+    expected = [
+        Contact(
+            db_id=10,
+            first_name="Kunal",
+            last_name="Yadav",
+            date_added=datetime.datetime(2022, 10, 23, 14, 44, 19, 768345),
+            phone_personal="+702288195975",
+            phone_work="+808831891248",
+            phone_home="+335815989437",
+            email=None,
+            address=None,
+        )
+    ]
+    assert mgr.fetch_by_exact_phone("+808831891248") == expected
+    assert mgr.fetch_by_exact_phone("+80-8831891248") == expected
+    assert mgr.fetch_by_exact_phone("808831891248") == expected
+    # Partial numbers are not exact matches
+    assert mgr.fetch_by_exact_phone("8831891248") == []
+    assert mgr.fetch_by_exact_phone("") == []
+
+
+def test_create_contact_duplicate_phone_formats():
+    mgr = DataManager()
+    # Same personal no. as contact 10, written with a separator
+    contact = Contact(
+        31, "Rahul", "Verma", datetime.datetime.now(), "+70-2288195975"
+    )
+    assert not mgr.create_contact(contact)
+
+
+def test_migration_duplicate_phone_formats():
+    # `connect` is mocked, this is the book of the fixture, which hasn't
+    # been migrated yet
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""INSERT INTO Contacts(id, first_name, date_added)
+        VALUES(31, 'Rahul', '2022-10-23 14:44:19')""")
+    # Same personal no. as contact 10, written without the +
+    conn.execute("""INSERT INTO Phone_numbers(c_id, personal)
+        VALUES(31, '702288195975')""")
+    conn.commit()
+
+    with pytest.raises(MigrationError) as error:
+        DataManager()
+    assert "'+702288195975' (contact 10), '702288195975' (contact 31)" \
+        in str(error.value)
+    assert conn.execute("PRAGMA user_version").fetchone() == (0,)
+
+    # Once the duplicate is removed, the book is upgraded
+    conn.execute("DELETE FROM Phone_numbers WHERE c_id = 31")
+    conn.commit()
+    mgr = DataManager()
+    assert [c.db_id for c in mgr.fetch_by_exact_phone("702288195975")] \
+        == [10]
+
+
+def test_failed_migration_rolled_back(monkeypatch):
+    migrations = cbook.datamanager.MIGRATIONS
+    monkeypatch.setattr(cbook.datamanager, "MIGRATIONS", migrations[:1] + [
+        "CREATE TABLE Half_done(x); SELECT no_such_function();"])
+    with pytest.raises(MigrationError, match="still at version 1"):
+        DataManager()
+    conn = sqlite3.connect(":memory:")
+    assert conn.execute("PRAGMA user_version").fetchone() == (1,)
+    assert not conn.execute("""SELECT name FROM sqlite_master
+        WHERE name = 'Half_done'""").fetchall()
+    assert not conn.in_transaction
+
+
+def test_add_phone_number():
+    mgr = DataManager()
+    assert mgr.add_phone_number(10, "+911234567890")
+    assert mgr.add_phone_number(10, "+911234567891")
+    # Same number can't be stored twice with the same kind
+    assert not mgr.add_phone_number(4, "+91-1234567890")
+    assert mgr.fetch_phone_numbers(10) == [
+        ("personal", "+702288195975"),
+        ("work", "+808831891248"),
+        ("home", "+335815989437"),
+        ("mobile", "+911234567890"),
+        ("mobile", "+911234567891"),
+    ]
+    contacts = mgr.fetch_by_phone_no("911234567891")
+    assert [c.db_id for c in contacts] == [10]
+    assert contacts[0].phone_personal == "+702288195975"
+
+    mgr.remove_phone_number(10, "+911234567890")
+    assert mgr.fetch_by_exact_phone("+911234567890") == []
+
+
+def test_phone_numbers_view():
+    mgr = DataManager()
+    contact = Contact(
+        db_id=20,
+        first_name="Prakash",
+        last_name="Gupta",
+        date_added=datetime.datetime(2022, 10, 23, 14, 44, 19, 768495),
+        phone_personal="+688532624571",
+        phone_work=None,
+        phone_home="+720360101603",
+    )
+    assert mgr.update_contact(contact)
+    assert mgr.fetch_by_name("Prakash")[0] == contact
+    conn = sqlite3.connect(":memory:")  # patched, returns the mock db
+    rows = conn.execute(
+        "SELECT personal, work, home FROM Phone_numbers WHERE c_id = 20"
+    ).fetchall()
+    assert rows == [("+688532624571", None, "+720360101603")]
+
+
+def test_iter_contacts():
+    mgr = DataManager(batch_size=3)
+    assert list(mgr.iter_contacts(10)) == mgr.fetch_contacts(10)
+    assert len(list(mgr.iter_contacts())) == 30
+    assert list(mgr.iter_by_name("Raju", batch_size=2)) == mgr.fetch_by_name(
+        "Raju")
+    assert list(mgr.iter_by_phone_no("192390")) == mgr.fetch_by_phone_no(
+        "192390")
+    assert list(mgr.iter_contacts_from_group(1)) == mgr.get_contacts_from_group(
+        1)
+
+    # Stopping early and writing while a generator is open
+    contacts = mgr.iter_contacts(batch_size=2)
+    first = next(contacts)
+    assert first.first_name == "Aayushman"
+    assert mgr.add_contacts_to_group(2, first.db_id)
+    contacts.close()
+    assert first in mgr.get_contacts_from_group(2)
+
+
+def test_fetch_added_between():
+    mgr = DataManager()
+    start = datetime.datetime(2022, 10, 23, 14, 44, 19, 768579)
+    end = datetime.datetime(2022, 10, 23, 14, 44, 19, 768623)
+    assert [c.db_id for c in mgr.fetch_added_between(start, end)] == [
+        25, 26, 27]
+    assert [c.db_id for c in mgr.fetch_added_since(end)] == [28, 29, 30]
+    assert mgr.fetch_added_since(datetime.datetime(2023, 1, 1)) == []
+
+    contact = Contact(31, "Rahul", "Verma", datetime.datetime.now(),
+                      "+321894123572")
+    assert mgr.create_contact(contact)
+    assert mgr.fetch_added_since(datetime.datetime(2023, 1, 1)) == [contact]
+
+
+def test_date_added_decoded_lazily():
+    mgr = DataManager()
+    contact = mgr.fetch_by_name("Kumari")[0]
+    assert isinstance(tuple.__getitem__(contact, 3), int)
+    assert contact.date_added == datetime.datetime(
+        2022, 10, 23, 14, 44, 19, 768360)
+    assert "datetime.datetime(2022, 10, 23" in repr(contact)
+
+
+def test_counters():
+    mgr = DataManager()
+    assert mgr.get_contact_count() == 30
+    assert mgr.get_group_size(1) == 3
+    assert mgr.get_group_size(2) == 2
+    assert mgr.get_group_size(3) == 0
+    counts = dict(mgr.get_country_code_counts())
+    assert counts["63"] == 1
+    assert counts["2"] == 1
+    assert sum(counts.values()) == 30
+
+    contact = Contact(31, "Rahul", "Verma", datetime.datetime.now(),
+                      "+91-2188195975")
+    assert mgr.create_contact(contact)
+    assert mgr.add_contacts_to_group(2, 31)
+    assert mgr.update_contact(contact._replace(phone_personal="+63-1234567890"))
+    assert mgr.get_contact_count() == 31
+    assert mgr.get_group_size(2) == 3
+    assert dict(mgr.get_country_code_counts())["63"] == 2
+    assert "91" not in dict(mgr.get_country_code_counts())
+
+    mgr.delete_contact(mgr.fetch_by_name("Kumari")[0])
+    mgr.delete_group(1)
+    assert mgr.get_contact_count() == 30
+    assert mgr.get_group_size(1) == 0
+    assert mgr.check_counters() == []
+
+
+def test_rebuild_counters():
+    mgr = DataManager()
+    conn = sqlite3.connect(":memory:")  # patched, returns the mock db
+    conn.execute("UPDATE Counters SET value = 5 WHERE name = 'contacts'")
+    conn.execute("DELETE FROM Counters WHERE name = 'group' AND key = '2'")
+    assert sorted(mgr.check_counters()) == [
+        ("contacts", "", 5, 30),
+        ("group", "2", 0, 2),
+    ]
+    mgr.rebuild_counters()
+    assert mgr.check_counters() == []
+    assert mgr.get_contact_count() == 30
+
+
+def test_storage_settings():
+    assert storage_settings() == {}
+    assert storage_settings("low-memory", {"cache_size": -500})[
+        "cache_size"] == -500
+    with pytest.raises(ValueError):
+        storage_settings("turbo")
+    with pytest.raises(ValueError):
+        storage_settings(overrides={"synchronous": 0})
+    with pytest.raises(ValueError):
+        storage_settings(overrides={"cache_size": "1; DROP TABLE Contacts"})
+
+    mgr = DataManager(settings=storage_settings("interactive"))
+    effective = mgr.effective_settings()
+    assert effective["cache_size"] == -16000
+    assert effective["temp_store"] == 2  # memory
+    # In-memory databases always use the memory journal
+    assert effective["journal_mode"] == "memory"
+
+
+def test_change_log():
+    mgr = DataManager()
+    # Rows present before the migration aren't logged
+    assert list(mgr.iter_changes()) == []
+    start = mgr.change_version()
+
+    contact = Contact(31, "Rahul", "Verma", datetime.datetime.now(),
+                      "+91-2188195975")
+    assert mgr.create_contact(contact)
+    assert mgr.update_contact(contact._replace(email="rahul@verma.in"))
+    mgr.add_contacts_to_group(1, 31)
+    mgr.delete_contact(mgr.fetch_by_name("Kumari")[0])
+
+    changes = list(mgr.iter_changes(start))
+    assert [c.version for c in changes] == list(
+        range(start + 1, mgr.change_version() + 1))
+    assert (changes[0].table, changes[0].op, changes[0].key) == (
+        "Contacts", "insert", {"id": 31})
+    assert changes[1].data == {"c_id": 31, "kind": "personal",
+                               "number": "+91-2188195975",
+                               "number_key": "912188195975"}
+    assert ("Contacts", "update", {"id": 31}) in [
+        (c.table, c.op, c.key) for c in changes]
+    assert ("Contacts", "delete", {"id": 11}, None) == (
+        changes[-1].table, changes[-1].op, changes[-1].key, changes[-1].data)
+    assert list(mgr.iter_changes(changes[-2].version)) == changes[-1:]
+
+
+def test_compact_changes():
+    mgr = DataManager()
+    contact = Contact(31, "Rahul", "Verma", datetime.datetime.now(),
+                      "+91-2188195975")
+    mgr.create_contact(contact)
+    for i in range(3):
+        mgr.update_contact(contact._replace(email=f"rahul{i}@verma.in"))
+    version = mgr.change_version()
+    mgr.create_group("friends")
+
+    # Only the latest change of each row is kept, the phone no. didn't
+    # change so only the contact's updates are dropped
+    assert mgr.compact_changes() == 3
+    changes = list(mgr.iter_changes())
+    assert [(c.table, c.op) for c in changes] == [
+        ("Phones", "insert"), ("Contacts", "update"), ("Groups", "insert")]
+    assert changes[1].data["email"] == "rahul2@verma.in"
+
+    assert mgr.compact_changes(upto=version) == 2
+    assert [c.table for c in mgr.iter_changes(version)] == ["Groups"]
+    with pytest.raises(ValueError):
+        mgr.iter_changes(version - 1)
+
+
+def test_update_contact_phones():
+    mgr = DataManager()
+    contact = Contact(31, "Rahul", "Verma", datetime.datetime.now(),
+                      "+91-2188195975", "+91-2188195976", "+91-2188195977")
+    assert mgr.create_contact(contact)
+    version = mgr.change_version()
+
+    # Unchanged numbers are left alone
+    assert mgr.update_contact(contact._replace(email="rahul@verma.in"))
+    assert [(c.table, c.op) for c in mgr.iter_changes(version)] == [
+        ("Contacts", "update")]
+
+    # Only the slots that changed are logged, the others keep their order
+    version = mgr.change_version()
+    assert mgr.update_contact(contact._replace(
+        phone_personal="+91-2188195978", phone_home=None))
+    assert mgr.fetch_phone_numbers(31) == [
+        ("personal", "+91-2188195978"), ("work", "+91-2188195976")]
+    assert sorted((c.table, c.op, c.key.get("kind"))
+                  for c in mgr.iter_changes(version)) == [
+        ("Contacts", "update", None), ("Phones", "delete", "home"),
+        ("Phones", "delete", "personal"), ("Phones", "insert", "personal")]
+    assert mgr.check_counters() == []
+
+    # A number taken by another contact fails the whole update
+    assert not mgr.update_contact(contact._replace(
+        phone_personal=mgr.fetch_phone_numbers(1)[0][1], email="x@y.in"))
+    assert mgr.get_contact(31).email is None
+
+
+def test_delete_contacts():
+    mgr = DataManager()
+    mgr.record_access(4)
+    version = mgr.change_version()
+    progress = []
+    assert mgr.delete_contacts([1, 4, 7, 10, 99], chunk_size=2,
+                               progress=lambda *args: progress.append(args)
+                               ) == 4
+    assert progress == [(2, 5), (4, 5), (5, 5)]
+
+    # Phone nos., memberships and ranks are deleted along with them
+    assert mgr.get_contact_count() == 26
+    assert mgr.fetch_phone_numbers(1) == []
+    assert mgr.get_group_size(1) == 0
+    assert [c.db_id for c in mgr.get_contacts_from_group(2)] == [12]
+    assert list(mgr.iter_frecent(5)) == []
+    assert mgr.check_counters() == []
+    assert {(c.table, c.op) for c in mgr.iter_changes(version)} == {
+        ("Contacts", "delete"), ("Phones", "delete"),
+        ("Group_members", "delete")}
+
+    with pytest.raises(RuntimeError):
+        with mgr.transaction():
+            mgr.delete_contacts([2])
+
+
+def test_delete_group_in_chunks():
+    mgr = DataManager()
+    assert mgr.delete_group_in_chunks(1, chunk_size=2) == 3
+    assert [name for _, name in mgr.fetch_groups()] == ["servants"]
+    assert mgr.get_contact_count() == 30
+    mgr.delete_group(2)
+    assert mgr.fetch_groups() == []
+    assert mgr.check_counters() == []
@@ -0,0 +1,102 @@
+from contextlib import contextmanager
+import datetime
+import json
+import time
+
+import pytest
+
+from .context import cbook
+from cbook.datamanager import Contact, DataManager
+from cbook.instrumentation import (
+    METHOD, Histogram, Stats, instrument_backend, instrument_options, timed)
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    assert histogram.percentile(0.5) == 0.0
+    for ms in range(1, 101):
+        histogram.add(ms / 1000)
+    assert histogram.count == 100
+    assert histogram.total == pytest.approx(5.05)
+    # Within a bucket's width of the exact values
+    assert histogram.percentile(0.5) == pytest.approx(0.050, rel=0.1)
+    assert histogram.percentile(0.95) == pytest.approx(0.095, rel=0.1)
+    assert histogram.percentile(0.99) == pytest.approx(0.099, rel=0.1)
+    assert histogram.percentile(1) == histogram.max == 0.1
+
+
+def test_instrument_backend(tmp_path):
+    book = DataManager(tmp_path / "book.sqlite")
+    now = datetime.datetime.now()
+    for i, name in enumerate(("Aayushman", "Raj", "Ananya"), start=1):
+        assert book.create_contact(Contact(i, name, "Sharma", now,
+                                           f"+91-98{i:08}"))
+    book.commit()
+
+    stats = Stats()
+    mgr = instrument_backend(book, stats, trace_sql=True)
+    assert [row[1] for row in mgr.fetch_by_name("Aayushman")] == \
+        ["Aayushman"]
+    assert len(list(mgr.iter_contacts(limit=5))) == 3
+    assert mgr.get_contact_count() == 3
+
+    counts = {name: summary["count"] for name, summary in stats.rows()}
+    assert counts["method:fetch_by_name"] == 1
+    # Called by `fetch_by_name` through the instance too
+    assert counts["method:iter_by_name"] == 1
+    assert counts["method:iter_contacts"] == 1
+    assert counts["method:get_contact_count"] == 1
+    statements = [name for name, _ in stats.rows("sql")]
+    # Literals are replaced, so the same statement is counted once
+    assert "sql:SELECT value FROM Counters WHERE name = ? AND key = ?" \
+        in statements
+    assert not any("Aayushman" in name for name in statements)
+
+    path = tmp_path / "stats.json"
+    stats.dump(path)
+    dumped = json.loads(path.read_text())
+    assert dumped["method:fetch_by_name"]["count"] == 1
+    assert set(dumped["method:fetch_by_name"]) == {
+        "count", "total", "p50", "p95", "p99", "max"}
+
+
+def test_timed_iterators_and_contexts():
+    stats = Stats()
+
+    def slow_items():
+        # A plain function returning an iterator, like `iter_contacts`
+        return (time.sleep(0.01) or i for i in range(3))
+
+    items = timed(METHOD, "slow_items", slow_items, stats)()
+    assert "method:slow_items" not in stats.histograms
+    for _ in items:
+        # The time the caller takes between the items isn't counted
+        time.sleep(0.02)
+    histogram = stats.histograms["method:slow_items"]
+    assert histogram.count == 1
+    assert 0.03 <= histogram.total < 0.06
+
+    @contextmanager
+    def transaction():
+        yield
+
+    with timed(METHOD, "transaction", transaction, stats)():
+        time.sleep(0.02)
+    assert stats.histograms["method:transaction"].total >= 0.02
+
+    # Sized results are returned as they are
+    rows = timed(METHOD, "rows", lambda: [1, 2], stats)()
+    assert rows == [1, 2]
+    assert stats.histograms["method:rows"].count == 1
+
+
+def test_instrument_options():
+    stats = Stats()
+    calls = []
+    options = {"List contacts": lambda: calls.append(1)}
+    instrument_options(options, stats)
+    options["List contacts"]()
+    options["List contacts"]()
+    assert calls == [1, 1]
+    assert stats.rows()[0][0] == "option:List contacts"
+    assert stats.rows()[0][1]["count"] == 2
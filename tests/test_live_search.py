@@ -0,0 +1,44 @@
+import pytest
+
+from .context import cbook
+from datamanager import DataManager
+from live_search import IncrementalSearch
+from memory_backend import MemoryBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, dummy_contacts):
+    backend = MemoryBackend() if request.param == "memory" \
+        else DataManager(":memory:")
+    for contact in dummy_contacts:
+        backend.create_contact(contact)
+    return backend
+
+
+def test_narrowing_by_name(backend):
+    search = IncrementalSearch(backend)
+    for query in ("a", "aa", "aay", "Aayushman", "Kumar", "Kumari"):
+        assert search.run(query) == backend.fetch_by_name(query)
+    # Extending a query reuses the previous results
+    assert search.narrowed == 4
+    search.run("Kum")
+    assert search.narrowed == 4
+
+
+def test_narrowing_by_phone(backend):
+    search = IncrementalSearch(backend, by_phone=True)
+    for query in ("9", "97", "975", "+702288195975", "+7022881959", "70228"):
+        assert search.run(query) == backend.fetch_by_phone_no(query)
+    # The exact match and its partial number are searched again
+    assert search.narrowed == 2
+
+
+def test_stale_search_dropped(backend):
+    search = IncrementalSearch(backend)
+    search.start("a")
+    assert not search.step(2)
+    assert len(search.results) == 2
+    # The unfinished results can't be narrowed
+    search.start("ab")
+    assert search.narrowed == 0
+    assert search.run("raju") == backend.fetch_by_name("raju")
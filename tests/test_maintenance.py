@@ -0,0 +1,142 @@
+import datetime
+import sqlite3
+import time
+
+import pytest
+
+from .context import cbook
+from cbook.datamanager import Contact, DataManager
+from cbook.maintenance import (
+    MaintenanceCancelled, MaintenanceScheduler, maintain)
+
+
+def trashed_book(path):
+    mgr = DataManager(path)
+    now = datetime.datetime.now()
+    with mgr.transaction():
+        for i in range(1, 3001):
+            assert mgr.create_contact(Contact(
+                i, f"Name{i}", "Surname", now, f"+91-98{i:08}",
+                address="Some long address " * 5))
+    assert mgr.delete_contacts(range(1, 2001), trash=True) == 2000
+    assert mgr.get_contact_count() == 1000
+    assert len(mgr.fetch_trash()) == 2000
+    return mgr
+
+
+def auto_vacuum(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_maintain(tmp_path):
+    mgr = trashed_book(tmp_path / "book.sqlite")
+
+    # Recent entries of the trash are kept
+    result = maintain(mgr, trash_days=30)
+    assert result.purged == 0
+    assert set(result.timings) == {"purge", "analyze", "vacuum"}
+    pages, free, page_size = mgr.page_stats()
+    assert free == 0
+
+    result = maintain(mgr, trash_days=0)
+    assert result.purged == 2000
+    assert result.reclaimed > 0
+    assert "optimize" in result.timings
+    assert mgr.page_stats()[0] < pages
+    assert mgr.fetch_trash() == []
+    assert mgr.get_contact_count() == 1000
+    assert mgr.check_counters() == []
+
+
+def test_maintain_without_converting(tmp_path):
+    path = tmp_path / "book.sqlite"
+    mgr = trashed_book(path)
+    result = maintain(mgr, trash_days=0, convert=False, analysis_limit=100)
+    assert result.purged == 2000
+    # The book isn't switched to incremental vacuuming, so the pages
+    # freed stay in the file
+    assert auto_vacuum(path) == 0
+    assert mgr.page_stats()[1] > 0
+
+    maintain(mgr, trash_days=0)
+    assert auto_vacuum(path) == 2
+    assert mgr.page_stats()[1] == 0
+
+
+def test_maintain_cancelled(tmp_path):
+    mgr = trashed_book(tmp_path / "book.sqlite")
+    checks = []
+
+    def cancelled():
+        checks.append(None)
+        # Once before the purge and once after its first chunk
+        return len(checks) > 1
+
+    with pytest.raises(MaintenanceCancelled):
+        maintain(mgr, trash_days=0, cancelled=cancelled)
+    # The chunk purged before the cancellation is kept
+    assert len(mgr.fetch_trash()) == 1000
+    assert mgr.check_counters() == []
+
+
+def test_scheduler_runs_when_idle(tmp_path):
+    scheduler = MaintenanceScheduler(tmp_path / "book.sqlite",
+                                     idle_seconds=60, interval=3600)
+    start = scheduler._idle_since
+    assert not scheduler.due(start + 30)
+    assert scheduler.due(start + 61)
+    scheduler.busy()
+    assert not scheduler.due(start + 120)
+    scheduler.idle()
+    assert not scheduler.due(scheduler._idle_since + 30)
+    scheduler._last_run = scheduler._idle_since
+    assert not scheduler.due(scheduler._idle_since + 600)
+    assert scheduler.due(scheduler._idle_since + 3601)
+
+
+def test_scheduler_maintains_book(tmp_path):
+    path = tmp_path / "book.sqlite"
+    mgr = DataManager(path)
+    assert mgr.create_contact(Contact(1, "Raj", None, datetime.datetime.now(),
+                                      "+91-9800000001"))
+    assert mgr.trash_contact(mgr.get_contact(1))
+    mgr.commit()
+
+    scheduler = MaintenanceScheduler(path, idle_seconds=0, poll=0.01,
+                                     trash_days=0)
+    scheduler.start()
+    deadline = time.monotonic() + 5
+    while scheduler.last_result is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    scheduler.join()
+    assert scheduler.last_error is None
+    assert scheduler.last_result.purged == 1
+    assert mgr.fetch_trash() == []
+
+
+def test_scheduler_stops_when_busy(tmp_path):
+    path = tmp_path / "book.sqlite"
+    trashed_book(path).commit()
+    scheduler = MaintenanceScheduler(path, idle_seconds=0, trash_days=0)
+
+    # A run starting as the app gets busy stops before doing anything
+    # and is retried once the app is idle again
+    scheduler.busy()
+    scheduler.run_once()
+    assert scheduler.last_result is None
+    assert scheduler.last_error is None
+    assert len(DataManager(path).fetch_trash()) == 2000
+    scheduler.idle()
+    assert scheduler.due()
+
+    scheduler.run_once()
+    assert scheduler.last_result.purged == 2000
+    assert not scheduler.due()
+    # The background never runs the full VACUUM switching the book to
+    # incremental vacuuming
+    assert auto_vacuum(path) == 0
@@ -0,0 +1,97 @@
+import datetime
+
+import pytest
+
+from .context import cbook
+from datamanager import Contact
+import input_handlers
+from memory_backend import MemoryBackend
+from name_index import NameIndex
+from replay import Action, replay
+
+
+def make_index(contacts):
+    backend = MemoryBackend()
+    for contact in contacts:
+        backend.create_contact(contact)
+    return backend, NameIndex(backend)
+
+
+def test_complete(dummy_contacts):
+    _, names = make_index(dummy_contacts)
+    assert names.complete("hem") == [
+        "Hemant Kumar", "Hemant Sharma", "Hemant Yadav"]
+    # Completed from the last name too
+    assert names.complete("KUMARI") == ["Kumari Neha"]
+    # Duplicate names are suggested once
+    assert names.complete("raju k") == ["Raju Kumar"]
+    assert len(names.complete("", limit=5)) == 5
+    assert names.complete("xyz") == []
+
+
+def test_lookup(dummy_contacts):
+    _, names = make_index(dummy_contacts)
+    assert names.lookup("neha kumari") == [11]
+    assert names.lookup("Kumari Neha") == [11]
+    assert names.lookup("Raju Kumar") == [15, 27]
+    assert names.lookup("Neha") == []
+
+
+def test_updates(dummy_contacts):
+    backend, names = make_index(dummy_contacts)
+    assert names.lookup("Neha Kumari") == [11]
+    old = dummy_contacts[10]
+    new = old._replace(last_name="Verma")
+    names.replace(old, new)
+    assert names.lookup("Neha Kumari") == []
+    assert names.complete("Neha V") == ["Neha Verma"]
+    names.remove(new)
+    assert names.complete("Neha V") == []
+    names.add(old._replace(db_id=31, first_name="Zoya", last_name=None))
+    assert names.lookup("zoya") == [31]
+
+
+@pytest.fixture
+def book(dummy_contacts):
+    backend = MemoryBackend()
+    for contact in dummy_contacts[:5]:
+        backend.create_contact(contact)
+    now = datetime.datetime.now()
+    backend.create_contact(Contact(31, "Ram", None, now, "+91-1111111111"))
+    backend.create_contact(Contact(32, "Ram", "Kumar", now, "+91-2222222222"))
+    backend.create_contact(Contact(33, "Shriram", None, now, "+91-3333333333"))
+    return backend
+
+
+def test_typed_name_not_selected(book):
+    # "Ram" is the full name of a contact, but also the start of others
+    [result] = replay([Action("View a contact's info", ["Ram", "0"])], book)
+    assert "Found 3 contacts" in result.output
+    assert result.prompts[-1] == "Enter the index: "
+    # The exact match comes first
+    table = result.output
+    assert table.index("+91-1111111111") < table.index("+91-2222222222") \
+        < table.index("+91-3333333333")
+
+
+def tab_completed(prefix):
+    """Replaces reading a line by pressing <Tab> after typing `prefix`
+    and accepting the first suggestion"""
+
+    return lambda prompt, completer: completer(prefix)[0]
+
+
+def test_completed_name_selected(book, monkeypatch):
+    monkeypatch.setattr(input_handlers, "_input_with_completion",
+                        tab_completed("Ram K"))
+    [result] = replay([Action("View a contact's info", [])], book)
+    assert "Found" not in result.output
+    assert "+91-2222222222" in result.output
+
+
+def test_completed_to_one_of_several(book, monkeypatch):
+    # Completing to one of several suggestions doesn't select it
+    monkeypatch.setattr(input_handlers, "_input_with_completion",
+                        tab_completed("Ra"))
+    [result] = replay([Action("View a contact's info", ["0"])], book)
+    assert "Found 3 contacts" in result.output
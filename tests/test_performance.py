@@ -0,0 +1,168 @@
+"""
+Performance tier: key operations run on a synthetic book and are
+compared with the baselines stored in perf_baselines.json. The query
+plans are checked on every run, an operation whose statements start
+scanning a table they didn't scan before fails. The timings are only
+checked with --perf, they fail when an operation gets slower than its
+baseline by more than --perf-tolerance, after scaling the baselines by
+the speed of the machine measured with a fixed workload
+
+Run with --update-baselines to store the current timings and plans
+"""
+import contextlib
+import datetime
+import io
+import itertools
+import json
+from pathlib import Path
+import time
+
+import pytest
+
+from .context import cbook
+from data_display import display_table, format_for_display
+from datamanager import Contact
+from replay import synthetic_book
+
+BASELINES = Path(__file__).with_name("perf_baselines.json")
+# No. of contacts of the synthetic book
+SIZE = 20000
+# Each timing is the best of this many runs
+REPEAT = 5
+# No. of contacts created by the bulk insert
+BULK = 1000
+
+_new_ids = itertools.count(SIZE + 1)
+
+
+def bulk_create(book):
+    now = datetime.datetime.now()
+    with book.transaction():
+        for _ in range(BULK):
+            cid = next(_new_ids)
+            book.create_contact(Contact(cid, "Bulk", "Insert", now,
+                                        f"+92-{9000000000 + cid}"))
+    book.commit()
+
+
+def display(rows):
+    with contextlib.redirect_stdout(io.StringIO()):
+        display_table(format_for_display(rows))
+
+
+# keys: operation, values: function running it on the book, given the
+# first 1000 contacts of the book
+OPERATIONS = {
+    "fetch_by_name":
+        lambda book, rows: book.fetch_by_name("kavya"),
+    "fetch_by_phone_no":
+        lambda book, rows: book.fetch_by_phone_no("900000123"),
+    "create_contact (bulk)":
+        lambda book, rows: bulk_create(book),
+    "get_contacts_from_group":
+        lambda book, rows: book.get_contacts_from_group(1),
+    "display_table":
+        lambda book, rows: display(rows),
+}
+
+
+def best_of(func, repeat=REPEAT):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def calibration():
+    """Seconds taken by a fixed pure Python workload, the baselines are
+    scaled by how much faster or slower it runs on this machine"""
+
+    return best_of(lambda: sorted(str(i) for i in range(100000)))
+
+
+def query_plans(book, func):
+    """Returns the distinct query plans of the statements run by `func`"""
+
+    statements = []
+    book.set_trace_callback(statements.append)
+    try:
+        func()
+    finally:
+        book.set_trace_callback(None)
+    plans = set()
+    for statement in statements:
+        if statement.lstrip().split(" ", 1)[0].upper() in (
+                "SELECT", "WITH", "INSERT", "UPDATE", "DELETE"):
+            plan = tuple(book.explain(statement))
+            if plan:
+                plans.add(plan)
+    return [list(plan) for plan in sorted(plans)]
+
+
+def scans(plans):
+    return {step.strip() for plan in plans for step in plan
+            if step.strip().startswith("SCAN ")}
+
+
+@pytest.fixture(scope="module")
+def book():
+    return synthetic_book(SIZE, "sqlite")
+
+
+@pytest.fixture(scope="module")
+def rows(book):
+    return book.fetch_contacts(1000)
+
+
+@pytest.fixture(scope="module")
+def baselines(request):
+    stored = json.loads(BASELINES.read_text()) if BASELINES.exists() \
+        else {"size": SIZE, "timings": {}, "plans": {}}
+    yield stored
+    if request.config.getoption("--update-baselines"):
+        ordered = {"size": SIZE, "calibration": stored.get("calibration"),
+                   "timings": stored["timings"], "plans": stored["plans"]}
+        BASELINES.write_text(json.dumps(ordered, indent=2) + "\n")
+
+
+def test_query_plans(request, book, rows, baselines):
+    update = request.config.getoption("--update-baselines")
+    failures = []
+    for name, operation in OPERATIONS.items():
+        plans = query_plans(book, lambda: operation(book, rows))
+        if update:
+            baselines["plans"][name] = plans
+            continue
+        new_scans = scans(plans) - scans(baselines["plans"][name])
+        if new_scans:
+            failures.append(f"{name} now runs {', '.join(sorted(new_scans))}"
+                            f", its plans are:\n" + "\n".join(
+                                "\n".join(plan) for plan in plans))
+    assert not failures, "\n\n".join(failures)
+
+
+def test_timings(request, book, rows, baselines):
+    update = request.config.getoption("--update-baselines")
+    if not (update or request.config.getoption("--perf")):
+        pytest.skip("Timings are only checked with --perf")
+    tolerance = request.config.getoption("--perf-tolerance")
+
+    machine = calibration()
+    timings = {name: best_of(lambda: operation(book, rows))
+               for name, operation in OPERATIONS.items()}
+    if update:
+        baselines["calibration"] = round(machine, 6)
+        baselines["timings"] = {name: round(elapsed, 6)
+                                for name, elapsed in timings.items()}
+        return
+
+    scale = machine / baselines["calibration"]
+    failures = []
+    for name, elapsed in timings.items():
+        limit = baselines["timings"][name] * scale * (1 + tolerance)
+        if elapsed > limit:
+            failures.append(f"{name}: {elapsed * 1000:.3f} ms, limit"
+                            f" {limit * 1000:.3f} ms")
+    assert not failures, "Slower than the baselines:\n" + "\n".join(failures)
@@ -0,0 +1,125 @@
+import datetime
+
+import pytest
+
+from .context import cbook
+from datamanager import DataManager
+from memory_backend import MemoryBackend
+import query
+from query import And, Not, Or, Term
+
+
+@pytest.fixture
+def book(dummy_contacts):
+    book = DataManager(":memory:")
+    for contact in dummy_contacts:
+        book.create_contact(contact)
+    book.create_contact(dummy_contacts[0]._replace(
+        db_id=31, first_name="Raj", last_name=None, phone_personal="+1 555",
+        phone_work=None, phone_home=None, email=None, address="50% off",
+        date_added=datetime.datetime(2023, 2, 1)))
+    book.create_group("Work")
+    for cid in (1, 15, 31):
+        book.add_contacts_to_group(1, cid)
+    return book
+
+
+def ids(book, text):
+    return sorted(c.db_id for c in query.search(book, text))
+
+
+def test_parse():
+    assert query.parse("name:raj group:Work added>2023-01 -email:null") == \
+        And((Term("name", ":", "raj"), Term("group", ":", "Work"),
+             Term("added", ">", "2023-01"), Not(Term("email", "=", None))))
+    assert query.parse('raj OR -(last="Kumar" address:x)') == Or((
+        Term("name", ":", "raj"),
+        Not(And((Term("last", "=", "Kumar"), Term("address", ":", "x"))))))
+    for invalid in ("name:", "nick:raj", "(raj", "raj)", "OR raj",
+                    "phone:null", "email>x"):
+        with pytest.raises(ValueError):
+            query.parse(invalid)
+
+
+def test_search(book):
+    assert ids(book, "raj") == [15, 16, 17, 18, 27, 28, 29, 30, 31]
+    assert ids(book, "name:raj group:Work") == [15, 31]
+    assert ids(book, "group:Work -email:null") == [1]
+    assert ids(book, "group:Work added>=2023") == [31]
+    assert ids(book, "added:2022-10-23") == list(range(1, 31))
+    assert ids(book, "added<2022-10") == []
+    assert ids(book, "first=raj") == [31]
+    assert ids(book, "last:kum*") == [1, 4, 7, 11, 15, 19, 23, 27]
+    # Missing last names don't make negated terms unknown
+    assert ids(book, "first:ra* -last:kumar") == [16, 17, 18, 28, 29, 30, 31]
+    assert ids(book, "riya OR neha -last:gupta") == [
+        11, 13, 14, 23, 24, 25, 26]
+    assert ids(book, "phone:+63-3347347957") == [1]
+    assert ids(book, "phone:1555*") == [31]
+    assert ids(book, "phone=1555") == [31]
+    # LIKE wildcards are matched literally
+    assert ids(book, 'address:"0%"') == [31]
+    assert ids(book, "address:_") == []
+    with pytest.raises(ValueError):
+        query.search(book, "added:23")
+    with pytest.raises(ValueError):
+        query.search(MemoryBackend(), "raj")
+
+
+def test_explain(book):
+    assert query.scans(query.explain(book, "raj"))
+    for indexed in ("first:raj*", "phone=1555", "added:2023",
+                    "group:Work raj"):
+        assert not query.scans(query.explain(book, indexed)), indexed
+
+
+def test_batch_update(book):
+    assert query.update(book, "group:Work", "address", "Office",
+                        dry_run=True) == 3
+    assert ids(book, "address=Office") == []
+    assert query.update(book, "group:Work", "address", "Office") == 3
+    # Contacts which already have the value aren't changed again
+    assert query.update(book, "group:Work", "address", "Office") == 0
+    assert ids(book, "address=Office") == [1, 15, 31]
+
+    assert query.update(book, "first=raj", "first_name", "Rajesh") == 1
+    assert ids(book, "first:rajesh*") == [31]
+    assert query.update(book, "group:Work", "email", None) == 1
+    assert ids(book, "group:Work email:null") == [1, 15, 31]
+    for field, value in (("phone_personal", "1"), ("first_name", None)):
+        with pytest.raises(ValueError):
+            query.update(book, "raj", field, value)
+
+
+def test_add_country_code(book, dummy_contacts):
+    now = datetime.datetime(2023, 3, 1)
+    for cid, number in ((32, "98765-43210"), (33, "+91 98765 43210"),
+                        (34, "22 2345 6789")):
+        book.create_contact(dummy_contacts[0]._replace(
+            db_id=cid, phone_personal=number, phone_work=None,
+            phone_home=None, date_added=now))
+    version = book.change_version()
+
+    # 98765-43210 would clash with the number of contact 33
+    assert query.add_country_code(book, "added>=2023", "+91",
+                                  dry_run=True) == 1
+    assert query.add_country_code(book, "added>=2023", "91") == 1
+    assert query.add_country_code(book, "added>=2023", "91") == 0
+    assert book.fetch_by_exact_phone("+91 22 2345 6789")[0].phone_personal \
+        == "+91-22 2345 6789"
+    # Too short to be missing just the country code
+    assert book.fetch_by_exact_phone("1555")[0].db_id == 31
+    assert book.fetch_by_exact_phone("9876543210")[0].db_id == 32
+    assert book.check_counters() == []
+    assert [(c.op, c.key["number_key"]) for c in book.iter_changes(version)
+            if c.table == "Phones"] == [("delete", "2223456789"),
+                                        ("insert", "912223456789")]
+    with pytest.raises(ValueError):
+        query.add_country_code(book, "raj", "0")
+
+
+def test_delete(book):
+    assert query.delete(book, "group:Work", dry_run=True) == 3
+    assert query.delete(book, "group:Work") == 3
+    assert ids(book, "raj") == [16, 17, 18, 27, 28, 29, 30]
+    assert book.get_group_size(1) == 0
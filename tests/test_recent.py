@@ -0,0 +1,67 @@
+import datetime
+
+import pytest
+
+from .context import cbook
+from datamanager import ACCESS_HALF_LIFE, DataManager
+from memory_backend import MemoryBackend
+from recent import RecentContacts
+from replay import Action, replay
+
+
+@pytest.fixture(params=[DataManager, MemoryBackend])
+def backend(request, dummy_contacts):
+    backend = request.param() if request.param is MemoryBackend \
+        else request.param(":memory:")
+    for contact in dummy_contacts:
+        backend.create_contact(contact)
+    return backend
+
+
+def test_frecency_rank(backend):
+    now = datetime.datetime.now()
+    # Three accesses two half lives ago are worth 3/4 of an access now
+    for _ in range(3):
+        backend.record_access(1, now - 2 * ACCESS_HALF_LIFE)
+    backend.record_access(2, now)
+    # ... and less than three accesses a half life ago
+    for _ in range(3):
+        backend.record_access(3, now - ACCESS_HALF_LIFE)
+    assert [c.db_id for _, c in backend.iter_frecent(5)] == [3, 2, 1]
+    assert [c.db_id for _, c in backend.iter_frecent(1)] == [3]
+    assert backend.record_access(99) is None
+
+
+def test_recent_contacts(backend, dummy_contacts):
+    recent = RecentContacts(backend, size=3)
+    assert recent.contacts() == []
+    for cid in (5, 6, 7, 8, 5):
+        recent.touch(dummy_contacts[cid - 1])
+    assert [c.db_id for c in recent.contacts()] == [5, 8, 7]
+    # Kept in memory in the same order as the book ranks them
+    assert recent.contacts() == RecentContacts(backend, size=3).contacts()
+
+    renamed = dummy_contacts[7]._replace(first_name="Ravi")
+    backend.update_contact(renamed)
+    recent.replace(dummy_contacts[7], renamed)
+    assert recent.contacts()[1].first_name == "Ravi"
+
+    backend.delete_contact(dummy_contacts[4])
+    recent.remove(dummy_contacts[4])
+    assert [c.db_id for c in recent.contacts()] == [8, 7, 6]
+
+
+def test_single_recent_contact_index_checked(dummy_contacts):
+    book = MemoryBackend()
+    for contact in dummy_contacts[:5]:
+        book.create_contact(contact)
+    name = f"{dummy_contacts[1].first_name} {dummy_contacts[1].last_name}"
+    actions = [Action("View a contact's info", [name, "0"]),
+               # Out of range indices of the only recent contact are asked
+               # again
+               Action("View a contact's info", ["3", "-1", "0"])]
+    first, second = replay(actions, book)
+    assert "Recent contacts" in second.output
+    assert "Maximum: 0" in second.output and "Minimum: 0" in second.output
+    assert second.prompts.count(second.prompts[0]) == 3
+    assert dummy_contacts[1].phone_personal in second.output
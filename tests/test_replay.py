@@ -0,0 +1,73 @@
+import builtins
+
+import pytest
+
+from .context import cbook
+from replay import (
+    DEFAULT_SCRIPT, Action, ScriptError, ScriptRecorder, load_script,
+    load_test, parse_script, replay, synthetic_book)
+
+
+def test_parse_script():
+    script = "# A comment\n> Create group\n\\> not an option\n\n" \
+             "> Show groups\n"
+    assert parse_script(script) == [
+        Action("Create group", ["> not an option", ""]),
+        Action("Show groups", [])]
+    with pytest.raises(ScriptError):
+        parse_script("raj\n> Search contacts by name\n")
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "memory"])
+def test_replay_default_script(backend):
+    book = synthetic_book(200, backend)
+    assert book.get_contact_count() == 200
+    results = replay(parse_script(DEFAULT_SCRIPT), book)
+
+    by_option = {result.option: result for result in results}
+    assert len(by_option) == len(results) == 8
+    assert "Found 20 contacts" in by_option["Search contacts by name"].output
+    assert by_option["View a contact's info"].prompts == [
+        "Enter the name (<Tab> to complete): ", "Enter the index: "]
+    assert "Contact created successfully" in \
+        by_option["Create new contact"].output
+    assert book.get_contact_count() == 201
+    if backend == "memory":
+        assert "only supported by the SQLite backend" in \
+            by_option["Filter contacts by several fields"].output
+    assert all(result.elapsed > 0 for result in results)
+
+
+def test_replay_script_errors():
+    book = synthetic_book(200)
+    with pytest.raises(ScriptError, match="No answer left"):
+        replay([Action("Search contacts by name", [])], book)
+    with pytest.raises(ScriptError, match="1 answers left unread"):
+        replay([Action("Show groups", ["extra"])], book)
+    with pytest.raises(ScriptError, match="Unknown option"):
+        replay([Action("Fly to the moon", [])], book)
+
+
+def test_load_test():
+    script = "> Search contacts by name\nkavya\n> Create new contact\n" \
+             "Replay\n\n+919999999999\n\n\n\n\n"
+    results = load_test(parse_script(script), [100, 300], "sqlite", repeat=2)
+    for size, stats in results.items():
+        rows = dict(stats.rows())
+        assert rows["option:Search contacts by name"]["count"] == 2
+        assert rows["option:Create new contact"]["count"] == 2
+
+
+def test_record_and_replay(tmp_path, monkeypatch):
+    answers = iter(["# not a comment", "aarav"])
+    monkeypatch.setattr(builtins, "input", lambda prompt="": next(answers))
+    path = tmp_path / "session.txt"
+    recorder = ScriptRecorder(path)
+    with recorder.action("Search contacts by name"):
+        assert input() == "# not a comment"
+        assert input() == "aarav"
+    with recorder.action("Show groups"):
+        pass
+    assert load_script(path) == [
+        Action("Search contacts by name", ["# not a comment", "aarav"]),
+        Action("Show groups", [])]
@@ -0,0 +1,48 @@
+import signal
+import time
+
+import pytest
+
+from .context import cbook
+from cbook.sampler import SAMPLE_ENV, sampling, settings
+
+pytestmark = pytest.mark.skipif(not hasattr(signal, "setitimer"),
+                                reason="Needs signal.setitimer")
+
+
+def busy_loop(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+
+
+def test_sampling(tmp_path):
+    path = tmp_path / "session.folded"
+    with sampling(path, interval=0.001) as sampler:
+        busy_loop(0.2)
+    # The timer and the handler are removed afterwards
+    assert signal.getitimer(signal.ITIMER_PROF) == (0.0, 0.0)
+    assert signal.getsignal(signal.SIGPROF) in (signal.SIG_DFL, None)
+
+    lines = path.read_text().splitlines()
+    assert lines == sampler.collapsed()
+    stack, count = lines[0].rsplit(" ", 1)
+    frames = stack.split(";")
+    assert frames[-1] == "tests.test_sampler:busy_loop"
+    assert frames[-2] == "tests.test_sampler:test_sampling"
+    assert int(count) > 50
+    assert sampler.samples >= int(count)
+
+
+def test_sampling_off():
+    with sampling(None) as sampler:
+        assert sampler is None
+    assert signal.getsignal(signal.SIGPROF) in (signal.SIG_DFL, None)
+
+
+def test_settings(monkeypatch):
+    monkeypatch.delenv(SAMPLE_ENV, raising=False)
+    assert settings() == (None, 0.005)
+    assert settings("out.folded", 2) == ("out.folded", 0.002)
+    monkeypatch.setenv(SAMPLE_ENV, "env.folded")
+    assert settings() == ("env.folded", 0.005)
@@ -0,0 +1,52 @@
+import pytest
+
+from .context import cbook
+from cbook.datamanager import DataManager
+from cbook.snapshot import SnapshotReader, compile_snapshot
+
+
+@pytest.fixture
+def book(tmp_path, dummy_contacts):
+    mgr = DataManager(tmp_path / "book.sqlite")
+    for contact in dummy_contacts:
+        assert mgr.create_contact(contact)
+    assert mgr.add_phone_number(3, "+911234567890")
+    return mgr
+
+
+@pytest.fixture
+def reader(tmp_path, book):
+    path = tmp_path / "book.snap"
+    assert compile_snapshot(book, path) == 30
+    with SnapshotReader(path) as reader:
+        yield reader
+
+
+def test_fetch_contacts(book, reader):
+    assert reader.get_contact_count() == 30
+    assert reader.fetch_contacts() == book.fetch_contacts()
+    assert reader.fetch_contacts(100) == book.fetch_contacts(100)
+
+
+def test_fetch_by_phone_no(book, reader):
+    for phone in ("+741923905397", "+80-8831891248", "81999863748",
+                  "192390", "+911234567890", "000"):
+        assert reader.fetch_by_phone_no(phone) == book.fetch_by_phone_no(phone)
+
+
+def test_fetch_by_name(book, reader):
+    assert reader.fetch_by_name("Neha") == book.fetch_by_name("Neha")
+    assert reader.fetch_by_name("kumari") == book.fetch_by_name("Kumari")
+    # Any part of the first or last name matches
+    for name in ("ra", "shar", "shman", "ARM", "a", "", "Reshma", "adf"):
+        assert reader.fetch_by_name(name) == book.fetch_by_name(name), name
+    assert [c.db_id for c in reader.fetch_by_name("shman")] == [2, 1, 3]
+    # Emails and other strings of the pool aren't names
+    assert reader.fetch_by_name("adf") == []
+
+
+def test_invalid_snapshot(tmp_path):
+    path = tmp_path / "junk.snap"
+    path.write_bytes(b"\0" * 100)
+    with pytest.raises(ValueError):
+        SnapshotReader(path)
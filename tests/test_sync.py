@@ -0,0 +1,132 @@
+import datetime
+import shutil
+import sqlite3
+
+import pytest
+
+from .context import cbook
+from cbook import sync
+from cbook.datamanager import Contact, DataManager
+
+
+@pytest.fixture
+def books(tmp_path, dummy_contacts):
+    paths = (tmp_path / "local.sqlite", tmp_path / "remote.sqlite")
+    mgr = DataManager(paths[0])
+    with mgr.transaction():
+        for contact in dummy_contacts:
+            assert mgr.create_contact(contact)
+    mgr.commit()
+    del mgr
+    # Copies of the same book
+    shutil.copy(*paths)
+    return paths
+
+
+def snapshot(path):
+    mgr = DataManager(path)
+    return [(contact, mgr.fetch_phone_numbers(contact.db_id))
+            for contact in mgr.fetch_contacts(1000)]
+
+
+def test_sync_both_ways(books, dummy_contacts, monkeypatch):
+    local_path, remote_path = books
+    monkeypatch.setattr(sync, "LEAF_SIZE", 2)
+    monkeypatch.setattr(sync, "FANOUT", 2)
+    assert sync.sync_books(local_path, remote_path).differing == 0
+
+    local, remote = DataManager(local_path), DataManager(remote_path)
+    local.update_contact(dummy_contacts[0]._replace(email="new@local.in"))
+    remote.update_contact(dummy_contacts[1]._replace(email="new@remote.in"))
+    remote.delete_contact(dummy_contacts[2])
+    local.create_contact(Contact(31, "Rahul", "Verma",
+                                 datetime.datetime.now(), "+91-2188195975"))
+    # Edited on both sides, the later edit wins
+    local.update_contact(dummy_contacts[4]._replace(address="Local"))
+    remote.update_contact(dummy_contacts[4]._replace(address="Remote"))
+    remote.add_phone_number(7, "+91 11 2345 6789", "fax")
+    local.commit()
+    remote.commit()
+    del local, remote
+
+    result = sync.sync_books(local_path, remote_path, dry_run=True)
+    assert (result.to_local, result.to_remote) == (4, 2)
+    assert snapshot(local_path) != snapshot(remote_path)
+
+    result = sync.sync_books(local_path, remote_path)
+    assert (result.to_local, result.to_remote) == (4, 2)
+    assert snapshot(local_path) == snapshot(remote_path)
+
+    local = DataManager(local_path)
+    assert local.fetch_by_name("Verma")[0].phone_personal == "+91-2188195975"
+    assert local.fetch_by_name("Yadav")[0].db_id != 3
+    assert local.fetch_by_exact_phone("+633347347957")[0].email == \
+        "new@local.in"
+    assert [c.address for c in local.fetch_by_name("Sharma")
+            if c.db_id == 5] == ["Remote"]
+    assert ("fax", "+91 11 2345 6789") in local.fetch_phone_numbers(7)
+    assert local.check_counters() == []
+    assert DataManager(remote_path).check_counters() == []
+
+    assert sync.sync_books(local_path, remote_path).differing == 0
+
+
+def test_sync_deletion_loses_to_later_edit(books, dummy_contacts):
+    local_path, remote_path = books
+    sync.sync_books(local_path, remote_path)
+    DataManager(local_path).delete_contact(dummy_contacts[0])
+    DataManager(remote_path).update_contact(
+        dummy_contacts[0]._replace(email="still@here.in"))
+
+    sync.sync_books(local_path, remote_path)
+    assert DataManager(local_path).fetch_by_exact_phone(
+        "+633347347957")[0].email == "still@here.in"
+    assert snapshot(local_path) == snapshot(remote_path)
+
+
+def test_sync_contacts_created_in_both_books(books, monkeypatch):
+    local_path, remote_path = books
+    monkeypatch.setattr(sync, "LEAF_SIZE", 2)
+    monkeypatch.setattr(sync, "FANOUT", 2)
+    local, remote = DataManager(local_path), DataManager(remote_path)
+    alice = Contact(local.get_new_id(), "Alice", "Local",
+                    datetime.datetime.now(), "+91-1111111111")
+    bob = Contact(remote.get_new_id(), "Bob", "Remote",
+                  datetime.datetime.now(), "+91-2222222222")
+    assert alice.db_id == bob.db_id == 31
+    assert local.create_contact(alice) and remote.create_contact(bob)
+    remote.create_group("Work")
+    assert remote.add_contacts_to_group(1, 31)
+    # A contact created and deleted in one book while the other book
+    # created a different one under the same id
+    carol = Contact(32, "Carol", "Local", datetime.datetime.now(),
+                    "+91-3333333333")
+    dave = Contact(32, "Dave", "Remote", datetime.datetime.now(),
+                   "+91-4444444444")
+    assert remote.create_contact(dave)
+    assert local.create_contact(carol)
+    local.delete_contact(carol)
+    local.commit()
+    remote.commit()
+    del local, remote
+
+    result = sync.sync_books(local_path, remote_path)
+    assert result.rekeyed == 2
+    assert snapshot(local_path) == snapshot(remote_path)
+    local = DataManager(local_path)
+    assert [c.first_name for c in local.fetch_by_name("Local")] == ["Alice"]
+    assert [c.first_name for c in local.fetch_by_name("Remote")] == [
+        "Bob", "Dave"]
+    assert local.get_contact(31).first_name == "Alice"
+    assert local.fetch_by_exact_phone("+91-2222222222")[0].db_id > 32
+    assert local.check_counters() == []
+    remote = DataManager(remote_path)
+    assert remote.check_counters() == []
+    # Bob was moved to a new id in his book, along with his groups
+    assert [c.first_name for c in remote.get_contacts_from_group(1)] == [
+        "Bob"]
+    conn = sqlite3.connect(remote_path)
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+    conn.close()
+
+    assert sync.sync_books(local_path, remote_path).differing == 0
@@ -0,0 +1,26 @@
+import sqlite3
+
+from .context import cbook
+from cbook.datamanager import DataManager
+from cbook.tuning import _copy_book, benchmark_profile
+
+
+def test_copy_book_page_size(tmp_path, dummy_contacts):
+    source = tmp_path / "book.sqlite"
+    mgr = DataManager(source, settings={"journal_mode": "wal"})
+    for contact in dummy_contacts:
+        assert mgr.create_contact(contact)
+    mgr.commit()
+
+    copy = tmp_path / "copy.sqlite"
+    _copy_book(source, copy, 16384)
+    conn = sqlite3.connect(copy)
+    assert conn.execute("PRAGMA page_size").fetchone() == (16384,)
+    assert conn.execute("SELECT COUNT(*) FROM Contacts").fetchone() == (30,)
+    conn.close()
+    assert DataManager(copy).fetch_by_name("Neha") \
+        == mgr.fetch_by_name("Neha")
+
+    timings = benchmark_profile(source, "bulk", lookups=5, inserts=10)
+    assert set(timings) == {"open", "list all", "search by name",
+                            "exact phone lookup", "bulk insert"}